@@ -0,0 +1,96 @@
+"""partition logs by month
+
+Revision ID: 3f1c2a7b9d10
+Revises: 55dd54a938c9
+Create Date: 2026-10-17 10:12:31.482113
+
+The logs table is converted into a table that is partitioned by month on timestamp.
+Partitions are named logs_YYYY_MM, rows outside any partition are stored in logs_default.
+
+The create_log_partition(month) function creates the partition for the given month.
+It is used by the workflow manager to create the partitions for the upcoming months.
+
+The primary key of a partitioned table has to include the partition key,
+the primary key is (logid, timestamp). Logid remains unique because it is served by a sequence.
+The ix_logs_logid and ix_logs_logid_desc indexes are covered by the primary key and are not recreated.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a7b9d10'
+down_revision = '55dd54a938c9'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = ['application', 'catalogue', 'destination', 'entity', 'process_id', 'source', 'jobid', 'stepid', 'timestamp']
+
+
+def _create_indexes():
+    for column in INDEXES:
+        op.create_index(op.f(f'ix_logs_{column}'), 'logs', [column], unique=False)
+    op.create_foreign_key('logs_jobid_fkey', 'logs', 'jobs', ['jobid'], ['id'])
+    op.create_foreign_key('logs_stepid_fkey', 'logs', 'jobsteps', ['stepid'], ['id'])
+
+
+def upgrade():
+    create_log_partition = """
+create or replace function create_log_partition(_month date) returns void
+    language plpgsql
+as $$
+DECLARE
+    _start date := date_trunc('month', _month);
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)',
+        'logs_' || to_char(_start, 'YYYY_MM'), _start, _start + interval '1 month'
+    );
+END;
+$$;
+"""
+    op.execute("ALTER TABLE logs RENAME TO logs_unpartitioned")
+    op.execute("UPDATE logs_unpartitioned SET timestamp = '1970-01-01' WHERE timestamp IS NULL")
+    op.execute("""
+CREATE TABLE logs (LIKE logs_unpartitioned INCLUDING DEFAULTS)
+PARTITION BY RANGE (timestamp)
+""")
+    op.execute("ALTER TABLE logs ALTER COLUMN timestamp SET NOT NULL")
+    op.execute("CREATE TABLE logs_default PARTITION OF logs DEFAULT")
+    op.execute(create_log_partition)
+
+    # Create partitions for all months with logs and the upcoming months
+    op.execute("""
+SELECT create_log_partition(month::date)
+FROM   generate_series(
+           (SELECT date_trunc('month', coalesce(min(timestamp), now())) FROM logs_unpartitioned
+            WHERE  timestamp > '1970-01-01'),
+           date_trunc('month', now()) + interval '2 months',
+           interval '1 month') AS month
+""")
+    op.execute("INSERT INTO logs SELECT * FROM logs_unpartitioned")
+
+    # Keep the logid sequence when the unpartitioned table is dropped
+    op.execute("ALTER SEQUENCE logs_logid_seq OWNED BY logs.logid")
+    op.drop_table('logs_unpartitioned')
+
+    op.create_primary_key('logs_pkey', 'logs', ['logid', 'timestamp'])
+    _create_indexes()
+
+
+def downgrade():
+    op.execute("ALTER TABLE logs RENAME TO logs_partitioned")
+    op.execute("CREATE TABLE logs (LIKE logs_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE logs ALTER COLUMN timestamp DROP NOT NULL")
+    op.execute("INSERT INTO logs SELECT * FROM logs_partitioned")
+
+    op.execute("ALTER SEQUENCE logs_logid_seq OWNED BY logs.logid")
+    op.drop_table('logs_partitioned')
+    op.execute("DROP FUNCTION create_log_partition(date)")
+
+    op.create_primary_key('logs_pkey', 'logs', ['logid'])
+    _create_indexes()
+    op.create_index(op.f('ix_logs_logid'), 'logs', ['logid'], unique=False)
+    op.create_index('ix_logs_logid_desc', 'logs', [sa.text('logid DESC')], unique=False)
@@ -0,0 +1,65 @@
+"""move default logs to partition
+
+Revision ID: b4e1d7a2c9f3
+Revises: f7c3a9d1e8b6
+Create Date: 2026-10-17 18:24:51.093716
+
+Logs for a month without a partition are stored in logs_default.
+Creating the partition for that month failed because the rows in logs_default violate the new partition.
+
+The create_log_partition(month) function now creates the partition as a separate table,
+moves the rows of the month from logs_default to the table and then attaches the table as partition of logs.
+logs_default is locked while the rows are moved so that no new rows for the month can be stored in the meantime.
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e1d7a2c9f3'
+down_revision = 'f7c3a9d1e8b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+create or replace function create_log_partition(_month date) returns void
+    language plpgsql
+as $$
+DECLARE
+    _start date := date_trunc('month', _month);
+    _end date := date_trunc('month', _month) + interval '1 month';
+    _partition text := 'logs_' || to_char(_month, 'YYYY_MM');
+BEGIN
+    IF to_regclass(_partition) IS NOT NULL THEN
+        RETURN;
+    END IF;
+    LOCK TABLE logs_default IN SHARE ROW EXCLUSIVE MODE;
+    EXECUTE format('CREATE TABLE %I (LIKE logs INCLUDING DEFAULTS)', _partition);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM logs_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        _start, _end, _partition
+    );
+    EXECUTE format('ALTER TABLE logs ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', _partition, _start, _end);
+END;
+$$;
+""")
+
+
+def downgrade():
+    op.execute("""
+create or replace function create_log_partition(_month date) returns void
+    language plpgsql
+as $$
+DECLARE
+    _start date := date_trunc('month', _month);
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)',
+        'logs_' || to_char(_start, 'YYYY_MM'), _start, _start + interval '1 month'
+    );
+END;
+$$;
+""")
@@ -0,0 +1,39 @@
+"""jobs fingerprint
+
+Revision ID: f7c3a9d1e8b6
+Revises: e5b8d2c6a4f0
+Create Date: 2026-10-17 16:12:08.731952
+
+The fingerprint of a job is the hash of its type and model (catalogue, collection, attribute and application).
+Running jobs with the same fingerprint are possible duplicates.
+The fingerprint is generated by the database, adding the column computes the fingerprint of all existing jobs.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7c3a9d1e8b6'
+down_revision = 'e5b8d2c6a4f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+ALTER TABLE jobs ADD COLUMN fingerprint VARCHAR GENERATED ALWAYS AS (md5(
+    coalesce(type, '') ||
+    coalesce(':' || catalogue, '') ||
+    coalesce(':' || collection, '') ||
+    coalesce(':' || attribute, '') ||
+    coalesce(':' || application, '')
+)) STORED
+""")
+    op.create_index('ix_jobs_running_fingerprint', 'jobs', ['fingerprint'], unique=False,
+                    postgresql_where=sa.text('"end" IS NULL'))
+
+
+def downgrade():
+    op.drop_index('ix_jobs_running_fingerprint', table_name='jobs')
+    op.drop_column('jobs', 'fingerprint')
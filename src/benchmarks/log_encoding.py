@@ -0,0 +1,80 @@
+"""Log encoding micro-benchmark
+
+Compares the CPU cost per log message of:
+- the former save_log record construction: strptime, json.dumps with GobTypeJSONEncoder and a mapped Log instance
+- the current log_record construction and its COPY encoding
+
+No database is required:
+
+    python -m benchmarks.log_encoding [--messages MESSAGES]
+"""
+import argparse
+import datetime
+import json
+import timeit
+
+from gobcore.model.sa.management import Log
+from gobcore.typesystem.json import GobTypeJSONEncoder
+
+from gobworkflow.logs import log_record
+from gobworkflow.storage.storage import _copy_value
+
+MSG = {
+    "timestamp": "2020-06-20T12:20:20.123456",
+    "process_id": "1592655620.import.gebieden.stadsdelen",
+    "source": "AMSBI",
+    "application": "DGDialog",
+    "destination": "Database",
+    "catalogue": "gebieden",
+    "entity": "stadsdelen",
+    "level": "WARNING",
+    "name": "IMPORT",
+    "id": 12345,
+    "msg": "Value should not be empty",
+    "jobid": 1234,
+    "stepid": 5678,
+    "data": {"id": "03630000000018", "attribute": "naam", "value": None},
+}
+
+
+def former_log_record(msg):
+    json_data = json.dumps(msg.get("data", None), cls=GobTypeJSONEncoder)
+    return Log(
+        timestamp=datetime.datetime.strptime(msg["timestamp"], "%Y-%m-%dT%H:%M:%S.%f"),
+        process_id=msg.get("process_id", None),
+        source=msg.get("source", None),
+        application=msg.get("application", None),
+        destination=msg.get("destination", None),
+        catalogue=msg.get("catalogue", None),
+        entity=msg.get("entity", None),
+        level=msg.get("level", None),
+        name=msg.get("name", None),
+        msgid=msg.get("id", None),
+        msg=msg.get("msg", None),
+        jobid=msg.get("jobid", None),
+        stepid=msg.get("stepid", None),
+        data=json_data,
+    )
+
+
+def current_log_record(msg):
+    record = list(log_record(msg))
+    record[-1] = json.dumps(record[-1])
+    return "\t".join([_copy_value(value) for value in record])
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.log_encoding", description="Log encoding benchmark")
+    parser.add_argument("--messages", type=int, default=100000, help="number of log messages")
+    args = parser.parse_args()
+
+    results = {}
+    for name, func in [("former", former_log_record), ("current", current_log_record)]:
+        duration = min(timeit.repeat(lambda: func(MSG), number=args.messages, repeat=3))
+        results[name] = duration / args.messages * 1e6
+        print(f"{name:10s}{results[name]:8.2f} us/message")
+    print(f"Speedup {results['former'] / results['current']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Log ingestion benchmark
+
+Compares the number of log rows per second that are written by:
+- one insert and one commit per log message (the former save_log)
+- bulk loading batches of log messages (save_logs)
+
+Requires a management database, the database settings are taken from gobworkflow.config:
+
+    python -m benchmarks.log_ingestion [--rows ROWS] [--batch-size BATCH_SIZE]
+
+The benchmark creates a job and removes the job and its logs when it has finished.
+"""
+import argparse
+import datetime
+import time
+
+from gobcore.model.sa.management import Job, Log
+
+from gobworkflow.logs import log_record
+from gobworkflow.storage import storage
+
+
+def _messages(jobid, rows):
+    timestamp = datetime.datetime.utcnow().isoformat(timespec="microseconds")
+    return [
+        {
+            "timestamp": timestamp,
+            "process_id": "benchmark",
+            "source": "benchmark",
+            "level": "INFO",
+            "name": "BENCHMARK",
+            "id": i,
+            "msg": f"Benchmark message {i}",
+            "jobid": jobid,
+            "data": {"row": i},
+        }
+        for i in range(rows)
+    ]
+
+
+def per_message_commit(messages):
+    for msg in messages:
+        storage.session.add(Log(**dict(zip(storage.LOG_FIELDS, log_record(msg)))))
+        storage.session.commit()
+
+
+def bulk_load(messages, batch_size):
+    records = [log_record(msg) for msg in messages]
+    for i in range(0, len(records), batch_size):
+        storage.save_logs(records[i : i + batch_size])
+
+
+def _measure(name, func, rows):
+    start = time.perf_counter()
+    func()
+    duration = time.perf_counter() - start
+    print(f"{name:24s}{rows:10d} rows {duration:10.2f} s {rows / duration:12.0f} rows/s")
+    return duration
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.log_ingestion", description="Log ingestion benchmark")
+    parser.add_argument("--rows", type=int, default=10000, help="number of log messages")
+    parser.add_argument("--batch-size", type=int, default=500, help="number of log messages per bulk load")
+    args = parser.parse_args()
+
+    if not storage.connect():
+        print("No database connection")
+        return
+
+    job = storage.job_save({"name": "benchmark", "type": "benchmark", "start": datetime.datetime.utcnow()})
+    try:
+        messages = _messages(job.id, args.rows)
+        before = _measure("per message commit", lambda: per_message_commit(messages), args.rows)
+        after = _measure("bulk load", lambda: bulk_load(messages, args.batch_size), args.rows)
+        print(f"Speedup {before / after:.1f}x")
+    finally:
+        storage.session.query(Log).filter(Log.jobid == job.id).delete()
+        storage.session.query(Job).filter(Job.id == job.id).delete()
+        storage.session.commit()
+        storage.disconnect()
+
+
+if __name__ == "__main__":
+    main()
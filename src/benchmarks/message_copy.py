@@ -0,0 +1,57 @@
+"""Message copy micro-benchmark
+
+Compares the cost of keeping the original message for a possible retry when a workflow is started:
+- the former deep copy of the message
+- the current copy of the message and its header (copy_message)
+
+The messages carry contents and summaries of the given size.
+No database is required:
+
+    python -m benchmarks.message_copy [--entities ENTITIES]
+"""
+import argparse
+import copy
+import timeit
+
+from gobworkflow.workflow.message import copy_message
+
+
+def _message(entities):
+    return {
+        "header": {
+            "catalogue": "gebieden",
+            "collection": "stadsdelen",
+            "application": "DGDialog",
+            "process_id": "1592655620.import.gebieden.stadsdelen",
+            "jobid": 1234,
+            "stepid": 5678,
+        },
+        "summary": {
+            "num_records": entities,
+            "warnings": [f"Value should not be empty for entity {i}" for i in range(entities // 10)],
+            "log_counts": {"warning": entities // 10},
+        },
+        "contents": [
+            {"identificatie": f"0363{i:010d}", "naam": f"Entity {i}", "ligt_in_gemeente": {"code": "0363"}}
+            for i in range(entities)
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.message_copy", description="Message copy benchmark")
+    parser.add_argument("--entities", type=int, default=10000, help="number of entities in the message contents")
+    args = parser.parse_args()
+
+    msg = _message(args.entities)
+    results = {}
+    for name, func in [("deepcopy", copy.deepcopy), ("copy_message", copy_message)]:
+        number = 10 if func is copy.deepcopy else 10000
+        duration = min(timeit.repeat(lambda: func(msg), number=number, repeat=3))
+        results[name] = duration / number * 1e6
+        print(f"{name:14s}{results[name]:12.2f} us/message")
+    print(f"Speedup {results['deepcopy'] / results['copy_message']:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
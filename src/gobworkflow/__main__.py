@@ -6,6 +6,14 @@ Log messages are simply printed (for now)
 Workflow messages consist of proposals. A proposal is evaluated (for now always OK) and then routed as a request
 to the service that can handle the proposal.
 
+Workflow messages are handled in one unit of work per message, the changes of a message are committed at once.
+Optionally the messages of the services of a role are handled by a pool of worker threads, see worker_pool.
+
+The services and scheduled tasks are grouped in roles. By default a workflow manager runs all roles.
+Roles can be run by separate workflow managers to scale them separately, eg:
+
+    python -m gobworkflow --roles logs,audit
+    python -m gobworkflow --roles heartbeat,workflow,tasks
 """
 import argparse
 
@@ -23,15 +31,53 @@ from gobcore.message_broker.config import (
 from gobcore.message_broker.messagedriven_service import messagedriven_service
 from gobcore.status.heartbeat import STATUS_FAIL, STATUS_OK
 
-from gobworkflow.config import LOG_HANDLERS, LOG_NAME
-from gobworkflow.heartbeats import on_heartbeat
-from gobworkflow.storage.storage import connect, get_job_step, save_audit_log, save_log
+from gobworkflow.config import (
+    DB_POOL_SIZE,
+    DB_POOL_SIZE_PER_ROLE,
+    HEARTBEAT_COALESCE_INTERVAL,
+    HEARTBEAT_FLUSH_INTERVAL,
+    LOG_HANDLERS,
+    LOG_NAME,
+    LOG_PARTITION_INTERVAL,
+    LOG_SUPPRESSION_INTERVAL,
+    PREFETCH_COUNT,
+    PREFETCH_COUNT_PER_ROLE,
+    PURGE_INTERVAL,
+    SERVICE_SWEEP_INTERVAL,
+    SPOOL_REPLAY_INTERVAL,
+    WORKER_QUEUE_SIZE,
+    WORKERS,
+    WORKERS_PER_ROLE,
+    ZOMBIE_SWEEP_INTERVAL,
+)
+from gobworkflow.heartbeats import (
+    apply_heartbeats,
+    check_services,
+    flush_heartbeat_timestamps,
+    forget_services,
+    on_heartbeat,
+)
+from gobworkflow.logs import (
+    audit_log_writer,
+    log_suppressed_summaries,
+    log_writer,
+    manage_log_partitions,
+    on_audit_log,
+    on_log,
+    replay_spools,
+)
+from gobworkflow.retention import purge, retention_rules
+from gobworkflow.scheduler import scheduler
+from gobworkflow.storage.storage import connect, get_job_step, in_unit_of_work
 from gobworkflow.task.queue import TaskQueue
+from gobworkflow.worker_pool import with_worker_pools
 from gobworkflow.workflow import hooks
 from gobworkflow.workflow.jobs import step_status
-from gobworkflow.workflow.workflow import Workflow
+from gobworkflow.workflow.workflow import Workflow, compile_workflows
+from gobworkflow.zombies import sweep_zombies
 
 
+@in_unit_of_work
 def handle_result(msg):
     """
     Handle the result of a message.
@@ -56,6 +102,7 @@ def handle_result(msg):
         Workflow(job.type, step.name, dynamic_workflow_steps=dynamic).handle_result()(msg)
 
 
+@in_unit_of_work
 def start_workflow(msg):
     """
     Start a workflow using the parameters that are contained in the message header
@@ -80,6 +127,7 @@ def start_workflow(msg):
         Workflow.end_of_workflow(msg)
 
 
+@in_unit_of_work
 def on_workflow_progress(msg):
     """
     Process a workflow progress message
@@ -99,15 +147,27 @@ def on_workflow_progress(msg):
     hooks.on_workflow_progress(msg)
 
 
+def report_failure(msg, error):
+    """
+    Report a message that could not be handled by a worker in the log of its job
+
+    :param msg: The message that could not be handled
+    :param error: The exception that has been raised by the handler
+    :return: None
+    """
+    with logger.configure_context(msg, LOG_NAME, LOG_HANDLERS):
+        logger.error(f"Message could not be handled: {str(error)}")
+
+
 task_queue = TaskQueue()
 
 SERVICEDEFINITION = {
     "step_completed": {"queue": JOBSTEP_RESULT_QUEUE, "handler": handle_result},
     "start_workflow": {"queue": WORKFLOW_QUEUE, "handler": start_workflow},
-    "save_logs": {"queue": LOG_QUEUE, "handler": save_log},
+    "save_logs": {"queue": LOG_QUEUE, "handler": on_log},
     "save_audit_logs": {
         "queue": AUDIT_LOG_QUEUE,
-        "handler": save_audit_log,
+        "handler": on_audit_log,
     },
     "heartbeat_monitor": {"queue": HEARTBEAT_QUEUE, "handler": on_heartbeat},
     "workflow_progress": {"queue": PROGRESS_QUEUE, "handler": on_workflow_progress},
@@ -118,16 +178,104 @@ SERVICEDEFINITION = {
     "task_completed": {"queue": TASK_RESULT_QUEUE, "handler": task_queue.on_task_result},
 }
 
+
+def start_logs_role():
+    """Start writing logs and the scheduled log tasks"""
+    log_writer.start()
+    scheduler.add("LogPartitions", LOG_PARTITION_INTERVAL, manage_log_partitions, leader_only=True, role="logs")
+    scheduler.add("LogSuppressionSummaries", LOG_SUPPRESSION_INTERVAL, log_suppressed_summaries)
+
+
+def start_audit_role():
+    """Start writing audit logs"""
+    audit_log_writer.start()
+
+
+def start_heartbeat_role():
+    """Start the scheduled heartbeat tasks"""
+    if HEARTBEAT_COALESCE_INTERVAL > 0:
+        scheduler.add("Heartbeats", HEARTBEAT_COALESCE_INTERVAL, apply_heartbeats)
+    scheduler.add("HeartbeatTimestamps", HEARTBEAT_FLUSH_INTERVAL, flush_heartbeat_timestamps)
+    scheduler.add("ServiceSweep", SERVICE_SWEEP_INTERVAL, check_services, leader_only=True, role="heartbeat")
+    scheduler.add("ForgetServices", SERVICE_SWEEP_INTERVAL, forget_services)
+
+
+def start_workflow_role():
+    """Compile the workflows and start the scheduled job tasks"""
+    compile_workflows()
+    scheduler.add("ZombieSweep", ZOMBIE_SWEEP_INTERVAL, sweep_zombies, leader_only=True, role="workflow")
+    if retention_rules():
+        scheduler.add("PurgeJobs", PURGE_INTERVAL, purge, leader_only=True, role="workflow")
+
+
+def start_tasks_role():
+    """Tasks have no writers or scheduled tasks"""
+
+
+# The services of every role and the function that starts the writers and scheduled tasks of the role
+ROLES = {
+    "logs": {"services": ["save_logs"], "start": start_logs_role},
+    "audit": {"services": ["save_audit_logs"], "start": start_audit_role},
+    "heartbeat": {"services": ["heartbeat_monitor"], "start": start_heartbeat_role},
+    "workflow": {"services": ["step_completed", "start_workflow", "workflow_progress"], "start": start_workflow_role},
+    "tasks": {"services": ["start_tasks", "task_completed"], "start": start_tasks_role},
+}
+
+
+def start_roles(roles):
+    """Start the writers and scheduled tasks of the given roles
+
+    :param roles: list of roles
+    :return: the service definitions of the roles
+    """
+    for role in roles:
+        ROLES[role]["start"]()
+    if "logs" in roles or "audit" in roles:
+        # Replays both the log and audit log spools
+        scheduler.add("ReplaySpools", SPOOL_REPLAY_INTERVAL, replay_spools)
+    scheduler.start()
+
+    return {service: SERVICEDEFINITION[service] for role in roles for service in ROLES[role]["services"]}
+
+
+def roles_argument(value):
+    """Parse a comma separated list of roles
+
+    :param value: eg "logs,audit"
+    :return: list of roles
+    """
+    roles = list(dict.fromkeys(role.strip() for role in value.split(",") if role.strip()))
+    unknown = [role for role in roles if role not in ROLES]
+    if unknown or not roles:
+        raise argparse.ArgumentTypeError(f"invalid roles '{value}', choose from {','.join(ROLES)}")
+    return roles
+
+
 parser = argparse.ArgumentParser(prog="python -m gobworkflow", description="GOB Workflow manager")
 
 parser.add_argument("--migrate", action="store_true", default=False, help="migrate the management database")
+parser.add_argument("--purge", action="store_true", default=False, help="purge jobs older than their retention period")
+parser.add_argument(
+    "--roles",
+    type=roles_argument,
+    default=list(ROLES),
+    help=f"comma separated roles to run, default all roles: {','.join(ROLES)}",
+)
 args = parser.parse_args()
 
 if args.migrate:
     print("Storage migration forced")
     connect(force_migrate=True)
-else:
+elif args.purge:
     connect()
+    purge()
+else:
+    connect(pool_size=max(DB_POOL_SIZE_PER_ROLE.get(role, DB_POOL_SIZE) for role in args.roles))
+
+    services = start_roles(args.roles)
+    pools = {role: (WORKERS_PER_ROLE.get(role, WORKERS), ROLES[role]["services"]) for role in args.roles}
+    services = with_worker_pools(services, pools, WORKER_QUEUE_SIZE, on_error=report_failure)
 
-    params = {"prefetch_count": 1, "load_message": False}
-    messagedriven_service(SERVICEDEFINITION, "Workflow", params)
+    prefetch_count = max(PREFETCH_COUNT_PER_ROLE.get(role, PREFETCH_COUNT) for role in args.roles)
+    params = {"prefetch_count": prefetch_count, "load_message": False}
+    messagedriven_service(services, "Workflow", params)
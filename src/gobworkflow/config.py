@@ -15,3 +15,94 @@ GOB_MGMT_DB = {
 }
 
 API_HOST = os.getenv("API_HOST", "http://localhost:8141")
+
+# Log messages are written in batches. A batch is written when it holds LOG_BATCH_SIZE rows
+# or when its oldest row has been waiting for LOG_BATCH_MAX_AGE seconds
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 500))
+LOG_BATCH_MAX_AGE = float(os.getenv("LOG_BATCH_MAX_AGE", 0.2))
+
+# Log and audit log batches are spooled in SPOOL_DIR when the management database is unreachable
+# A spool segment holds at most SPOOL_SEGMENT_ROWS rows, spooled rows are replayed every SPOOL_REPLAY_INTERVAL seconds
+SPOOL_DIR = os.getenv("SPOOL_DIR", "/tmp/gobworkflow/spool")
+SPOOL_SEGMENT_ROWS = int(os.getenv("SPOOL_SEGMENT_ROWS", 50000))
+SPOOL_REPLAY_INTERVAL = int(os.getenv("SPOOL_REPLAY_INTERVAL", 10))
+
+# Heartbeat timestamps of services are written in one batch every HEARTBEAT_FLUSH_INTERVAL seconds
+HEARTBEAT_FLUSH_INTERVAL = int(os.getenv("HEARTBEAT_FLUSH_INTERVAL", 10))
+# Heartbeats are coalesced, the newest heartbeat per service is applied every HEARTBEAT_COALESCE_INTERVAL seconds
+# 0 applies every heartbeat when it is received
+HEARTBEAT_COALESCE_INTERVAL = float(os.getenv("HEARTBEAT_COALESCE_INTERVAL", 1))
+# Services are checked for heartbeat timeout every SERVICE_SWEEP_INTERVAL seconds
+SERVICE_SWEEP_INTERVAL = int(os.getenv("SERVICE_SWEEP_INTERVAL", 60))
+
+# Number of unacknowledged messages the message broker delivers to the workflow manager
+# The prefetch count can be set per role, e.g. PREFETCH_COUNT_PER_ROLE="logs:1000,workflow:10"
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", 100))
+PREFETCH_COUNT_PER_ROLE = {
+    role: int(count)
+    for role, count in (item.split(":") for item in os.getenv("PREFETCH_COUNT_PER_ROLE", "").split(",") if item)
+}
+
+# Number of database connections that are kept open
+# The pool size can be set per role, e.g. DB_POOL_SIZE_PER_ROLE="logs:2,workflow:10"
+# A workflow manager that runs multiple roles uses the largest prefetch count and pool size of its roles
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_POOL_SIZE_PER_ROLE = {
+    role: int(size)
+    for role, size in (item.split(":") for item in os.getenv("DB_POOL_SIZE_PER_ROLE", "").split(",") if item)
+}
+
+# The messages of the services of a role are handled by one pool of WORKERS worker threads,
+# 0 handles them in the message broker thread
+# The number of workers can be set per role, e.g. WORKERS_PER_ROLE="workflow:4,tasks:2"
+# At most WORKER_QUEUE_SIZE messages are queued for a worker
+WORKERS = int(os.getenv("WORKERS", 0))
+WORKERS_PER_ROLE = {
+    role: int(workers)
+    for role, workers in (item.split(":") for item in os.getenv("WORKERS_PER_ROLE", "").split(",") if item)
+}
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 10))
+
+# The logs table is partitioned by month
+# Partitions are created LOG_PARTITIONS_AHEAD months in advance
+# Partitions older than LOG_RETENTION_MONTHS months are dropped, 0 keeps all partitions
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", 2))
+LOG_RETENTION_MONTHS = int(os.getenv("LOG_RETENTION_MONTHS", 0))
+LOG_PARTITION_INTERVAL = int(os.getenv("LOG_PARTITION_INTERVAL", 60 * 60))  # Check partitions every hour
+
+# Jobs that have started more than JOB_RETENTION_DAYS days ago are purged, 0 keeps all jobs
+# The retention can be set per job type, e.g. JOB_RETENTION_DAYS_PER_TYPE="import:30,export:7"
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", 0))
+JOB_RETENTION_DAYS_PER_TYPE = {
+    job_type: int(days)
+    for job_type, days in (item.split(":") for item in os.getenv("JOB_RETENTION_DAYS_PER_TYPE", "").split(",") if item)
+}
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", 100))  # Number of jobs that are purged in one transaction
+PURGE_THROTTLE = float(os.getenv("PURGE_THROTTLE", 1.0))  # Pause in seconds between two batches
+PURGE_INTERVAL = int(os.getenv("PURGE_INTERVAL", 24 * 60 * 60))  # Purge jobs once a day
+
+# Jobs that have not ended ZOMBIE_JOB_HOURS hours after they have started are zombies
+# Zombie jobs and their open steps are ended every ZOMBIE_SWEEP_INTERVAL seconds
+ZOMBIE_JOB_HOURS = int(os.getenv("ZOMBIE_JOB_HOURS", 12))
+ZOMBIE_SWEEP_INTERVAL = int(os.getenv("ZOMBIE_SWEEP_INTERVAL", 15 * 60))
+
+# Number of job ids for which it is cached whether the job exists
+KNOWN_JOBS_CACHE_SIZE = int(os.getenv("KNOWN_JOBS_CACHE_SIZE", 10000))
+
+# Number of active jobs of which the job and its steps are cached
+JOB_CACHE_SIZE = int(os.getenv("JOB_CACHE_SIZE", 1000))
+
+# Number of compiled dynamic workflows that are kept in memory
+DYNAMIC_WORKFLOW_CACHE_SIZE = int(os.getenv("DYNAMIC_WORKFLOW_CACHE_SIZE", 1000))
+
+# Log messages are rate limited per job and level, 0 disables the rate limit
+# LOG_RATE_LIMIT messages per second are stored with bursts of at most LOG_RATE_BURST messages
+# The rate can be set per level, e.g. LOG_RATE_LIMIT_PER_LEVEL="WARNING:100,DATAWARNING:100"
+# Suppressed messages are summarized every LOG_SUPPRESSION_INTERVAL seconds
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 0))
+LOG_RATE_LIMIT_PER_LEVEL = {
+    level: float(rate)
+    for level, rate in (item.split(":") for item in os.getenv("LOG_RATE_LIMIT_PER_LEVEL", "").split(",") if item)
+}
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", 1000))
+LOG_SUPPRESSION_INTERVAL = int(os.getenv("LOG_SUPPRESSION_INTERVAL", 60))
@@ -4,74 +4,266 @@ Use heartbeats to monitor the status of the components and their tasks
 
 The status is stored in both memory and storage
 
-On every heartbeat all currently known services are checked for heartbeat interval timeout
+All services are periodically checked for heartbeat interval timeout by sweep_services
+
+Heartbeats are coalesced, only the newest heartbeat per service and host is applied by apply_heartbeats.
+After an outage the stale heartbeats in the queue are drained without any database access.
 
 The memory storage is used to compare the status with the last registered status
 If the status has changed the change is written to the storage
+If only the timestamp has changed the timestamp is registered and written later,
+together with the timestamps of all other services, by flush_heartbeat_timestamps.
+The complete status is written at least once every two heartbeat intervals,
+this restores services that have been marked dead or removed in the meantime.
+
+A heartbeat either contains the full list of threads of the service or only the changes (delta):
+
+    full:  {"name", "host", "pid", "is_alive", "timestamp", "threads": [{"name", "is_alive"}, ...], "seq" (optional)}
+    delta: {"name", "host", "pid", "is_alive", "timestamp", "seq", "added": [{"name", "is_alive"}, ...],
+            "removed": [name, ...], "changed": [{"name", "is_alive"}, ...]}
 
+The threads of every service are kept in memory, a delta is applied to the threads of the previous heartbeat.
+The sequence number of a delta should follow the sequence number of the previous heartbeat.
+If a delta is missing the threads are unknown until the next full heartbeat.
+Meanwhile the status and timestamp of the service are still registered, the registered threads are left as they are.
+The threads of a service that is not alive are not needed, its heartbeat does not need to contain them.
 
+The sequence numbers and threads are kept in the memory of the process.
+Deltas can only be applied when all heartbeats are received by one process,
+run the heartbeat role in a single workflow manager when the services send delta heartbeats.
+When the heartbeats are spread over multiple consumers every consumer sees gaps in the sequence numbers,
+the threads are then only updated by full heartbeats.
+
+Services that have been removed because of a heartbeat timeout are forgotten by forget_services.
 """
 import datetime
+import threading
 
 from gobcore.status.heartbeat import HEARTBEAT_INTERVAL
 
-from gobworkflow.storage.storage import get_services, mark_service_dead, remove_service, update_service
+from gobworkflow.config import HEARTBEAT_COALESCE_INTERVAL
+from gobworkflow.storage.storage import sweep_services, update_service, update_service_timestamps
 
 # Remove a service after not having received anything for SERVICE_REMOVAL_TIMEOUT seconds
 _SERVICE_REMOVAL_TIMEOUT = HEARTBEAT_INTERVAL * 60
 
+# Write the complete status when it has not been written for _SERVICE_REWRITE_INTERVAL
+_SERVICE_REWRITE_INTERVAL = datetime.timedelta(seconds=HEARTBEAT_INTERVAL * 2)
+
+# Last written status per (name, host): (status, time of the heartbeat that has been written)
+_services = {}
+# Timestamps per (name, host) that have not yet been written
+_pending_timestamps = {}
+# Newest heartbeat per (name, host) that has not yet been applied
+_pending_heartbeats = {}
+# Threads per (name, host)
+_threads = {}
+_lock = threading.Lock()
+
+
+class _Threads:
+    def __init__(self):
+        self.seq = None  # Sequence number of the last heartbeat, None when deltas cannot be applied
+        self.is_alive = {}  # is_alive status per thread name
+        self.version = 0  # Incremented on every change in the threads
+        self.known = False  # False until a full heartbeat has been received or when a delta is missing
+        self.timestamp = None  # Timestamp of the last received heartbeat
+
+    def update(self, msg):
+        """Update the threads with the threads of a full heartbeat or the changes in a delta heartbeat
+
+        A delta that does not follow the previous heartbeat cannot be applied,
+        the threads are unknown until the next full heartbeat.
+        The threads of a service that is not alive are not updated.
+
+        :param msg: heartbeat message
+        :return: None
+        """
+        seq = msg.get("seq")
+        if "threads" in msg:
+            self._set({thread["name"]: thread["is_alive"] for thread in msg["threads"]})
+            self.seq = seq
+            self.known = True
+        elif not msg["is_alive"]:
+            return
+        elif seq is not None and self.seq is not None and seq == self.seq + 1:
+            self.seq = seq
+            self._apply_delta(msg)
+        else:
+            if self.known:
+                print(f"Heartbeat {msg['name']} out of sequence, wait for full heartbeat")
+            self.seq = None
+            self.known = False
+
+    def _set(self, is_alive):
+        if is_alive != self.is_alive:
+            self.is_alive = is_alive
+            self.version += 1
+
+    def _apply_delta(self, msg):
+        changed = False
+        for thread in msg.get("added", []) + msg.get("changed", []):
+            if self.is_alive.get(thread["name"]) != thread["is_alive"]:
+                self.is_alive[thread["name"]] = thread["is_alive"]
+                changed = True
+        for name in msg.get("removed", []):
+            if name in self.is_alive:
+                del self.is_alive[name]
+                changed = True
+        if changed:
+            self.version += 1
+
 
 def on_heartbeat(msg):
     """On heartbeat message
 
-    Register the current status
-    Store the status
-    Check all services for timeout on heartbeat interval
+    Register the current status, it is applied by apply_heartbeats
+    Any older heartbeat of the same service that has not yet been applied is discarded
+
+    If heartbeats are not coalesced the heartbeat is applied immediately
 
     :param msg: heartbeat message
     :return: None
     """
-    service_name = msg["name"]
-
     service = {
-        "name": service_name,
+        "name": msg["name"],
         "host": msg.get("host"),
         "pid": msg.get("pid"),
         "is_alive": msg["is_alive"],
         "timestamp": msg["timestamp"],
     }
+    key = (service["name"], service["host"])
 
-    service_tasks = (
-        {
-            thread["name"]: {"service_name": service_name, "name": thread["name"], "is_alive": thread["is_alive"]}
-            for thread in msg["threads"]
-        }
-        if service["is_alive"]
-        else {}
-    )
+    with _lock:
+        threads = _threads.get(key)
+        if threads is None:
+            threads = _threads[key] = _Threads()
+        threads.timestamp = service["timestamp"]
+        threads.update(msg)
+
+        if HEARTBEAT_COALESCE_INTERVAL > 0:
+            pending = _pending_heartbeats.get(key)
+            if pending is None or pending["timestamp"] <= service["timestamp"]:
+                _pending_heartbeats[key] = service
+            return
+
+    _register(service)
+
+
+def apply_heartbeats():
+    """Apply the newest heartbeat of every service
+
+    Store the status if it has changed, otherwise register the timestamp to be stored later
+
+    Runs as a scheduled task
+
+    :return: None
+    """
+    global _pending_heartbeats
+
+    with _lock:
+        heartbeats, _pending_heartbeats = _pending_heartbeats, {}
+
+    for service in heartbeats.values():
+        _register(service)
+
+
+def _register(service):
+    key = (service["name"], service["host"])
+    timestamp = datetime.datetime.fromisoformat(service["timestamp"])
+
+    with _lock:
+        threads = _threads.get(key)
+        if threads is None:
+            # Forgotten service
+            return
+        # Threads are only registered for a service that is alive and of which the threads are known
+        with_threads = service["is_alive"] and threads.known
+        status = (service["pid"], service["is_alive"], threads.version if with_threads else None)
+        registered = _services.get(key)
+        if registered and timestamp < registered[1]:
+            # Outdated heartbeat
+            return
+        if registered and registered[0] == status and timestamp - registered[1] < _SERVICE_REWRITE_INTERVAL:
+            # Only the timestamp has changed
+            _pending_timestamps[key] = service["timestamp"]
+            return
+
+        if with_threads:
+            service_tasks = [
+                {"service_name": service["name"], "name": name, "is_alive": is_alive}
+                for name, is_alive in threads.is_alive.items()
+            ]
+        else:
+            # A dead service has no tasks, the registered tasks of a service with unknown threads are kept
+            service_tasks = None if service["is_alive"] else []
 
     # Update in storage
-    update_service(service, service_tasks.values())
+    update_service(service, service_tasks)
+
+    with _lock:
+        _services[key] = (status, timestamp)
+        _pending_timestamps.pop(key, None)
+
+
+def flush_heartbeat_timestamps():
+    """Write the registered heartbeat timestamps of all services in one batch
+
+    If the write fails the timestamps are kept for the next flush, unless a newer timestamp has been registered
+
+    :return: None
+    """
+    global _pending_timestamps
+
+    with _lock:
+        timestamps, _pending_timestamps = _pending_timestamps, {}
 
-    # timeout of heartbeat interval check
-    check_services()
+    try:
+        update_service_timestamps([(name, host, timestamp) for (name, host), timestamp in timestamps.items()])
+    except Exception:
+        with _lock:
+            _pending_timestamps = {**timestamps, **_pending_timestamps}
+        raise
 
 
 def check_services():
     """Check services on heartbeat timeout
 
-    If a heartbeat has not been received in the heartbeat timeour interval mark the process as dead
+    If a heartbeat has not been received in the heartbeat timeout interval mark the process as dead
+    If a heartbeat has not been received in the service removal timeout remove the process
+
+    Runs as a scheduled task
 
     :return: None
     """
     now = datetime.datetime.utcnow()
-    for service in get_services():
-        # Only check services that are currently marked as alive
-        last_heartbeat = service.timestamp
-        time_ago = now - last_heartbeat
-        if time_ago.total_seconds() > _SERVICE_REMOVAL_TIMEOUT:
-            # Final timeout reached, remove the service
-            remove_service(service)
-        elif time_ago.total_seconds() > (HEARTBEAT_INTERVAL * 2):
-            # Heartbeat timeout, register as dead
-            mark_service_dead(service)
+    dead, removed = sweep_services(
+        dead_before=now - datetime.timedelta(seconds=HEARTBEAT_INTERVAL * 2),
+        remove_before=now - datetime.timedelta(seconds=_SERVICE_REMOVAL_TIMEOUT),
+    )
+    if dead or removed:
+        print(f"Heartbeat timeout: {dead} service(s) marked dead, {removed} service(s) removed")
+
+
+def forget_services():
+    """Forget the services that have not sent a heartbeat within the service removal timeout
+
+    These are the services that are removed from the storage by check_services.
+    Hosts change on every deploy, without forgetting them the status of old services would be kept forever.
+
+    Runs as a scheduled task in every instance
+
+    :return: None
+    """
+    remove_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=_SERVICE_REMOVAL_TIMEOUT)
+    with _lock:
+        forgotten = [
+            key
+            for key, threads in _threads.items()
+            if datetime.datetime.fromisoformat(threads.timestamp) < remove_before
+        ]
+        for key in forgotten:
+            del _threads[key]
+            _services.pop(key, None)
+            _pending_timestamps.pop(key, None)
+            _pending_heartbeats.pop(key, None)
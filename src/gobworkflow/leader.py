@@ -0,0 +1,52 @@
+"""Leader
+
+Multiple workflow manager instances can run at the same time.
+Singleton duties, like sweeping services and purging jobs, are only run by one instance, the leader.
+
+The leader is the instance that holds a PostgreSQL advisory lock, comparable to the lock that protects migrations.
+Every instance tries to acquire the lock when it needs to know whether it is the leader.
+When the leader stops or loses its database connection the lock is released and another instance takes over.
+
+Instances can run different roles, every role has its own leader.
+The singleton duties of a role are run by the leader of that role.
+"""
+import threading
+
+from gobworkflow.storage.storage import holds_leader_lock, try_leader_lock
+
+
+class Leader:
+    def __init__(self):
+        self._connections = {}  # Connection that holds the leader lock per role
+        self._lock = threading.Lock()
+
+    def is_leader(self, role=None):
+        """Tells whether this instance is the leader
+
+        Tries to become leader when this instance is not yet the leader
+
+        :param role: Role to lead, None for the leader of all roles
+        :return: True when this instance is the leader
+        """
+        with self._lock:
+            connection = self._connections.get(role)
+            if connection is not None:
+                if holds_leader_lock(connection):
+                    return True
+                print("Leadership lost" if role is None else f"Leadership of {role} lost")
+                del self._connections[role]
+
+            try:
+                connection = try_leader_lock(role)
+            except Exception as e:
+                print(f"Leader election failed: {str(e)}")
+                return False
+
+            if connection is None:
+                return False
+            print("Elected as leader" if role is None else f"Elected as leader of {role}")
+            self._connections[role] = connection
+            return True
+
+
+leader = Leader()
@@ -0,0 +1,140 @@
+"""Log rate limiter
+
+Limits the number of log messages that are stored per job and level
+
+A misconfigured job can emit millions of identical log messages.
+Storing all these messages slows down the storage of the log messages of all other jobs.
+
+Every (job, level) combination has its own token bucket.
+A message is allowed when a token is available. Tokens are refilled at a fixed rate up to a maximum burst size.
+Messages that are not allowed are suppressed and counted.
+The suppressed messages are periodically reported in one summary message per (job, level).
+"""
+import datetime
+import threading
+import time
+from collections import Counter
+
+# Maximum number of distinct message texts that are counted per (job, level)
+MAX_TEXTS = 100
+# Number of most common message texts in a summary
+TOP_TEXTS = 10
+
+# Message attributes that are copied from the suppressed messages to the summary message
+SUMMARY_ATTRIBUTES = [
+    "process_id",
+    "source",
+    "application",
+    "destination",
+    "catalogue",
+    "entity",
+    "level",
+    "name",
+    "jobid",
+    "stepid",
+]
+
+
+class _Bucket:
+    def __init__(self, burst):
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+
+class _Suppressed:
+    def __init__(self, msg):
+        self.msg = msg
+        self.count = 0
+        self.first = msg["timestamp"]
+        self.last = msg["timestamp"]
+        self.texts = Counter()
+
+    def add(self, msg):
+        self.msg = msg
+        self.count += 1
+        self.last = msg["timestamp"]
+        text = msg.get("msg")
+        if text in self.texts or len(self.texts) < MAX_TEXTS:
+            self.texts[text] += 1
+
+
+class LogRateLimiter:
+    def __init__(self, rate, burst, rates_per_level=None):
+        """Constructor
+
+        :param rate: Default number of messages per second per (job, level), 0 for no limit
+        :param burst: Maximum number of messages that are allowed at once
+        :param rates_per_level: Number of messages per second per level, overrides rate
+        """
+        self.rate = rate
+        self.burst = burst
+        self.rates_per_level = rates_per_level or {}
+
+        self._buckets = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def allow(self, msg):
+        """Tells whether the log message is allowed to be stored
+
+        If the message is not allowed it is counted as suppressed
+
+        :param msg: log message
+        :return: True if the message should be stored
+        """
+        level = msg.get("level")
+        rate = self.rates_per_level.get(level, self.rate)
+        if rate <= 0:
+            return True
+
+        key = (msg.get("jobid"), level)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(self.burst)
+            else:
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * rate)
+                bucket.updated = now
+
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return True
+
+            suppressed = self._suppressed.get(key)
+            if suppressed is None:
+                suppressed = self._suppressed[key] = _Suppressed(msg)
+            suppressed.add(msg)
+            return False
+
+    def summaries(self):
+        """Get the summary messages for all messages that have been suppressed since the last call
+
+        Buckets that have not been used for a while are removed
+
+        :return: list of log messages
+        """
+        with self._lock:
+            suppressed, self._suppressed = self._suppressed, {}
+            now = time.monotonic()
+            self._buckets = {
+                key: bucket
+                for key, bucket in self._buckets.items()
+                if bucket.tokens + (now - bucket.updated) * self.rates_per_level.get(key[1], self.rate) < self.burst
+            }
+
+        timestamp = datetime.datetime.utcnow().isoformat(timespec="microseconds")
+        return [
+            {
+                **{attribute: s.msg.get(attribute) for attribute in SUMMARY_ATTRIBUTES},
+                "timestamp": timestamp,
+                "msg": f"{s.count} further messages suppressed",
+                "data": {
+                    "suppressed": s.count,
+                    "first_timestamp": s.first,
+                    "last_timestamp": s.last,
+                    "messages": [{"msg": text, "count": count} for text, count in s.texts.most_common(TOP_TEXTS)],
+                },
+            }
+            for s in suppressed.values()
+        ]
@@ -0,0 +1,191 @@
+"""Logs
+
+Log and audit log messages are received from the log queues and stored in the management database
+
+Log messages arrive in large volumes. Instead of writing every message in its own transaction
+the messages are collected by a batch writer and bulk loaded in batches.
+Log messages for jobs that do not exist (anymore) are skipped before they reach the batch.
+This check never waits for the database, when the database is unreachable the logs are filtered when they are saved.
+When the management database is unreachable the batches are spooled on local disk and replayed later.
+Floods of log messages are rate limited per job and level, suppressed messages are stored as periodic summaries.
+
+The logs table is partitioned by month. The partitions for the upcoming months are created in advance,
+old partitions are dropped as a whole when a log retention period has been configured.
+"""
+import datetime
+
+from gobcore.typesystem.json import GobTypeJSONEncoder
+
+from gobworkflow.config import (
+    LOG_BATCH_MAX_AGE,
+    LOG_BATCH_SIZE,
+    LOG_PARTITIONS_AHEAD,
+    LOG_RATE_BURST,
+    LOG_RATE_LIMIT,
+    LOG_RATE_LIMIT_PER_LEVEL,
+    LOG_RETENTION_MONTHS,
+    SPOOL_DIR,
+    SPOOL_SEGMENT_ROWS,
+)
+from gobworkflow.log_rate_limiter import LogRateLimiter
+from gobworkflow.storage.batch_writer import BatchWriter, skip_failing_rows
+from gobworkflow.storage.spool import Spool
+from gobworkflow.storage.storage import (
+    create_log_partitions,
+    drop_log_partitions,
+    is_connected,
+    job_exists,
+    save_audit_logs,
+    save_logs,
+)
+
+# Log timestamps are ISO formatted, e.g. 2020-06-20T12:20:20.000000
+_parse_timestamp = datetime.datetime.fromisoformat
+
+# Encoder for the log data, the GOB type encoding is only used for GOB type values
+_json_encoder = GobTypeJSONEncoder()
+
+# A log that cannot be stored, e.g. because of an invalid value, is skipped and does not block the other logs
+write_logs = skip_failing_rows("LogWriter", save_logs, is_connected)
+write_audit_logs = skip_failing_rows("AuditLogWriter", save_audit_logs, is_connected)
+
+log_spool = Spool("logs", SPOOL_DIR, write_logs, max_rows=SPOOL_SEGMENT_ROWS)
+audit_log_spool = Spool("audit_logs", SPOOL_DIR, write_audit_logs, max_rows=SPOOL_SEGMENT_ROWS)
+
+log_writer = BatchWriter(
+    "LogWriter",
+    write_logs,
+    max_rows=LOG_BATCH_SIZE,
+    max_age=LOG_BATCH_MAX_AGE,
+    spool=log_spool,
+    is_connected=is_connected,
+)
+log_rate_limiter = LogRateLimiter(LOG_RATE_LIMIT, LOG_RATE_BURST, LOG_RATE_LIMIT_PER_LEVEL)
+audit_log_writer = BatchWriter(
+    "AuditLogWriter",
+    write_audit_logs,
+    max_rows=LOG_BATCH_SIZE,
+    max_age=LOG_BATCH_MAX_AGE,
+    spool=audit_log_spool,
+    is_connected=is_connected,
+)
+
+
+def log_record(msg):
+    """Convert a log message to a log record
+
+    This function is called for every log message and is kept as lean as possible
+
+    :param msg: log message
+    :return: tuple with the values for LOG_FIELDS
+    """
+    get = msg.get
+    data = get("data")
+    return (
+        _parse_timestamp(msg["timestamp"]),
+        get("process_id"),
+        get("source"),
+        get("application"),
+        get("destination"),
+        get("catalogue"),
+        get("entity"),
+        get("level"),
+        get("name"),
+        get("id"),
+        get("msg"),
+        get("jobid"),
+        get("stepid"),
+        "null" if data is None else _json_encoder.encode(data),
+    )
+
+
+def audit_log_record(msg):
+    """Convert an audit log message to an audit log record
+
+    :param msg: audit log message
+    :return: tuple with the values for AUDIT_LOG_FIELDS
+    """
+    get = msg.get
+    return (
+        _parse_timestamp(msg["timestamp"]),
+        get("source"),
+        get("destination"),
+        get("type"),
+        get("data"),
+        get("request_uuid"),
+    )
+
+
+def on_log(msg):
+    """On log message
+
+    Add the log message to the current batch of log records
+    Messages that exceed the rate limit of their job and level are suppressed
+
+    :param msg: log message
+    :return: None
+    """
+    if not log_rate_limiter.allow(msg):
+        return
+    jobid = msg.get("jobid")
+    if jobid is None or job_exists(jobid):
+        log_writer.add(log_record(msg))
+
+
+def log_suppressed_summaries():
+    """Store a summary for the log messages that have been suppressed by the rate limiter
+
+    :return: None
+    """
+    for msg in log_rate_limiter.summaries():
+        log_writer.add(log_record(msg))
+
+
+def on_audit_log(msg):
+    """On audit log message
+
+    Add the audit log message to the current batch of audit log records
+
+    :param msg: audit log message
+    :return: None
+    """
+    audit_log_writer.add(audit_log_record(msg))
+
+
+def replay_spools():
+    """Replay the log and audit log batches that have been spooled while the database was unreachable
+
+    The spools are only replayed when the connection is available, otherwise the replay is retried at the next interval.
+    Restoring the connection is left to the storage, the replay never reconnects itself.
+
+    :return: None
+    """
+    spools = [spool for spool in (log_spool, audit_log_spool) if spool.pending()]
+    if not spools:
+        return
+    if not is_connected():
+        print("Spooled logs are replayed when the connection has been restored")
+        return
+    for spool in spools:
+        spool.replay()
+
+
+def _add_months(month, months):
+    month_index = month.month - 1 + months
+    return datetime.date(month.year + month_index // 12, month_index % 12 + 1, 1)
+
+
+def manage_log_partitions():
+    """Manage the monthly partitions of the logs table
+
+    Create the partitions for the current and the upcoming months
+    Drop the partitions that are older than the log retention period
+
+    :return: None
+    """
+    this_month = datetime.datetime.utcnow().date().replace(day=1)
+    create_log_partitions([_add_months(this_month, n) for n in range(LOG_PARTITIONS_AHEAD + 1)])
+
+    if LOG_RETENTION_MONTHS > 0:
+        for name in drop_log_partitions(_add_months(this_month, -LOG_RETENTION_MONTHS)):
+            print(f"Dropped logs partition {name}")
@@ -0,0 +1,53 @@
+"""Retention
+
+Purge jobs that are older than the retention period
+
+The retention period is configured per job type, any other job type gets the default retention period.
+Jobs are purged in batches. Every batch is deleted in its own transaction with set-based deletes.
+Between two batches the purge pauses so that it does not monopolize the management database.
+
+The purge runs as a scheduled task of the workflow manager or once from the command line:
+
+    python -m gobworkflow --purge
+"""
+import datetime
+import time
+
+from gobworkflow.config import JOB_RETENTION_DAYS, JOB_RETENTION_DAYS_PER_TYPE, PURGE_BATCH_SIZE, PURGE_THROTTLE
+from gobworkflow.storage.storage import purge_jobs
+
+
+def retention_rules():
+    """Get the retention rules
+
+    :return: list of (job type, retention days), job type None is used for all other job types
+    """
+    rules = [(job_type, days) for job_type, days in JOB_RETENTION_DAYS_PER_TYPE.items() if days > 0]
+    if JOB_RETENTION_DAYS > 0:
+        rules.append((None, JOB_RETENTION_DAYS))
+    return rules
+
+
+def purge(batch_size=PURGE_BATCH_SIZE, throttle=PURGE_THROTTLE):
+    """Purge all jobs that are older than their retention period
+
+    :param batch_size: number of jobs to delete in one transaction
+    :param throttle: pause in seconds between two batches
+    :return: total number of purged jobs
+    """
+    now = datetime.datetime.utcnow()
+    total = 0
+    for job_type, days in retention_rules():
+        before = now - datetime.timedelta(days=days)
+        description = job_type or "other"
+        purged = 0
+        while True:
+            ids = purge_jobs(before, batch_size, job_type=job_type, exclude_types=list(JOB_RETENTION_DAYS_PER_TYPE))
+            purged += len(ids)
+            if len(ids) < batch_size:
+                break
+            print(f"Purged {purged} {description} jobs started before {before:%Y-%m-%d}...")
+            time.sleep(throttle)
+        print(f"Purged {purged} {description} jobs started before {before:%Y-%m-%d}")
+        total += purged
+    return total
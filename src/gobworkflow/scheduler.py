@@ -0,0 +1,70 @@
+"""Scheduler
+
+Runs periodic tasks in the background
+
+Every task runs in its own thread.
+A task is run when the scheduler is started and then again every interval seconds.
+Any exception is reported and the task is run again at the next interval.
+
+Tasks that should run on only one of the workflow manager instances are run on the leader only.
+A task that belongs to a role is run on the leader of that role.
+
+Scheduled tasks run concurrently with the message handlers.
+Storage functions that are used by scheduled tasks use their own database connection.
+"""
+import threading
+import time
+
+from gobworkflow.leader import leader
+
+
+class Scheduler:
+    def __init__(self, is_leader=leader.is_leader):
+        """Constructor
+
+        :param is_leader: Function that tells whether this instance is the leader
+        """
+        self.is_leader = is_leader
+        self._tasks = []
+        self._threads = []
+
+    def add(self, name, interval, task, leader_only=False, role=None):
+        """Add a periodic task
+
+        :param name: Name of the task
+        :param interval: Interval in seconds between two runs of the task
+        :param task: Function to run
+        :param leader_only: Run the task only when this instance is the leader
+        :param role: Role of the task, a leader only task is run by the leader of this role
+        :return: None
+        """
+        self._tasks.append((name, interval, task, leader_only, role))
+
+    def start(self):
+        """Start running the scheduled tasks
+
+        :return: None
+        """
+        started = len(self._threads)
+        for name, interval, task, leader_only, role in self._tasks[started:]:
+            thread = threading.Thread(
+                target=self._run_loop, args=(name, interval, task, leader_only, role), name=name, daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _run_loop(self, name, interval, task, leader_only, role):
+        while True:
+            self._run(name, task, leader_only, role)
+            time.sleep(interval)
+
+    def _run(self, name, task, leader_only=False, role=None):
+        try:
+            if leader_only and not self.is_leader(role):
+                return
+            task()
+        except Exception as e:
+            print(f"ERROR: scheduled task {name} failed: {str(e)}")
+
+
+scheduler = Scheduler()
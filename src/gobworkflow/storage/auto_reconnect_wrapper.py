@@ -8,8 +8,15 @@ This might for instance trying to execute a rollback for when the wrapper is use
 
 On a regular interval (RECONNECT_INTERVAL) the wrapper will try to restore the connection.
 When the connection is restored, the failed command is re-executed
+
+Commands that are executed by another command, eg the storage functions within a unit of work,
+are not re-executed by themselves. The outermost command is re-executed as a whole.
+
+Commands can be executed by multiple threads. Only one thread at a time restores the connection,
+the other threads wait for it and then re-execute their failed command.
 """
 import functools
+import threading
 from time import sleep
 
 RECONNECT_INTERVAL = 60  # Duration in seconds to try to reconnect
@@ -33,6 +40,8 @@ class AutoReconnector:
         self.is_connected = is_connected
         self.connect = connect
         self.disconnect = disconnect
+        self._executing = threading.local()
+        self._reconnect_lock = threading.Lock()
 
     def reconnect(self, try_times=MAX_TRY_RECONNECT):
         """Reconnect
@@ -74,6 +83,17 @@ class AutoReconnector:
         :param kwargs: function parameters
         :return: the function result
         """
+        if getattr(self._executing, "active", False):
+            # Executed by another command, any connection problem is handled by the outermost command
+            return func(*args, **kwargs)
+
+        self._executing.active = True
+        try:
+            return self._exec(func, *args, **kwargs)
+        finally:
+            self._executing.active = False
+
+    def _exec(self, func, *args, **kwargs):
         result = None
         try:
             # Optimistic execution
@@ -84,8 +104,11 @@ class AutoReconnector:
             if not self.is_connected():
                 # Report connection problem
                 print("Connection problem, operation failed", str(e))
-                self.reconnect()
-                return self.exec(func, *args, **kwargs)  # Try again...
+                with self._reconnect_lock:
+                    # The connection may have been restored by another thread in the meantime
+                    if not self.is_connected():
+                        self.reconnect()
+                return self._exec(func, *args, **kwargs)  # Try again...
             else:
                 # If not, re-raise the exception
                 raise e
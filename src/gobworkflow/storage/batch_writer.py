@@ -0,0 +1,174 @@
+"""Batch writer
+
+A write-behind buffer that collects rows and writes them to the storage in batches.
+
+A batch is written (flushed) when:
+- the buffer holds max_rows rows
+- the oldest row in the buffer has been waiting for max_age seconds
+
+Full batches are written by the thread that adds the last row.
+Batches that have aged are written by a background flusher thread.
+
+Message handlers that add rows to the buffer return before the row is written.
+The message broker acknowledges a message when its handler returns.
+The size and the age of the buffer limit the number of messages that are lost when the process is killed.
+When the process exits normally the buffer is flushed.
+
+Optionally a spool takes over the rows when the connection with the storage has been lost.
+As long as the spool holds rows that have not been replayed, new batches are appended to the spool as well.
+Adding rows then never waits for the storage to become available again.
+
+A batch that cannot be written is kept in the buffer, at most MAX_BUFFERED_BATCHES batches are kept.
+When the buffer is full the oldest rows are dropped.
+A single row that can never be written should not block all other rows, see skip_failing_rows.
+"""
+import atexit
+import threading
+import time
+
+# Maximum number of batches that are kept in the buffer when writing fails
+MAX_BUFFERED_BATCHES = 10
+
+
+def skip_failing_rows(name, write, is_connected):
+    """Get a write function that skips the rows that cannot be written
+
+    When writing a batch fails while the connection with the storage is alive, the batch is split in halves
+    that are written separately until the rows that fail have been found. These rows are reported and skipped.
+    Failures because the connection has been lost are re-raised.
+
+    The write function should write a batch in one transaction, a failed batch then has written nothing.
+
+    :param name: Name used in error messages
+    :param write: Function that writes a list of rows to the storage
+    :param is_connected: Function that tells whether the connection with the storage is alive
+    :return: the write function
+    """
+
+    def write_rows(rows):
+        try:
+            write(rows)
+        except Exception as e:
+            if not is_connected():
+                raise
+            if len(rows) == 1:
+                print(f"ERROR: {name}: skip row that cannot be written ({str(e)}): {str(rows[0])[:1000]}")
+                return
+            middle = len(rows) // 2
+            write_rows(rows[:middle])
+            write_rows(rows[middle:])
+
+    return write_rows
+
+
+class BatchWriter:
+    def __init__(self, name, write, max_rows, max_age, spool=None, is_connected=None):
+        """Constructor
+
+        :param name: Name of the writer, used in error messages
+        :param write: Function that writes a list of rows to the storage
+        :param max_rows: Maximum number of rows in the buffer
+        :param max_age: Maximum time in seconds that a row waits in the buffer
+        :param spool: Optional spool for the rows that cannot be written because the connection has been lost
+        :param is_connected: Function that tells whether the connection with the storage is alive, required for spool
+        """
+        self.name = name
+        self.write = write
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.spool = spool
+        self.is_connected = is_connected
+
+        self._rows = []
+        self._oldest = None  # time at which the oldest row in the buffer has been added
+        self._lock = threading.RLock()
+        self._flusher = None
+
+    def add(self, row):
+        """Add a row to the buffer
+
+        The buffer is flushed when it has reached its maximum size
+
+        :param row: Row to write
+        :return: None
+        """
+        with self._lock:
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.append(row)
+            if len(self._rows) >= self.max_rows:
+                self.flush()
+
+    def is_due(self):
+        """Tells whether the oldest row in the buffer has reached its maximum age
+
+        :return: True when the buffer should be flushed
+        """
+        with self._lock:
+            return bool(self._rows) and time.monotonic() - self._oldest >= self.max_age
+
+    def flush(self):
+        """Write all rows in the buffer
+
+        If the write fails because the connection has been lost the rows are appended to the spool
+        Otherwise the rows are kept in the buffer and the exception is re-raised,
+        when the buffer holds more than MAX_BUFFERED_BATCHES batches the oldest rows are dropped
+
+        :return: None
+        """
+        with self._lock:
+            rows, self._rows = self._rows, []
+            if not rows:
+                return
+            try:
+                self._write(rows)
+            except Exception:
+                # Keep the rows for the next flush
+                self._rows = rows + self._rows
+                self._drop_oldest_rows()
+                raise
+            self._oldest = time.monotonic() if self._rows else None
+
+    def _drop_oldest_rows(self):
+        dropped = len(self._rows) - self.max_rows * MAX_BUFFERED_BATCHES
+        if dropped > 0:
+            print(f"ERROR: {self.name}: buffer full, drop {dropped} rows")
+            self._rows = self._rows[dropped:]
+
+    def _write(self, rows):
+        if self.spool is None:
+            return self.write(rows)
+
+        if not self.spool.pending():
+            try:
+                return self.write(rows)
+            except Exception as e:
+                if self.is_connected():
+                    raise
+                print(f"{self.name}: connection lost, spool {len(rows)} rows ({str(e)})")
+        # Keep spooling until the spool has been replayed
+        self.spool.append(rows)
+
+    def start(self):
+        """Start the background flusher thread
+
+        The buffer is also flushed when the process exits
+
+        :return: None
+        """
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name=f"{self.name}Flusher", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.max_age / 2)
+            self._flush_when_due()
+
+    def _flush_when_due(self):
+        try:
+            if self.is_due():
+                self.flush()
+        except Exception as e:
+            print(f"ERROR: {self.name} flush failed: {str(e)}")
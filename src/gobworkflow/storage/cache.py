@@ -0,0 +1,67 @@
+"""Cache
+
+An in-process cache with a bounded size
+
+When the cache is full the least recently used entry is evicted.
+The cache is thread safe, it can be used by message handlers and scheduled tasks at the same time.
+"""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_size):
+        """Constructor
+
+        :param max_size: Maximum number of entries in the cache
+        """
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Get the value for the given key
+
+        :param key:
+        :param default: value to return if the key is not in the cache
+        :return: the cached value or default
+        """
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return default
+            return self._entries[key]
+
+    def set(self, key, value):
+        """Set the value for the given key
+
+        :param key:
+        :param value:
+        :return: None
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Remove the given key from the cache
+
+        :param key:
+        :return: None
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all keys from the cache
+
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,112 @@
+"""Job cache
+
+A write-through cache of the jobs that are active in this instance and their steps
+
+Jobs and steps are cached as plain snapshots, read-only copies of their column values.
+Snapshots are not bound to a database session, they can be shared by message handlers and scheduled tasks.
+
+Every write of a job or step replaces its snapshot, a job and its steps are evicted when the job ends.
+Other workflow instances may change the same jobs, the storage evicts the jobs that they change.
+"""
+import threading
+from types import SimpleNamespace
+
+from gobworkflow.storage.cache import LRUCache
+
+
+class _Snapshot(SimpleNamespace):
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Snapshot attribute {name} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Snapshot attribute {name} is read-only")
+
+
+def snapshot(values):
+    """Get a snapshot of the given column values
+
+    :param values: mapping of column name to value
+    :return: object with the values as read-only attributes
+    """
+    return _Snapshot(**values)
+
+
+class _CachedJob:
+    def __init__(self, job):
+        self.job = job
+        self.steps = {}
+
+
+class JobCache:
+    def __init__(self, max_size):
+        """Constructor
+
+        :param max_size: Maximum number of jobs in the cache
+        """
+        self._jobs = LRUCache(max_size)
+        self._lock = threading.Lock()
+
+    def get_job(self, jobid):
+        """Get the snapshot of the job with the given id
+
+        :param jobid:
+        :return: the job snapshot or None if the job is not cached
+        """
+        cached = self._jobs.get(jobid)
+        return None if cached is None else cached.job
+
+    def get_step(self, jobid, stepid):
+        """Get the snapshot of the step with the given id
+
+        :param jobid: id of the job of the step
+        :param stepid:
+        :return: the step snapshot or None if the step is not cached
+        """
+        cached = self._jobs.get(jobid)
+        return None if cached is None else cached.steps.get(stepid)
+
+    def set_job(self, job):
+        """Set the snapshot of an active job, an ended job is evicted
+
+        :param job: job snapshot
+        :return: None
+        """
+        if job.end is not None:
+            self.evict(job.id)
+            return
+
+        with self._lock:
+            cached = self._jobs.get(job.id)
+            if cached is None:
+                self._jobs.set(job.id, _CachedJob(job))
+            else:
+                cached.job = job
+
+    def set_step(self, step):
+        """Set the snapshot of a step, the step is only cached when its job is cached
+
+        :param step: step snapshot
+        :return: None
+        """
+        with self._lock:
+            cached = self._jobs.get(step.jobid)
+            if cached is not None:
+                cached.steps[step.id] = step
+
+    def evict(self, jobid):
+        """Remove the job with the given id and its steps from the cache
+
+        :param jobid:
+        :return: None
+        """
+        self._jobs.delete(jobid)
+
+    def clear(self):
+        """Remove all jobs from the cache
+
+        :return: None
+        """
+        self._jobs.clear()
+
+    def __len__(self):
+        return len(self._jobs)
@@ -0,0 +1,136 @@
+"""Spool
+
+A durable local buffer for rows that cannot be written to the storage because the connection has been lost.
+
+Rows are appended to segment files in a local directory.
+Every append is flushed to disk before it returns.
+A segment is closed when it holds max_rows rows or when the spool is replayed.
+
+When the connection has been restored the closed segments are replayed in the order in which they were written.
+Every segment is written to the storage in one call and is deleted once it has been written.
+A segment that fails to replay is kept and will be replayed again.
+
+Segments that are left behind by a previous process are replayed as well.
+"""
+import os
+import pickle
+import threading
+
+
+class Spool:
+    SUFFIX = ".seg"
+
+    def __init__(self, name, directory, write, max_rows):
+        """Constructor
+
+        :param name: Name of the spool, used as prefix for the segment files
+        :param directory: Directory for the segment files
+        :param write: Function that writes a list of rows to the storage
+        :param max_rows: Maximum number of rows in a segment
+        """
+        self.name = name
+        self.directory = directory
+        self.write = write
+        self.max_rows = max_rows
+
+        self._lock = threading.Lock()
+        self._segment = None  # file object of the current segment
+        self._segment_rows = 0
+        self._recover_segments()
+        self._sequence = max([self._sequence_of(path) for path in self._closed_segments()], default=0)
+
+    def _path(self, sequence):
+        return os.path.join(self.directory, f"{self.name}-{sequence:012d}{self.SUFFIX}")
+
+    def _sequence_of(self, path):
+        start, end = len(self.name) + 1, -len(self.SUFFIX)
+        return int(os.path.basename(path)[start:end])
+
+    def _closed_segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            os.path.join(self.directory, filename)
+            for filename in os.listdir(self.directory)
+            if filename.startswith(f"{self.name}-") and filename.endswith(self.SUFFIX)
+        )
+
+    def _recover_segments(self):
+        # Close the segments that a previous process has left open
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.startswith(f"{self.name}-") and filename.endswith(f"{self.SUFFIX}.tmp"):
+                    path = os.path.join(self.directory, filename)
+                    os.replace(path, path[: -len(".tmp")])
+
+    def pending(self):
+        """Tells whether the spool holds any rows that have not yet been replayed
+
+        :return: True when there are rows to replay
+        """
+        with self._lock:
+            return self._segment is not None or bool(self._closed_segments())
+
+    def append(self, rows):
+        """Append rows to the current segment
+
+        :param rows: list of rows
+        :return: None
+        """
+        with self._lock:
+            if self._segment is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._sequence += 1
+                # Write to a temporary file, the segment is only replayed once it has been closed
+                self._segment = open(self._path(self._sequence) + ".tmp", "wb")
+                self._segment_rows = 0
+            pickle.dump(rows, self._segment, protocol=pickle.HIGHEST_PROTOCOL)
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            self._segment_rows += len(rows)
+            if self._segment_rows >= self.max_rows:
+                self._close_segment()
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            os.replace(self._segment.name, self._segment.name[: -len(".tmp")])
+            self._segment = None
+
+    def _read_segment(self, path):
+        rows = []
+        with open(path, "rb") as segment:
+            while True:
+                try:
+                    rows.extend(pickle.load(segment))
+                except EOFError:
+                    break
+                except pickle.UnpicklingError:
+                    # An append that has been interrupted by a crash of the process
+                    print(f"WARNING: {self.name} segment {path} is truncated")
+                    break
+        return rows
+
+    def replay(self):
+        """Write all spooled rows to the storage
+
+        The current segment is closed and every closed segment is written and deleted.
+        Replay stops at the first segment that fails and re-raises the exception.
+
+        :return: number of replayed rows
+        """
+        replayed = 0
+        while True:
+            with self._lock:
+                self._close_segment()
+                segments = self._closed_segments()
+            if not segments:
+                return replayed
+
+            for path in segments:
+                rows = self._read_segment(path)
+                if rows:
+                    self.write(rows)
+                os.remove(path)
+                replayed += len(rows)
+                print(f"{self.name}: replayed {len(rows)} rows from {os.path.basename(path)}")
@@ -5,50 +5,86 @@ This module encapsulates the GOB Management storage.
 
 
 import datetime
+import functools
+import io
 import json
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from typing import Optional
 
 import alembic.config
 import alembic.script
 from alembic.runtime import migration
-from gobcore.model.sa.management import AuditLog, Base, Job, JobStep, Log, Service, ServiceTask, Task
-from gobcore.typesystem.json import GobTypeJSONEncoder
-from sqlalchemy import String, and_, create_engine, or_, text
+from gobcore.model.sa.management import AuditLog, Base, Job, JobStep, Log, Service, Task
+from sqlalchemy import JSON, String, and_, create_engine, or_, select, text, update
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.engine import Engine
 from sqlalchemy.engine.url import URL
-from sqlalchemy.exc import DBAPIError, IntegrityError
-from sqlalchemy.orm import Session
-from sqlalchemy.orm.exc import ObjectDeletedError
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.sql.expression import cast
 
-from gobworkflow.config import GOB_MGMT_DB
-from gobworkflow.storage.auto_reconnect_wrapper import auto_reconnect_wrapper
+from gobworkflow.config import DB_POOL_SIZE, GOB_MGMT_DB, JOB_CACHE_SIZE, KNOWN_JOBS_CACHE_SIZE
+from gobworkflow.storage.auto_reconnect_wrapper import RECONNECT_INTERVAL, auto_reconnect_wrapper
+from gobworkflow.storage.cache import LRUCache
+from gobworkflow.storage.job_cache import JobCache, snapshot
+from gobworkflow.workflow.message import copy_message
 
-session: Optional[Session] = None
+# Every thread has its own session
+session: Optional[scoped_session] = None
 engine: Optional[Engine] = None
+# Number of database connections that are kept open
+_pool_size = DB_POOL_SIZE
 
+# Tells for recently used job ids whether the job exists
+# Only jobs that exist and jobs that have been purged by this process are cached,
+# a job that is not found may still be created by another workflow instance
+known_jobs = LRUCache(KNOWN_JOBS_CACHE_SIZE)
+# Jobs are not checked in the storage until this time (time.monotonic) after a check has failed
+_check_jobs_after = 0
 
-def connect(force_migrate=False):
+# Active jobs and their steps
+job_cache = JobCache(JOB_CACHE_SIZE)
+
+# Changes of jobs and steps are notified to all workflow instances on this channel
+JOB_CHANGES_CHANNEL = "gobworkflow_job_changes"
+# Identifies the changes of this instance
+INSTANCE_ID = uuid.uuid4().hex
+# Connection that listens for job changes
+_job_changes = None
+_job_changes_lock = threading.Lock()
+
+# Unit of work of the current thread
+_unit_of_work = threading.local()
+
+
+def connect(force_migrate=False, pool_size=None):
     """Module initialisation
 
     The connection with the underlying storage is initialised.
     Meta information is available via the Base variable.
-    Data retrieval is facilitated via the session object
+    Data retrieval is facilitated via the session object, every thread that uses the session gets its own session
 
+    :param pool_size: Number of database connections that are kept open, also used when reconnecting
     :return: True when the connection has been established
     """
-    global session, engine
+    global session, engine, _pool_size
+
+    if pool_size is not None:
+        _pool_size = pool_size
 
     try:
-        engine = create_engine(URL.create(**GOB_MGMT_DB), connect_args={"sslmode": "require"})
+        engine = create_engine(URL.create(**GOB_MGMT_DB), connect_args={"sslmode": "require"}, pool_size=_pool_size)
 
         migrate_storage(force_migrate)
 
         # Declarative base model to create database tables and classes
         Base.metadata.bind = engine
 
-        session = Session(engine)
+        session = scoped_session(sessionmaker(engine))
     except DBAPIError as e:
         # Catch any connection errors
         print(f"Connect failed: {str(e)}")
@@ -112,6 +148,7 @@ def disconnect():
     """
     global engine, session
 
+    _stop_listening()
     try:
         if session is not None:
             session.rollback()
@@ -132,6 +169,8 @@ def is_connected():
     Tells whether the database connection is alive
 
     A simple statement is executed to test if the database communication is OK
+    When the statement fails the session of the current thread is rolled back,
+    the next check then uses a new connection, so the check succeeds again once the database is reachable
 
     :return: True when the database connection is OK
     """
@@ -142,107 +181,517 @@ def is_connected():
             session.execute(text("SELECT 1"))
             return True
         except Exception:
+            session.rollback()
             return False
 
 
+# Advisory lock that is held by the leader of the workflow manager instances
+LEADER_LOCK = 248517091  # Just some random number, next to MIGRATION_LOCK
+
+
+def try_leader_lock(role=None):
+    """Try to acquire the leader lock
+
+    The lock is held by a dedicated connection, it is released when the connection is closed or lost.
+    This way leadership moves to another instance when the leader stops or loses its database connection.
+
+    Every role has its own lock, identified by LEADER_LOCK and the hash of the role name.
+
+    The connection runs in autocommit mode, it is never left idle in transaction while its instance leads.
+
+    :param role: Role to lead, None for the leader of all roles
+    :return: The connection that holds the leader lock or None when another instance holds the lock
+    """
+    if role is None:
+        lock, params = "SELECT pg_try_advisory_lock(:lock)", {"lock": LEADER_LOCK}
+    else:
+        lock, params = "SELECT pg_try_advisory_lock(:lock, hashtext(:role))", {"lock": LEADER_LOCK, "role": role}
+
+    connection = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        if connection.execute(text(lock), params).scalar():
+            return connection
+        connection.close()
+    except Exception:
+        connection.invalidate()
+        raise
+    return None
+
+
+def holds_leader_lock(connection):
+    """Tells whether the connection that has acquired the leader lock is still alive
+
+    A connection that has been lost is discarded, the lock has then been released by the database
+
+    :param connection: The connection that holds the leader lock
+    :return: True when the connection still holds the lock
+    """
+    try:
+        connection.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        connection.invalidate()
+        return False
+
+
+def _stop_listening():
+    global _job_changes
+
+    with _job_changes_lock:
+        if _job_changes is not None:
+            _job_changes.invalidate()
+            _job_changes = None
+        job_cache.clear()
+
+
+def _receive_job_changes():
+    """Evict the jobs that have been changed by other workflow instances from the job cache
+
+    Changes are received on a dedicated connection that listens on the job changes channel.
+    Notifications are sent when a transaction commits, receiving them does not require a query.
+    Changes can be missed while not listening, the job cache is cleared when listening (re)starts.
+
+    :return: None
+    """
+    global _job_changes
+
+    with _job_changes_lock:
+        try:
+            if _job_changes is None:
+                _job_changes = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+                _job_changes.execute(text(f"LISTEN {JOB_CHANGES_CHANNEL}"))
+                job_cache.clear()
+
+            _evict_changed_jobs(_job_changes.connection.dbapi_connection)
+        except Exception as e:
+            print(f"Receive job changes failed: {str(e)}")
+            if _job_changes is not None:
+                _job_changes.invalidate()
+                _job_changes = None
+            job_cache.clear()
+
+
+def _evict_changed_jobs(dbapi_connection):
+    dbapi_connection.poll()
+    while dbapi_connection.notifies:
+        instance, jobid = dbapi_connection.notifies.pop(0).payload.split()
+        if instance != INSTANCE_ID:
+            job_cache.evict(int(jobid))
+
+
+def _notify_job_change(jobid):
+    # Sent to the other workflow instances when the current transaction commits
+    session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": JOB_CHANGES_CHANNEL, "payload": f"{INSTANCE_ID} {jobid}"},
+    )
+
+
 # Create a wrapper to protect database functions against connection loss
 # Any failed operation will automatically be retried when the connection becomes available again
 session_auto_reconnect = auto_reconnect_wrapper(is_connected=is_connected, connect=connect, disconnect=disconnect)
 
 
-@session_auto_reconnect
-def save_log(msg):
-    # Encode the json data
-    json_data = json.dumps(msg.get("data", None), cls=GobTypeJSONEncoder)
-
-    # Create the log record
-    record = Log(
-        timestamp=datetime.datetime.strptime(msg["timestamp"], "%Y-%m-%dT%H:%M:%S.%f"),
-        process_id=msg.get("process_id", None),
-        source=msg.get("source", None),
-        application=msg.get("application", None),
-        destination=msg.get("destination", None),
-        catalogue=msg.get("catalogue", None),
-        entity=msg.get("entity", None),
-        level=msg.get("level", None),
-        name=msg.get("name", None),
-        msgid=msg.get("id", None),
-        msg=msg.get("msg", None),
-        jobid=msg.get("jobid", None),
-        stepid=msg.get("stepid", None),
-        data=json_data,
-    )
+@contextmanager
+def unit_of_work():
+    """Execute the storage functions within the context in one transaction
+
+    Storage functions flush their changes instead of committing them.
+    The transaction is committed once at the end of the context or rolled back on any exception.
+    Functions that are registered by after_commit are executed once the transaction has been committed.
+
+    A unit of work within a unit of work is part of the outer unit of work.
+    """
+    if getattr(_unit_of_work, "after_commit", None) is not None:
+        yield
+        return
+
+    _unit_of_work.after_commit = []
     try:
-        session.add(record)
+        yield
         session.commit()
-    except IntegrityError:
-        print("ERROR: skip log message for non-existent job")
+    except BaseException:
+        _rollback()
+        raise
+    finally:
+        after_commit_functions, _unit_of_work.after_commit = _unit_of_work.after_commit, None
+    for func in after_commit_functions:
+        func()
+
+
+def in_unit_of_work(func):
+    """Wrapper to execute a message handler in one unit of work
+
+    The handler is protected against connection loss.
+    When the connection is lost the unit of work is rolled back and the handler is executed again.
+    Every execution gets its own copy of the message,
+    changes that a rolled back execution has made to the message are not seen by the next execution.
+
+    :param func: function that handles the message that is passed as first argument
+    :return: the wrapped function
+    """
+
+    @functools.wraps(func)
+    def wrapper(msg, *args, **kwargs):
+        with unit_of_work():
+            return func(copy_message(msg), *args, **kwargs)
+
+    return session_auto_reconnect(wrapper)
+
+
+def after_commit(func, *args, **kwargs):
+    """Execute a function after the current unit of work has been committed
+
+    Side effects, like publishing messages, should not be visible before the changes are committed.
+    Outside a unit of work the function is executed immediately.
+
+    :param func:
+    :return: None
+    """
+    if getattr(_unit_of_work, "after_commit", None) is not None:
+        _unit_of_work.after_commit.append(functools.partial(func, *args, **kwargs))
+    else:
+        func(*args, **kwargs)
+
+
+def _commit():
+    # Within a unit of work the changes are flushed, the unit of work commits them
+    if getattr(_unit_of_work, "after_commit", None) is not None:
+        session.flush()
+    else:
+        session.commit()
+
+
+# Log and AuditLog attributes in the order in which they are bulk loaded
+LOG_FIELDS = (
+    "timestamp",
+    "process_id",
+    "source",
+    "application",
+    "destination",
+    "catalogue",
+    "entity",
+    "level",
+    "name",
+    "msgid",
+    "msg",
+    "jobid",
+    "stepid",
+    "data",
+)
+AUDIT_LOG_FIELDS = ("timestamp", "source", "destination", "type", "data", "request_uuid")
+
+
+def _column_names(model, fields):
+    return ", ".join(model.__mapper__.columns[field].name for field in fields)
+
+
+def _copy_value(value):
+    # Encode a value in the PostgreSQL COPY text format
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+def _copy_rows(connection, model, table, fields, records):
+    """Bulk load records in the given table by using COPY FROM STDIN
+
+    Values for JSON columns are serialized like the ORM serializes them
+
+    :param connection: connection on which the records are loaded
+    :param model: model class of the records
+    :param table: name of the table to load
+    :param fields: model attributes in the order of the record values
+    :param records: list of tuples
+    :return: None
+    """
+    json_values = [i for i, field in enumerate(fields) if isinstance(model.__mapper__.columns[field].type, JSON)]
+    lines = []
+    for record in records:
+        if json_values:
+            record = list(record)
+            for i in json_values:
+                record[i] = json.dumps(record[i])
+        lines.append("\t".join([_copy_value(value) for value in record]))
+    lines.append("")
+
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {table} ({_column_names(model, fields)}) FROM STDIN", io.StringIO("\n".join(lines)))
+
+
+def _rollback():
+    # Rollback after a failed unit of work, the connection might already have been lost
+    try:
         session.rollback()
+    except Exception as e:
+        print(f"Rollback failed: {str(e)}")
 
 
-@session_auto_reconnect
-def save_audit_log(msg):
-    record = AuditLog(
-        timestamp=datetime.datetime.strptime(msg["timestamp"], "%Y-%m-%dT%H:%M:%S.%f"),
-        source=msg.get("source"),
-        destination=msg.get("destination"),
-        type=msg.get("type"),
-        data=msg.get("data"),
-        request_uuid=msg.get("request_uuid"),
-    )
-    session.add(record)
-    session.commit()
+def save_logs(records):
+    """Save log records
 
+    Not protected by auto reconnect, a batch writer spools the records when the connection has been lost
+    Runs on its own connection so that it can be called from the flusher thread of a batch writer
 
-@session_auto_reconnect
-def get_services():
-    """Get services
+    The records are bulk loaded in a staging table and then moved to the logs table in one statement.
+    The staging table is a temporary table, its contents are not written to the WAL
+    and are cleared on commit.
 
-    :return: All current services (alive or dead)
+    Records that refer to a non-existent job or jobstep are skipped
+
+    Every log is identified by a hash of its contents.
+    Records that have already been stored, e.g. because a batch of log messages has been redelivered, are skipped.
+    This makes it safe to save the same records more than once.
+
+    The log counters per job, jobstep and level are increased with the number of stored records.
+
+    :param records: list of tuples with the values for LOG_FIELDS
+    :return: None
     """
-    return session.query(Service).all()
+    with engine.begin() as connection:
+        stored = _save_logs(connection, records)
 
+    skipped = len(records) - stored
+    if skipped:
+        print(f"Skip {skipped} log message(s) for non-existent job or already stored")
 
-@session_auto_reconnect
-def mark_service_dead(service):
-    """Mark a service as not being alive anymore
 
-    :param service: the service to mark as dead
+def _save_logs(connection, records):
+    columns = _column_names(Log, LOG_FIELDS)
+    connection.execute(
+        text(
+            "CREATE TEMPORARY TABLE IF NOT EXISTS logs_staging ON COMMIT DELETE ROWS AS "
+            f"SELECT {columns} FROM logs WITH NO DATA"
+        )
+    )
+    _copy_rows(connection, Log, "logs_staging", LOG_FIELDS, records)
+    return connection.execute(
+        text(
+            f"""
+WITH inserted AS (
+    INSERT INTO logs ({columns}, msghash)
+    SELECT {columns}, md5(s::text)::uuid
+    FROM   logs_staging s
+    WHERE  (s.jobid IS NULL OR EXISTS (SELECT 1 FROM jobs j WHERE j.id = s.jobid))
+    AND    (s.stepid IS NULL OR EXISTS (SELECT 1 FROM jobsteps js WHERE js.id = s.stepid))
+    ON CONFLICT DO NOTHING
+    RETURNING jobid, stepid, level
+), counted AS (
+    INSERT INTO log_counters (jobid, stepid, level, count)
+    SELECT   jobid, coalesce(stepid, 0), coalesce(level, ''), count(*)
+    FROM     inserted
+    WHERE    jobid IS NOT NULL
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (jobid, stepid, level) DO UPDATE SET count = log_counters.count + excluded.count
+)
+SELECT count(*) FROM inserted
+"""
+        )
+    ).scalar()
+
+
+def save_audit_logs(records):
+    """Save audit log records
+
+    The records are bulk loaded in the audit logs table
+
+    Not protected by auto reconnect, a batch writer spools the records when the connection has been lost
+    Runs on its own connection so that it can be called from the flusher thread of a batch writer
+
+    :param records: list of tuples with the values for AUDIT_LOG_FIELDS
     :return: None
     """
-    # mark as dead
-    service.is_alive = False
-    # remove any tasks
-    _update_servicetasks(service, [])
-    session.commit()
+    with engine.begin() as connection:
+        _copy_rows(connection, AuditLog, "audit_logs", AUDIT_LOG_FIELDS, records)
 
 
-@session_auto_reconnect
-def remove_service(service):
-    """Remove a service
+def create_log_partitions(months):
+    """Create the monthly logs partitions for the given months
+
+    Existing partitions are left untouched
+    Logs of a month that have been stored in the default partition are moved to the new partition of the month
 
-    :param service: the servie to remove
+    Runs on its own connection so that it can be called from a scheduled task
+
+    :param months: list of dates, any date within a month identifies the month
     :return: None
     """
-    # remove any tasks
-    _update_servicetasks(service, [])
+    with engine.begin() as connection:
+        for month in months:
+            connection.execute(text("SELECT create_log_partition(:month)"), {"month": month})
 
-    try:
-        # remove service
-        session.query(Service).filter(Service.host == service.host).filter(Service.name == service.name).delete()
-        session.commit()
-    except ObjectDeletedError:
-        # This method can be called for the same service by multiple workflow instances
-        # A conflict can occur and can safely be ignored
-        print(f"Ignore conflicting service deletion for service {service.name}")
+
+def drop_log_partitions(before):
+    """Drop all monthly logs partitions that end on or before the given date
+
+    Dropping a partition removes its logs without row-level deletes
+
+    Runs on its own connection so that it can be called from a scheduled task
+
+    :param before: date
+    :return: names of the dropped partitions
+    """
+    dropped = []
+    with engine.begin() as connection:
+        partitions = connection.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'logs'::regclass ORDER BY c.relname"
+            )
+        )
+        for (name,) in partitions.fetchall():
+            match = re.fullmatch(r"logs_(\d{4})_(\d{2})", name)
+            if match and _next_month(datetime.date(int(match[1]), int(match[2]), 1)) <= before:
+                connection.execute(text(f"ALTER TABLE logs DETACH PARTITION {name}"))
+                connection.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+    return dropped
+
+
+def _next_month(month):
+    return (month.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def purge_jobs(before, batch_size, job_type=None, exclude_types=()):
+    """Delete a batch of jobs that have started before the given time and that have ended
+
+    The tasks, logs and jobsteps of the jobs are deleted with one statement per table.
+
+    Runs on its own connection so that it can be called from a scheduled task
+
+    :param before: datetime
+    :param batch_size: maximum number of jobs to delete
+    :param job_type: type of the jobs to delete, if None jobs of any type except exclude_types are deleted
+    :param exclude_types: job types that should not be deleted
+    :return: ids of the deleted jobs
+    """
+    if job_type is None:
+        type_filter = or_(Job.type == None, Job.type.notin_(exclude_types))  # noqa: E711
+    else:
+        type_filter = Job.type == job_type
+
+    with engine.begin() as connection:
+        ids = [
+            id
+            for id, in connection.execute(
+                select(Job.id)
+                .where(Job.start < before, Job.end != None, type_filter)  # noqa: E711
+                .order_by(Job.id)
+                .limit(batch_size)
+            )
+        ]
+        if ids:
+            for table in ["tasks", "logs", "log_counters", "jobsteps"]:
+                connection.execute(text(f"DELETE FROM {table} WHERE jobid = ANY(:ids)"), {"ids": ids})
+            connection.execute(text("DELETE FROM jobs WHERE id = ANY(:ids)"), {"ids": ids})
+    for id in ids:
+        known_jobs.set(id, False)
+    return ids
+
+
+def sweep_services(dead_before, remove_before):
+    """Mark services dead and remove services on heartbeat timeout
+
+    Services without a heartbeat since dead_before are marked dead and their tasks are removed
+    Services without a heartbeat since remove_before are removed
+
+    Both are done with set-based statements, the cost does not depend on the number of services or heartbeats
+
+    Runs on its own connection so that it can be called from a scheduled task
+
+    :param dead_before: timestamp before which a service is dead
+    :param remove_before: timestamp before which a service is removed
+    :return: (number of services marked dead, number of services removed)
+    """
+    with engine.begin() as connection:
+        dead = connection.execute(
+            text(
+                """
+WITH dead AS (
+    UPDATE services SET is_alive = false WHERE is_alive AND timestamp < :before RETURNING id
+), tasks AS (
+    DELETE FROM service_tasks WHERE service_id IN (SELECT id FROM dead)
+)
+SELECT count(*) FROM dead
+"""
+            ),
+            {"before": dead_before},
+        ).scalar()
+        removed = connection.execute(
+            text(
+                """
+WITH removed AS (
+    DELETE FROM services WHERE timestamp < :before RETURNING id
+), tasks AS (
+    DELETE FROM service_tasks WHERE service_id IN (SELECT id FROM removed)
+)
+SELECT count(*) FROM removed
+"""
+            ),
+            {"before": remove_before},
+        ).scalar()
+    return dead, removed
+
+
+def end_zombie_jobs(started_before, status, exclude_types=()):
+    """End zombie jobs and their open steps
+
+    Zombie jobs are jobs that have not ended and that have started before started_before.
+    The jobs and their open steps are ended with the given status in one set-based statement.
+    The other workflow instances are notified of every ended job.
+
+    Runs on its own connection so that it can be called from a scheduled task
+
+    :param started_before: timestamp before which a running job is a zombie
+    :param status: end status of the jobs and steps
+    :param exclude_types: job types of which zombie jobs should not be ended
+    :return: ids of the ended jobs
+    """
+    with engine.begin() as connection:
+        ids = [
+            id
+            for id, in connection.execute(
+                text(
+                    """
+WITH zombies AS (
+    UPDATE jobs SET "end" = :now, status = :status
+    WHERE "end" IS NULL AND start < :before AND (type IS NULL OR NOT type = ANY(:exclude_types))
+    RETURNING id
+), steps AS (
+    UPDATE jobsteps SET "end" = :now, status = :status
+    WHERE "end" IS NULL AND jobid IN (SELECT id FROM zombies)
+)
+SELECT id FROM zombies ORDER BY id
+"""
+                ),
+                {
+                    "now": datetime.datetime.utcnow(),
+                    "status": status,
+                    "before": started_before,
+                    "exclude_types": list(exclude_types),
+                },
+            )
+        ]
+        if ids:
+            # Sent to the other workflow instances when the transaction commits
+            connection.execute(
+                text("SELECT pg_notify(:channel, :instance || ' ' || id) FROM unnest(CAST(:ids AS INTEGER[])) AS id"),
+                {"channel": JOB_CHANGES_CHANNEL, "instance": INSTANCE_ID, "ids": ids},
+            )
+    for id in ids:
+        job_cache.evict(id)
+    return ids
 
 
 @session_auto_reconnect
 def update_service(service, tasks):
     """Update service state in storage
 
+    The service and its tasks are updated in one transaction
+
     :param service:
-    :param tasks:
+    :param tasks: the current tasks of the service, None to leave the tasks unchanged
     :return: None
     """
     # Get the current service or create it if not yet exists
@@ -261,88 +710,126 @@ def update_service(service, tasks):
     else:
         current = Service(**service)
         session.add(current)
-        session.commit()
+        # Assign an id to the new service
+        session.flush()
 
     # Update status with current tasks
-    _update_servicetasks(current, tasks)
+    if tasks is not None:
+        _update_servicetasks(current, tasks)
 
-    session.commit()
+    _commit()
+
+
+def update_service_timestamps(timestamps):
+    """Update the heartbeat timestamps of services in one statement
+
+    A timestamp is only moved forward, other workflow instances may have registered a more recent heartbeat
+
+    Runs on its own connection so that it can be called from a scheduled task
+
+    :param timestamps: list of (name, host, timestamp)
+    :return: None
+    """
+    if not timestamps:
+        return
+
+    values = ", ".join(
+        f"(CAST(:name_{i} AS VARCHAR), CAST(:host_{i} AS VARCHAR), CAST(:timestamp_{i} AS TIMESTAMP))"
+        for i in range(len(timestamps))
+    )
+    params = {}
+    for i, (name, host, timestamp) in enumerate(timestamps):
+        params.update({f"name_{i}": name, f"host_{i}": host, f"timestamp_{i}": timestamp})
+
+    with engine.begin() as connection:
+        connection.execute(
+            text(
+                "UPDATE services s SET timestamp = v.timestamp "
+                f"FROM (VALUES {values}) AS v(name, host, timestamp) "
+                "WHERE s.name = v.name AND s.host IS NOT DISTINCT FROM v.host AND s.timestamp < v.timestamp"
+            ),
+            params,
+        )
 
 
-@session_auto_reconnect
 def _update_servicetasks(service, tasks):
     """Update tasks
 
     Delete all current tasks that are not in tasks
-    Update or add all taska with the current status
+    Update or add all tasks with the current status
 
     A service (eg Workflow, Upload, Import) runs multiple tasks (eg MainThread, QueueHandler, Eventloop, ...)
 
-    :param current_tasks:
+    Tasks are reconciled in one statement, a task is identified by its service and name.
+    Concurrent updates of the same service by multiple workflow instances do not conflict.
+
+    :param service:
     :param tasks:
-    :return:
+    :return: None
     """
-    # Update db and refresh model
-    session.commit()
+    tasks = list(tasks)
+    changes = session.execute(
+        text(
+            """
+WITH reported AS (
+    SELECT * FROM unnest(CAST(:names AS VARCHAR[]), CAST(:is_alive AS BOOLEAN[])) AS r(name, is_alive)
+), upserted AS (
+    INSERT INTO service_tasks (service_id, service_name, name, is_alive)
+    SELECT :service_id, :service_name, name, is_alive FROM reported
+    ON CONFLICT (service_id, name) DO UPDATE SET is_alive = excluded.is_alive
+    WHERE service_tasks.is_alive IS DISTINCT FROM excluded.is_alive
+    RETURNING name, xmax = 0 AS registered
+), removed AS (
+    DELETE FROM service_tasks
+    WHERE  service_id = :service_id AND name NOT IN (SELECT name FROM reported)
+    RETURNING name
+)
+SELECT 'Register', name FROM upserted WHERE registered
+UNION ALL
+SELECT 'Remove', name FROM removed
+"""
+        ),
+        {
+            "service_id": service.id,
+            "service_name": service.name,
+            "names": [task["name"] for task in tasks],
+            "is_alive": [task.get("is_alive") for task in tasks],
+        },
+    )
+    for action, name in changes:
+        print(f"{action} task {service.name}.{name}")
 
-    try:
-        # Get currently registered tasks for the service
-        current_tasks = session.query(ServiceTask).filter(ServiceTask.service_id == service.id).all()
 
-        _mark_dangling_tasks(current_tasks, service, tasks)
+def _snapshot(instance):
+    return snapshot({column.key: getattr(instance, column.key) for column in instance.__table__.columns})
 
-        _mark_active_tasks(current_tasks, service, tasks)
 
-        # Update db and refresh model
-        session.commit()
+def _update(model, info):
+    # Update the row with the id in info and return a snapshot of the updated row
+    table = model.__table__
+    values = {key: value for key, value in info.items() if key != "id"}
+    row = session.execute(
+        update(table).where(table.c.id == info["id"]).values(**values).returning(*table.columns)
+    ).first()
+    return None if row is None else snapshot(dict(row._mapping))
 
-        # Remove any dangling tasks or tasks that have been marked for deletion
-        session.query(ServiceTask).filter(ServiceTask.service_id == None).delete()  # noqa: E711
-        session.commit()
 
-    except ObjectDeletedError:
-        # This method can be called for the same service by multiple workflow instances
-        # A conflict can occur and can safely be ignored
-        print(f"Ignore conflicting task deletions for service {service.name}")
-
-
-def _mark_active_tasks(current_tasks, service, tasks):
-    # Add or update tasks that are active
-    # This part will run on every heartbeat message
-    for task in tasks:
-        matches = [t for t in current_tasks if t.name == task["name"]]
-        if len(matches) == 0:
-            # Register new task
-            print(f"Register task {service.name}.{task['name']}")
-            task = ServiceTask(**task)
-            task.service_id = service.id
-            session.add(task)
-        else:
-            # Register alive-status of already existent task
-            matches[0].is_alive = task["is_alive"]
-
-
-def _mark_dangling_tasks(current_tasks, service, tasks):
-    # Delete tasks that have ended by detaching the tasks from the service
-    # Each heartbeat contains the running tasks
-    # When a service is marked dead then the task list argument is empty and all tasks will get deleted
-    for task in current_tasks:
-        matches = [t for t in tasks if t["name"] == task.name]
-        if len(matches) == 0:
-            print(f"Remove task {service.name}.{task.name}")
-            task.service_id = None
+# Job attributes that, together with the job type, identify duplicate jobs
+FINGERPRINT_ATTRIBUTES = ["catalogue", "collection", "attribute", "application"]
 
 
-@session_auto_reconnect
-def job_get(job_id):
-    """Returns task with task_id
+def _fingerprint(job_type, values):
+    """Returns the text of which the md5 hash is the fingerprint of a job
 
-    :param task_id:
+    The jobs.fingerprint column is generated by the database with the same expression:
+    md5(coalesce(type, '') || coalesce(':' || catalogue, '') || ... || coalesce(':' || application, ''))
+
+    :param job_type:
+    :param values: values of the fingerprint attributes
     :return:
     """
-    # Force fetching latest job
-    session.commit()
-    return session.query(Job).get(job_id)
+    attributes = [f":{values[attr]}" for attr in FINGERPRINT_ATTRIBUTES if values.get(attr) is not None]
+    return (job_type or "") + "".join(attributes)
 
 
 @session_auto_reconnect
@@ -363,12 +850,15 @@ def job_runs(jobinfo: Job, msg: dict, allow_start_new_when_zombie: bool = True)
 
     Otherwise a job is not a duplicate and should be started.
 
+    Running jobs are found by their fingerprint, the hash of the job type and the model.
+    The fingerprint is indexed for running jobs, the other criteria are checked on the jobs with the same fingerprint.
+
     :param jobinfo: current Job
     :param msg: Dict containing parameters to the workflow
     :return: True if a running job is found, else False
     """
     header = msg.get("header")
-    check_args = ["catalogue", "collection", "attribute", "application"]
+    check_args = FINGERPRINT_ATTRIBUTES
     job_args = [header.get(key) for key in ["destination", "entity_id", "source"] if header.get(key)]
 
     job = (
@@ -378,6 +868,9 @@ def job_runs(jobinfo: Job, msg: dict, allow_start_new_when_zombie: bool = True)
         .filter_by(**{arg: header.get(arg) for arg in check_args})
         .filter(cast(Job.args, ARRAY(String)).contains(cast(job_args, ARRAY(String))))
         .filter(Job.end == None)  # noqa E711 (== None)
+        .filter(
+            text("jobs.fingerprint = md5(:fingerprint)").bindparams(fingerprint=_fingerprint(jobinfo["type"], header))
+        )
         .order_by(Job.start.desc())
         .first()
     )
@@ -403,21 +896,106 @@ def job_save(job_info):
     """
     job = Job(**job_info)
     session.add(job)
-    session.commit()
+    # Assign an id to the new job
+    session.flush()
+    job = _snapshot(job)
+    _commit()
+    after_commit(known_jobs.set, job.id, True)
+    after_commit(job_cache.set_job, job)
     return job
 
 
+def job_exists(job_id):
+    """Tells whether the job with the given id exists
+
+    Existing jobs are cached, jobs that are created or purged by this process update the cache
+    A job that is not found is not cached, it may be created later by another workflow instance
+
+    The check does not wait for a lost connection to be restored.
+    A job that cannot be checked is assumed to exist, it is checked again when its logs are saved.
+    Jobs cannot be checked while there is no engine, eg while reconnecting,
+    and after a failed check the storage is not queried for RECONNECT_INTERVAL seconds.
+
+    :param job_id:
+    :return: True if the job exists or cannot be checked
+    """
+    global _check_jobs_after
+
+    exists = known_jobs.get(job_id)
+    if exists is None:
+        # The engine is replaced by a reconnect in another thread
+        current_engine = engine
+        if current_engine is None or time.monotonic() < _check_jobs_after:
+            return True
+        try:
+            with current_engine.connect() as connection:
+                exists = connection.execute(select(Job.id).where(Job.id == job_id)).first() is not None
+        except DBAPIError as e:
+            print(f"Job {job_id} not checked, connection problem ({str(e)})")
+            _check_jobs_after = time.monotonic() + RECONNECT_INTERVAL
+            return True
+        if exists:
+            known_jobs.set(job_id, True)
+    return exists
+
+
 @session_auto_reconnect
 def job_update(job_info):
     """
     Update Job using the information in job_info
+
+    The job is updated without reading it first, the updated job replaces the job in the job cache
+
     :param job_info: Job attributes
-    :return: Job instance
+    :return: job snapshot or None if the job does not exist
     """
-    job = session.query(Job).get(job_info["id"])
-    for key, value in job_info.items():
-        setattr(job, key, value)
-    session.commit()
+    job = _update(Job, job_info)
+    if job is not None:
+        _notify_job_change(job.id)
+    _commit()
+    if job is not None:
+        after_commit(job_cache.set_job, job)
+    return job
+
+
+@session_auto_reconnect
+def job_add_log_counts(job_id, log_counts):
+    """Add log counts to the log counts of a job
+
+    The counts are added per log type in one statement.
+    Results of the same job that are handled at the same time by multiple workflow instances do not lose counts.
+
+    :param job_id:
+    :param log_counts: number of log messages per log type, eg {"data_warnings": 5}
+    :return: job snapshot or None if the job does not exist
+    """
+    row = session.execute(
+        text(
+            """
+UPDATE jobs SET log_counts = (
+    SELECT CAST(jsonb_object_agg(key, count) AS JSON)
+    FROM (
+        SELECT key, sum(CAST(value AS BIGINT)) AS count
+        FROM (
+            SELECT * FROM jsonb_each_text(COALESCE(CAST(jobs.log_counts AS JSONB), '{}'))
+            UNION ALL
+            SELECT * FROM jsonb_each_text(CAST(:log_counts AS JSONB))
+        ) AS counts
+        GROUP BY key
+    ) AS totals
+)
+WHERE id = :id
+RETURNING *
+"""
+        ),
+        {"id": job_id, "log_counts": json.dumps(log_counts)},
+    ).first()
+    job = None if row is None else snapshot(dict(row._mapping))
+    if job is not None:
+        _notify_job_change(job.id)
+    _commit()
+    if job is not None:
+        after_commit(job_cache.set_job, job)
     return job
 
 
@@ -426,11 +1004,15 @@ def step_save(step_info):
     """
     Create JobStep using the information in step_info and store it
     :param step_info: JobStep attributes
-    :return: JobStep instance
+    :return: step snapshot
     """
     step = JobStep(**step_info)
     session.add(step)
-    session.commit()
+    # Assign an id to the new step
+    session.flush()
+    step = _snapshot(step)
+    _commit()
+    after_commit(job_cache.set_step, step)
     return step
 
 
@@ -438,14 +1020,18 @@ def step_save(step_info):
 def step_update(step_info):
     """
     Update JobStep using the information in step_info
+
+    The step is updated without reading it first, the updated step replaces the step in the job cache
+
     :param step_info: JobStep attributes
-    :return: JobStep instance
+    :return: step snapshot or None if the step does not exist
     """
-    step = session.query(JobStep).get(step_info["id"])
-    if step:
-        for key, value in step_info.items():
-            setattr(step, key, value)
-        session.commit()
+    step = _update(JobStep, step_info)
+    if step is not None:
+        _notify_job_change(step.jobid)
+    _commit()
+    if step is not None:
+        after_commit(job_cache.set_step, step)
     return step
 
 
@@ -469,7 +1055,7 @@ def task_save(task_info):
     """
     task = Task(**task_info)
     session.add(task)
-    session.commit()
+    _commit()
     return task
 
 
@@ -483,7 +1069,7 @@ def task_update(task_info):
     task = session.query(Task).get(task_info["id"])
     for key, value in task_info.items():
         setattr(task, key, value)
-    session.commit()
+    _commit()
     return task
 
 
@@ -499,7 +1085,7 @@ def task_lock(task):
         .filter(and_(Task.id == task.id, Task.lock == None))  # noqa: E711
         .update({"lock": int(datetime.datetime.now().timestamp())})
     )
-    session.commit()
+    _commit()
 
     return step_cnt > 0
 
@@ -514,7 +1100,7 @@ def task_unlock(task):
     step_cnt = (
         session.query(Task).filter(and_(Task.id == task.id, Task.lock != None)).update({"lock": None})  # noqa: E711
     )
-    session.commit()
+    _commit()
     assert step_cnt > 0, "Task was already unlocked. That can't be right."
 
 
@@ -533,10 +1119,22 @@ def get_job_step(jobid, stepid):
     """
     Retrieve the job and step for the given ids
 
+    Active jobs and their steps are served from the job cache
+
     :param jobid: identification of the job
     :param stepid: identification of the step
-    :return: Job and JobStep object for the given ids
+    :return: Job and JobStep snapshot for the given ids, None for a job or step that does not exist
     """
-    job = session.query(Job).get(jobid)
-    step = session.query(JobStep).get(stepid)
+    _receive_job_changes()
+    job = job_cache.get_job(jobid)
+    step = job_cache.get_step(jobid, stepid)
+    if job is None or step is None:
+        job = session.query(Job).get(jobid)
+        step = session.query(JobStep).get(stepid)
+        job = None if job is None else _snapshot(job)
+        step = None if step is None else _snapshot(step)
+        if job is not None:
+            after_commit(job_cache.set_job, job)
+            if step is not None:
+                after_commit(job_cache.set_step, step)
     return job, step
@@ -0,0 +1,142 @@
+"""Worker pool
+
+Handles the messages of one or more services by a pool of worker threads
+
+Every worker has its own queue of messages.
+A message is dispatched to a worker by the id of its job, whatever service it has been received by.
+The messages of one job are handled by the same worker in the order in which they have been received,
+the messages of different jobs are handled in parallel.
+Messages without a job id are all handled by the same worker in the order in which they have been received.
+
+The message broker acknowledges a message when its handler returns, for a worker pool that is when the message
+has been dispatched. The queues of the workers are bounded, dispatching waits when the queue of the worker is full.
+The size of the queues limits the number of messages that are lost when the process is killed.
+When the process exits normally the queued messages are handled before the process ends.
+
+A message of which the handler fails has already been acknowledged and cannot be redelivered.
+The failure is printed with its traceback and reported by the on_error function of the pool.
+
+Handlers of services with a worker pool run concurrently, they should be thread safe.
+Every worker thread has its own database session and unit of work.
+"""
+import atexit
+import functools
+import queue
+import threading
+import traceback
+
+
+def _jobid(msg):
+    # Workflow messages hold the job id in their header, progress messages hold it in the message itself
+    return msg.get("header", {}).get("jobid") or msg.get("jobid")
+
+
+class WorkerPool:
+    def __init__(self, name, size, max_queued, on_error=None):
+        """Constructor
+
+        :param name: Name of the pool, used as prefix for the names of the worker threads
+        :param size: Number of worker threads
+        :param max_queued: Maximum number of messages that are queued for a worker
+        :param on_error: Function that reports a message of which the handler has failed, called with the message
+                         and the exception
+        """
+        self.name = name
+        self.size = size
+        self.on_error = on_error
+
+        self._queues = [queue.Queue(maxsize=max_queued) for _ in range(size)]
+        self._workers = []
+
+    def handler(self, handler):
+        """Get a handler that dispatches the messages of a service to the pool
+
+        :param handler: Function that handles a message of the service
+        :return: the handler for the service
+        """
+        return functools.partial(self.dispatch, handler)
+
+    def dispatch(self, handler, msg):
+        """Dispatch a message to the worker of its job
+
+        Waits while the queue of the worker is full
+
+        :param handler: Function that handles the message
+        :param msg: Message to handle
+        :return: None
+        """
+        jobid = _jobid(msg)
+        worker = 0 if jobid is None else hash(jobid) % self.size
+        self._queues[worker].put((handler, msg))
+
+    def start(self):
+        """Start the worker threads
+
+        The queued messages are handled when the process exits
+
+        :return: None
+        """
+        if not self._workers:
+            for worker, messages in enumerate(self._queues):
+                thread = threading.Thread(target=self._work, args=(messages,), name=f"{self.name}{worker}", daemon=True)
+                thread.start()
+                self._workers.append(thread)
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the worker threads once they have handled all queued messages
+
+        :return: None
+        """
+        for messages in self._queues:
+            messages.put(None)
+        for thread in self._workers:
+            thread.join()
+        self._workers = []
+
+    def _work(self, messages):
+        while True:
+            item = messages.get()
+            if item is None:
+                return
+            self._handle(*item)
+
+    def _handle(self, handler, msg):
+        try:
+            handler(msg)
+        except Exception as e:
+            print(f"ERROR: {self.name} handler failed for job {_jobid(msg)}: {str(e)}")
+            traceback.print_exc()
+            self._report(msg, e)
+
+    def _report(self, msg, error):
+        if self.on_error is None:
+            return
+        try:
+            self.on_error(msg, error)
+        except Exception as e:
+            print(f"ERROR: {self.name} failure of job {_jobid(msg)} not reported: {str(e)}")
+
+
+def with_worker_pools(services, pools, max_queued, on_error=None):
+    """Get the service definitions in which the handlers of services with workers dispatch to a worker pool
+
+    The services of a pool share its workers, the messages of one job are handled by one worker whatever
+    service they have been received by. The worker pools are started.
+    Services that report the result of their handler keep handling their messages in the message broker thread.
+
+    :param services: Service definitions
+    :param pools: Number of workers and the names of its services per pool name, pools without workers are skipped
+    :param max_queued: Maximum number of messages that are queued for a worker
+    :param on_error: Function that reports a message of which the handler has failed
+    :return: the service definitions
+    """
+    result = dict(services)
+    for name, (size, service_names) in pools.items():
+        pooled = [service for service in service_names if service in services and "report" not in services[service]]
+        if size > 0 and pooled:
+            pool = WorkerPool(name, size, max_queued, on_error)
+            pool.start()
+            for service in pooled:
+                result[service] = {**services[service], "handler": pool.handler(services[service]["handler"])}
+    return result
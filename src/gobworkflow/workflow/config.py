@@ -33,6 +33,7 @@ from gobcore.message_broker.config import (
     RELATE_UPDATE_VIEW,
 )
 
+from gobworkflow.workflow.message import with_header
 from gobworkflow.workflow.start import has_no_errors, start_step
 
 START = "start"  # workflow[START] is the name of the first step in a workflow
@@ -108,29 +109,11 @@ WORKFLOWS = {
             "next": [{"step": UPDATE_MODEL}],
         },
         UPDATE_MODEL: {
-            "function": lambda msg: start_step(
-                APPLY,
-                {
-                    **msg,
-                    "header": {
-                        **msg["header"],
-                        "suppress_notifications": True,
-                    },
-                },
-            ),
+            "function": lambda msg: start_step(APPLY, with_header(msg, suppress_notifications=True)),
             "next": [{"step": IMPORT_COMPARE}],
         },
         IMPORT_COMPARE: {
-            "function": lambda msg: start_step(
-                COMPARE,
-                {
-                    **msg,
-                    "header": {
-                        **msg["header"],
-                        "suppress_notifications": False,
-                    },
-                },
-            ),
+            "function": lambda msg: start_step(COMPARE, with_header(msg, suppress_notifications=False)),
             "next": [{"step": IMPORT_UPLOAD}],
         },
         IMPORT_UPLOAD: {
@@ -1,6 +1,9 @@
 from gobcore.message_broker import publish
 from gobcore.message_broker.config import WORKFLOW_EXCHANGE
 
+from gobworkflow.storage.storage import after_commit
+from gobworkflow.workflow.message import copy_message
+
 HOOK_KEY = "result_key"
 
 
@@ -16,11 +19,11 @@ def on_workflow_progress(msg):
     key = _get_hook_key(msg)
     if not key:
         return
-    publish(WORKFLOW_EXCHANGE, key, msg)
+    after_commit(publish, WORKFLOW_EXCHANGE, key, copy_message(msg))
 
 
 def handle_result(msg):
     key = _get_hook_key(msg)
     if not key:
         return
-    publish(WORKFLOW_EXCHANGE, key, msg)
+    after_commit(publish, WORKFLOW_EXCHANGE, key, copy_message(msg))
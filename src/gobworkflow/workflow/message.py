@@ -0,0 +1,32 @@
+"""Workflow messages
+
+Workflow messages can carry large contents and summaries.
+Messages are never deep-copied. A copy of a message shares all its contents with the original message,
+only the layers that the workflow changes, the message itself and its header, are copied.
+"""
+
+
+def copy_message(msg):
+    """Returns a copy of the message that can be changed without changing the original message
+
+    The message and its header are copied, any other content is shared with the original message
+
+    :param msg:
+    :return:
+    """
+    msg_copy = {**msg}
+    if "header" in msg:
+        msg_copy["header"] = {**msg["header"]}
+    return msg_copy
+
+
+def with_header(msg, **header):
+    """Returns a copy of the message with the given header values
+
+    The message and its header are copied, any other content is shared with the original message
+
+    :param msg:
+    :param header: header values
+    :return:
+    """
+    return {**msg, "header": {**msg.get("header", {}), **header}}
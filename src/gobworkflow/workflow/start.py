@@ -10,6 +10,8 @@ from gobcore.message_broker import publish
 from gobcore.message_broker.config import WORKFLOW_EXCHANGE
 
 from gobworkflow.config import LOG_HANDLERS, LOG_NAME
+from gobworkflow.storage.storage import after_commit
+from gobworkflow.workflow.message import copy_message
 
 # Special return value that a function can return to end the current workflow
 END_OF_WORKFLOW = "END_OF_WORKFLOW"
@@ -32,7 +34,8 @@ def start_workflow(workflow_name, step_name, msg):
 
 
 def start_step(key, msg):
-    publish(WORKFLOW_EXCHANGE, f"{key}.request", msg)
+    # The step is requested once the step has been committed, the message may change in the meantime
+    after_commit(publish, WORKFLOW_EXCHANGE, f"{key}.request", copy_message(msg))
 
 
 def has_no_errors(msg):
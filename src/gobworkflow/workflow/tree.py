@@ -8,6 +8,8 @@ from gobworkflow.workflow.config import WORKFLOWS, IMPORT
 
 tree = WorkflowTreeNode.from_dict(WORKFLOWS[IMPORT])
 
+Nodes are looked up by name in an index that is built on the first lookup.
+A tree should not be changed once nodes have been looked up.
 
 """
 from typing import Callable, List
@@ -34,6 +36,9 @@ class WorkflowTreeNode:
         # context'
         self.header_parameters = {}
 
+        # Nodes in this tree by name, built on the first lookup
+        self._index = None
+
     @staticmethod
     def from_dict(workflow: dict, step_name=START) -> "WorkflowTreeNode":
         """
@@ -84,18 +89,32 @@ class WorkflowTreeNode:
     def get_node(self, name):
         """Returns node by name
 
+        If multiple nodes have the same name, the first node in depth-first order is returned
+
         :param name:
         :return:
         """
-        if self.name == name:
-            return self
+        index = self._index
+        if index is None:
+            index = self.build_index()
+        return index.get(name)
 
-        for n in self.next:
-            node = n.node.get_node(name)
+    def build_index(self):
+        """Builds the index of the nodes by name that is used by get_node
+
+        The index is only published when it is complete, a tree can be shared by threads once its index is built
 
-            if node:
-                return node
-        return None
+        :return: the index
+        """
+        index = {}
+        self._add_to_index(index)
+        self._index = index
+        return index
+
+    def _add_to_index(self, index):
+        index.setdefault(self.name, self)
+        for n in self.next:
+            n.node._add_to_index(index)
 
     def append_node(self, node: "WorkflowTreeNode", condition=None):
         """Appends node to this node
@@ -105,6 +124,7 @@ class WorkflowTreeNode:
         :return:
         """
         self.next.append(NextStep(node, condition))
+        self._index = None
 
     def append_to_names(self, append_str: str):
         """Appends append_str to all node names in this tree.
@@ -114,6 +134,7 @@ class WorkflowTreeNode:
         :return:
         """
         self.name = f"{self.name}_{append_str}"
+        self._index = None
 
         for n in self.next:
             n.node.append_to_names(append_str)
@@ -14,21 +14,54 @@ The result is received from the message broker (which ends the step)
 The result is interpreted by the rules of the workflow
 If a next step is found then this step is started
 If not, the workflow is ended
+
+Workflows are compiled into trees once and are shared by all Workflow instances.
+Dynamic workflows are compiled once per distinct list of workflow steps.
+Compiled trees are never changed, they are indexed before they are shared.
 """
-import copy
+import hashlib
+import json
 
 from gobcore.logging.logger import logger
 from gobcore.message_broker import publish
 from gobcore.status.heartbeat import STATUS_REJECTED, STATUS_START
 from gobcore.workflow.start_workflow import retry_workflow
 
-from gobworkflow.config import LOG_HANDLERS, LOG_NAME
-from gobworkflow.storage.storage import job_get, job_runs, job_update
+from gobworkflow.config import DYNAMIC_WORKFLOW_CACHE_SIZE, LOG_HANDLERS, LOG_NAME
+from gobworkflow.storage.cache import LRUCache
+from gobworkflow.storage.storage import after_commit, job_add_log_counts, job_runs
 from gobworkflow.workflow.config import CONF_ALLOW_START_NEW_WHEN_ZOMBIE, WORKFLOWS
 from gobworkflow.workflow.jobs import job_end, job_start, step_start, step_status
+from gobworkflow.workflow.message import copy_message
 from gobworkflow.workflow.start import END_OF_WORKFLOW, start_step
 from gobworkflow.workflow.tree import WorkflowTreeNode
 
+# Compiled workflow trees by workflow name
+_workflow_trees = {}
+# Compiled dynamic workflow trees by hash of the workflow steps
+_dynamic_workflow_trees = LRUCache(DYNAMIC_WORKFLOW_CACHE_SIZE)
+
+
+def _workflow_tree(workflow_name):
+    tree = _workflow_trees.get(workflow_name)
+    if tree is None:
+        tree = WorkflowTreeNode.from_dict(WORKFLOWS[workflow_name])
+        # Shared trees are indexed before they are published
+        tree.build_index()
+        _workflow_trees[workflow_name] = tree
+    return tree
+
+
+def compile_workflows():
+    """Compile all workflows
+
+    Workflows are otherwise compiled on first use
+
+    :return: None
+    """
+    for workflow_name in WORKFLOWS:
+        _workflow_tree(workflow_name)
+
 
 class Workflow:
     def __init__(self, workflow_name, step_name=None, dynamic_workflow_steps=None):
@@ -48,11 +81,12 @@ class Workflow:
         self._allow_start_new_when_zombie = True
 
         if dynamic_workflow_steps:
-            workflow = self._build_dynamic_workflow(dynamic_workflow_steps)
+            workflow = self._dynamic_workflow(dynamic_workflow_steps)
         else:
-            workflow_dict = WORKFLOWS[self._workflow_name]
-            workflow = WorkflowTreeNode.from_dict(workflow_dict)
-            self._allow_start_new_when_zombie = workflow_dict.get(CONF_ALLOW_START_NEW_WHEN_ZOMBIE, True)
+            workflow = _workflow_tree(self._workflow_name)
+            self._allow_start_new_when_zombie = WORKFLOWS[self._workflow_name].get(
+                CONF_ALLOW_START_NEW_WHEN_ZOMBIE, True
+            )
 
         self._step = workflow if step_name is None else workflow.get_node(step_name)
 
@@ -62,6 +96,15 @@ class Workflow:
             self._workflow_changed = True
             self._step = workflow
 
+    def _dynamic_workflow(self, workflow_steps: list):
+        key = hashlib.sha1(json.dumps(workflow_steps, sort_keys=True).encode()).hexdigest()
+        workflow = _dynamic_workflow_trees.get(key)
+        if workflow is None:
+            workflow = self._build_dynamic_workflow(workflow_steps)
+            workflow.build_index()
+            _dynamic_workflow_trees.set(key, workflow)
+        return workflow
+
     def _build_dynamic_workflow(self, workflow_steps: list):
         """workflow_steps example:
 
@@ -86,6 +129,8 @@ class Workflow:
             },
         ]
 
+        The trees of the workflows are built from scratch, the node names of the trees are changed
+
         :param workflow_steps:
         :return:
         """
@@ -125,7 +170,7 @@ class Workflow:
         :return:
         """
         # Keep the original message for a possible retry
-        original_msg = copy.deepcopy(msg)
+        original_msg = copy_message(msg)
 
         job = None
         msg["header"] = msg.get("header", {})  # init header if not present
@@ -133,9 +178,6 @@ class Workflow:
         if job_id is None:
             msg["header"].update(self._step.header_parameters)
             job = job_start(self._workflow_name, msg)
-            msg["header"] = {
-                **msg.get("header", {}),
-            }
             if job_runs(job, msg, allow_start_new_when_zombie=self._allow_start_new_when_zombie):
                 msg["header"]["process_id"] = job["id"]
                 self.reject(msg, job)
@@ -195,27 +237,12 @@ class Workflow:
                 if not isinstance(on_complete, dict) or not all([key in on_complete for key in ["exchange", "key"]]):
                     logger.error("on_workflow_complete should be a dict with keys 'exchange' and 'key'")
                 else:
-                    publish(on_complete["exchange"], on_complete["key"], msg)
+                    after_commit(publish, on_complete["exchange"], on_complete["key"], copy_message(msg))
                     logger.info(f"Publish on_workflow_complete to {on_complete['exchange']} with {on_complete['key']}")
 
             logger.info("End of workflow")
             job_end(msg["header"].get("jobid"))
 
-    def _update_job_log_counts(self, job, log_counts):
-        current_counts = job.log_counts or {}
-
-        for log_type, count in log_counts.items():
-            if log_type not in current_counts:
-                current_counts[log_type] = 0
-            current_counts[log_type] += count
-
-        job_update(
-            {
-                "id": job.id,
-                "log_counts": current_counts,
-            }
-        )
-
     def handle_result(self):
         """
         Get a handler that processes the result of a workflow step
@@ -233,8 +260,9 @@ class Workflow:
             :param msg: The results of the step that was executed
             :return:
             """
-            job = job_get(msg["header"].get("jobid"))
-            self._update_job_log_counts(job, msg.get("summary", {}).get("log_counts", {}))
+            log_counts = msg.get("summary", {}).get("log_counts")
+            if log_counts:
+                job_add_log_counts(msg["header"].get("jobid"), log_counts)
 
             if self._workflow_changed:
                 # Start at beginning again (self._step points to first step in the workflow now)
@@ -0,0 +1,35 @@
+"""Zombies
+
+End zombie jobs
+
+A zombie job is a job that has not ended long after it has started, the service that ran the job has died.
+Zombie jobs and their open steps are ended with status FAIL.
+This keeps the set of running jobs small, the duplicate check of a new job only has to consider running jobs.
+
+The zombie jobs of workflows that do not allow a new job to start when a zombie job is running are not ended.
+These zombie jobs keep blocking new jobs until they are ended manually.
+
+The sweep runs as a scheduled task on the leader of the workflow managers.
+"""
+import datetime
+
+from gobcore.status.heartbeat import STATUS_FAIL
+
+from gobworkflow.config import ZOMBIE_JOB_HOURS
+from gobworkflow.storage.storage import end_zombie_jobs
+from gobworkflow.workflow.config import CONF_ALLOW_START_NEW_WHEN_ZOMBIE, WORKFLOWS
+
+
+def sweep_zombies():
+    """End all zombie jobs and their open steps
+
+    :return: ids of the ended jobs
+    """
+    started_before = datetime.datetime.utcnow() - datetime.timedelta(hours=ZOMBIE_JOB_HOURS)
+    exclude_types = [
+        name for name, workflow in WORKFLOWS.items() if not workflow.get(CONF_ALLOW_START_NEW_WHEN_ZOMBIE, True)
+    ]
+    ids = end_zombie_jobs(started_before, STATUS_FAIL, exclude_types=exclude_types)
+    if ids:
+        print(f"Ended {len(ids)} zombie jobs started before {started_before:%Y-%m-%d %H:%M}: {ids}")
+    return ids
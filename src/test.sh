@@ -32,6 +32,12 @@ DIRTY_FILES=(
   gobworkflow/start/__init__.py
   gobworkflow/start/__main__.py
   gobworkflow/storage/auto_reconnect_wrapper.py
+  gobworkflow/storage/batch_writer.py
+  gobworkflow/storage/cache.py
+  gobworkflow/storage/job_cache.py
+  gobworkflow/storage/spool.py
+  gobworkflow/log_rate_limiter.py
+  gobworkflow/leader.py
   gobworkflow/storage/__init__.py
   gobworkflow/storage/storage.py
   gobworkflow/workflow/tree.py
@@ -41,10 +47,16 @@ DIRTY_FILES=(
   gobworkflow/workflow/start.py
   gobworkflow/workflow/jobs.py
   gobworkflow/workflow/workflow.py
+  gobworkflow/workflow/message.py
   gobworkflow/task/queue.py
   gobworkflow/task/__init__.py
   gobworkflow/__main__.py
   gobworkflow/heartbeats.py
+  gobworkflow/logs.py
+  gobworkflow/retention.py
+  gobworkflow/zombies.py
+  gobworkflow/worker_pool.py
+  gobworkflow/scheduler.py
 )
 
 # Combine CLEAN_FILES and DIRTY_FILES.
@@ -0,0 +1,205 @@
+from unittest import TestCase, mock
+
+from gobworkflow.storage.batch_writer import BatchWriter, skip_failing_rows
+
+
+class MockException(Exception):
+    pass
+
+
+class TestBatchWriter(TestCase):
+
+    def setUp(self):
+        self.write = mock.MagicMock()
+        self.writer = BatchWriter("AnyWriter", self.write, max_rows=3, max_age=10)
+
+    def test_add(self):
+        self.writer.add("row 1")
+        self.writer.add("row 2")
+        self.write.assert_not_called()
+
+        # Flush when the maximum number of rows has been reached
+        self.writer.add("row 3")
+        self.write.assert_called_once_with(["row 1", "row 2", "row 3"])
+        self.assertEqual(self.writer._rows, [])
+        self.assertIsNone(self.writer._oldest)
+
+    def test_flush(self):
+        # Nothing to write
+        self.writer.flush()
+        self.write.assert_not_called()
+
+        self.writer.add("row 1")
+        self.writer.flush()
+        self.write.assert_called_once_with(["row 1"])
+
+    def test_flush_failure(self):
+        self.writer.add("row 1")
+        self.writer.add("row 2")
+        self.write.side_effect = MockException
+
+        with self.assertRaises(MockException):
+            self.writer.flush()
+
+        # Rows are kept for the next flush
+        self.assertEqual(self.writer._rows, ["row 1", "row 2"])
+
+        self.write.side_effect = None
+        self.writer.flush()
+        self.write.assert_called_with(["row 1", "row 2"])
+
+    @mock.patch("builtins.print")
+    @mock.patch("gobworkflow.storage.batch_writer.MAX_BUFFERED_BATCHES", 2)
+    def test_flush_failure_buffer_full(self, mock_print):
+        self.write.side_effect = MockException
+        self.writer._rows = ["row 1", "row 2", "row 3", "row 4", "row 5", "row 6", "row 7"]
+
+        with self.assertRaises(MockException):
+            self.writer.flush()
+
+        # The oldest rows are dropped
+        self.assertEqual(self.writer._rows, ["row 2", "row 3", "row 4", "row 5", "row 6", "row 7"])
+        mock_print.assert_called_with("ERROR: AnyWriter: buffer full, drop 1 rows")
+
+    @mock.patch("gobworkflow.storage.batch_writer.time.monotonic")
+    def test_is_due(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.assertFalse(self.writer.is_due())
+
+        self.writer.add("row 1")
+        mock_monotonic.return_value = 105
+        self.assertFalse(self.writer.is_due())
+
+        mock_monotonic.return_value = 110
+        self.assertTrue(self.writer.is_due())
+
+    @mock.patch("builtins.print")
+    def test_flush_when_due(self, mock_print):
+        self.writer.is_due = mock.MagicMock(return_value=False)
+        self.writer.flush = mock.MagicMock()
+
+        self.writer._flush_when_due()
+        self.writer.flush.assert_not_called()
+
+        self.writer.is_due.return_value = True
+        self.writer._flush_when_due()
+        self.writer.flush.assert_called_once()
+
+        # Errors are reported and do not stop the flusher
+        self.writer.flush.side_effect = MockException("any error")
+        self.writer._flush_when_due()
+        mock_print.assert_called_with("ERROR: AnyWriter flush failed: any error")
+
+    @mock.patch("gobworkflow.storage.batch_writer.time.sleep")
+    def test_flush_loop(self, mock_sleep):
+        self.writer._flush_when_due = mock.MagicMock(side_effect=[None, MockException])
+
+        with self.assertRaises(MockException):
+            self.writer._flush_loop()
+
+        mock_sleep.assert_called_with(5)
+        self.assertEqual(self.writer._flush_when_due.call_count, 2)
+
+    @mock.patch("gobworkflow.storage.batch_writer.atexit")
+    @mock.patch("gobworkflow.storage.batch_writer.threading.Thread")
+    def test_start(self, mock_thread, mock_atexit):
+        self.writer.start()
+        mock_thread.assert_called_with(target=self.writer._flush_loop, name="AnyWriterFlusher", daemon=True)
+        mock_thread.return_value.start.assert_called_once()
+        mock_atexit.register.assert_called_with(self.writer.flush)
+
+        # Start only once
+        self.writer.start()
+        mock_thread.return_value.start.assert_called_once()
+
+
+class TestBatchWriterSpool(TestCase):
+
+    def setUp(self):
+        self.write = mock.MagicMock()
+        self.spool = mock.MagicMock()
+        self.spool.pending.return_value = False
+        self.is_connected = mock.MagicMock(return_value=True)
+        self.writer = BatchWriter("AnyWriter", self.write, max_rows=3, max_age=10,
+                                  spool=self.spool, is_connected=self.is_connected)
+
+    def test_flush(self):
+        self.writer.add("row 1")
+        self.writer.flush()
+        self.write.assert_called_once_with(["row 1"])
+        self.spool.append.assert_not_called()
+
+    def test_flush_failure_connected(self):
+        self.writer.add("row 1")
+        self.write.side_effect = MockException
+
+        # Errors that are not caused by connection loss are re-raised
+        with self.assertRaises(MockException):
+            self.writer.flush()
+        self.spool.append.assert_not_called()
+        self.assertEqual(self.writer._rows, ["row 1"])
+
+    @mock.patch("builtins.print")
+    def test_flush_connection_lost(self, mock_print):
+        self.writer.add("row 1")
+        self.write.side_effect = MockException("any error")
+        self.is_connected.return_value = False
+
+        self.writer.flush()
+        self.spool.append.assert_called_once_with(["row 1"])
+        self.assertEqual(self.writer._rows, [])
+        mock_print.assert_called_with("AnyWriter: connection lost, spool 1 rows (any error)")
+
+        # Keep spooling while the spool is pending
+        self.spool.pending.return_value = True
+        self.write.reset_mock()
+        self.writer.add("row 2")
+        self.writer.flush()
+        self.write.assert_not_called()
+        self.spool.append.assert_called_with(["row 2"])
+
+    def test_flush_spool_failure(self):
+        self.spool.pending.return_value = True
+        self.spool.append.side_effect = MockException
+
+        self.writer.add("row 1")
+        with self.assertRaises(MockException):
+            self.writer.flush()
+        self.assertEqual(self.writer._rows, ["row 1"])
+
+
+class TestSkipFailingRows(TestCase):
+
+    def setUp(self):
+        self.written = []
+        self.is_connected = mock.MagicMock(return_value=True)
+
+    def _write(self, rows):
+        if "bad" in rows:
+            raise MockException("bad row")
+        self.written.extend(rows)
+
+    @mock.patch("builtins.print")
+    def test_write_rows(self, mock_print):
+        write_rows = skip_failing_rows("AnyWriter", self._write, self.is_connected)
+
+        write_rows(["row 1", "row 2", "row 3"])
+        self.assertEqual(self.written, ["row 1", "row 2", "row 3"])
+        mock_print.assert_not_called()
+
+    @mock.patch("builtins.print")
+    def test_skip_failing_rows(self, mock_print):
+        write_rows = skip_failing_rows("AnyWriter", self._write, self.is_connected)
+
+        write_rows(["row 1", "bad", "row 2", "row 3", "bad"])
+        self.assertEqual(self.written, ["row 1", "row 2", "row 3"])
+        mock_print.assert_called_with("ERROR: AnyWriter: skip row that cannot be written (bad row): bad")
+        self.assertEqual(mock_print.call_count, 2)
+
+    def test_connection_lost(self):
+        self.is_connected.return_value = False
+        write_rows = skip_failing_rows("AnyWriter", self._write, self.is_connected)
+
+        with self.assertRaises(MockException):
+            write_rows(["row 1", "bad"])
+        self.assertEqual(self.written, [])
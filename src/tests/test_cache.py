@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from gobworkflow.storage.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(max_size=2)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("a", "default"), "default")
+
+        self.cache.set("a", 1)
+        self.cache.set("b", False)
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("b"), False)
+        self.assertEqual(len(self.cache), 2)
+
+    def test_evict_least_recently_used(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        # Use a, b is now the least recently used entry
+        self.cache.get("a")
+        self.cache.set("c", 3)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_delete(self):
+        self.cache.set("a", 1)
+        self.cache.delete("a")
+        self.cache.delete("b")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_clear(self):
+        self.cache.set("a", 1)
+        self.cache.clear()
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
@@ -1,15 +1,29 @@
 from unittest import TestCase, mock
-from collections import namedtuple
-
 import datetime
 
-from gobworkflow.heartbeats import on_heartbeat, check_services
+from freezegun import freeze_time
+
+import gobworkflow.heartbeats
+from gobworkflow.heartbeats import on_heartbeat, apply_heartbeats, check_services, flush_heartbeat_timestamps, \
+    forget_services
+
+
+class MockException(Exception):
+    pass
+
 
 class TestHeartbeats(TestCase):
 
-    @mock.patch('gobworkflow.heartbeats.get_services')
+    def setUp(self):
+        gobworkflow.heartbeats._services.clear()
+        gobworkflow.heartbeats._pending_timestamps.clear()
+        gobworkflow.heartbeats._pending_heartbeats.clear()
+        gobworkflow.heartbeats._threads.clear()
+
+    @mock.patch('gobworkflow.heartbeats.HEARTBEAT_COALESCE_INTERVAL', 0)
+    @mock.patch('gobworkflow.heartbeats.sweep_services')
     @mock.patch('gobworkflow.heartbeats.update_service')
-    def test_on_heartbeat(self, update_service, get_services):
+    def test_on_heartbeat(self, update_service, sweep_services):
         service = {
             "name": "AnyService",
             "is_alive": True,
@@ -39,70 +53,221 @@ class TestHeartbeats(TestCase):
         self.assertEqual(service_parameter, service)
         self.assertEqual(len(tasks), len(msg["threads"]))
 
+        # Services are not checked on every heartbeat
+        sweep_services.assert_not_called()
+
+    @freeze_time("2020-06-20 12:00:00")
+    @mock.patch('gobworkflow.heartbeats.HEARTBEAT_INTERVAL', 60)
+    @mock.patch('gobworkflow.heartbeats._SERVICE_REMOVAL_TIMEOUT', 3600)
+    @mock.patch('gobworkflow.heartbeats.sweep_services')
+    def test_check_services(self, sweep_services):
+        sweep_services.return_value = 0, 0
+        with mock.patch("builtins.print") as mock_print:
+            check_services()
+            mock_print.assert_not_called()
+
+        sweep_services.assert_called_with(
+            dead_before=datetime.datetime(2020, 6, 20, 11, 58),
+            remove_before=datetime.datetime(2020, 6, 20, 11, 0),
+        )
+
+        sweep_services.return_value = 2, 1
+        with mock.patch("builtins.print") as mock_print:
+            check_services()
+            mock_print.assert_called_with("Heartbeat timeout: 2 service(s) marked dead, 1 service(s) removed")
+
+    @mock.patch('gobworkflow.heartbeats.HEARTBEAT_COALESCE_INTERVAL', 0)
+    @mock.patch('gobworkflow.heartbeats._SERVICE_REWRITE_INTERVAL', datetime.timedelta(minutes=2))
     @mock.patch('gobworkflow.heartbeats.update_service')
-    @mock.patch('gobworkflow.heartbeats.get_services')
-    @mock.patch('gobworkflow.heartbeats.remove_service')
-    @mock.patch('gobworkflow.heartbeats.mark_service_dead')
-    def test_check_services(self, mark_service_dead, remove_service, get_services, update_service):
-        service = {
+    def test_on_heartbeat_unchanged(self, update_service):
+        msg = {
             "name": "AnyService",
+            "host": "AnyHost",
+            "pid": 123,
             "is_alive": True,
-            "timestamp": (datetime.datetime.now() - datetime.timedelta(hours=1)).isoformat(),
+            "timestamp": "2020-06-20T12:00:00",
+            "threads": [{"name": "thread1", "is_alive": True}],
         }
+        on_heartbeat(msg)
+        self.assertEqual(update_service.call_count, 1)
+
+        # Only the timestamp has changed
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:01:00"})
+        self.assertEqual(update_service.call_count, 1)
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps,
+                         {("AnyService", "AnyHost"): "2020-06-20T12:01:00"})
+
+        # The status of a thread has changed
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:02:00", "threads": [{"name": "thread1", "is_alive": False}]})
+        self.assertEqual(update_service.call_count, 2)
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps, {})
+
+        # The complete status is rewritten after two heartbeat intervals
+        msg["threads"] = [{"name": "thread1", "is_alive": False}]
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:03:00"})
+        self.assertEqual(update_service.call_count, 2)
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:05:00"})
+        self.assertEqual(update_service.call_count, 3)
+
+        # A service that is stopped is written
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:05:30", "is_alive": False})
+        self.assertEqual(update_service.call_count, 4)
+
+        # Outdated heartbeats are ignored
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:04:00", "pid": 456})
+        self.assertEqual(update_service.call_count, 4)
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps, {})
+
+    @mock.patch('gobworkflow.heartbeats.HEARTBEAT_COALESCE_INTERVAL', 1)
+    @mock.patch('gobworkflow.heartbeats.update_service')
+    def test_on_heartbeat_coalesced(self, update_service):
         msg = {
-            "threads": [
-                {
-                    "name": "thread1",
-                    "is_alive": True
-                },
-                {
-                    "name": "thread2",
-                    "is_alive": False
-                }
-            ]
+            "name": "AnyService",
+            "host": "AnyHost",
+            "pid": 123,
+            "is_alive": True,
+            "timestamp": "2020-06-20T12:00:00",
+            "threads": [{"name": "thread1", "is_alive": True}],
         }
-        msg.update(service)
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:01:00", "pid": 1})
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:03:00", "pid": 3})
+        on_heartbeat({**msg, "timestamp": "2020-06-20T12:02:00", "pid": 2})
+        on_heartbeat({**msg, "name": "OtherService"})
+        update_service.assert_not_called()
 
-        get_services.return_value = []
+        # Only the newest heartbeat of every service is applied
+        apply_heartbeats()
+        self.assertEqual(update_service.call_count, 2)
+        services = [call[0][0] for call in update_service.call_args_list]
+        self.assertEqual([(service["name"], service["pid"]) for service in services],
+                         [("AnyService", 3), ("OtherService", 123)])
 
-        on_heartbeat(msg)
+        apply_heartbeats()
+        self.assertEqual(update_service.call_count, 2)
 
-        # Assure that the service has been marked dead because of a heartbeat timeout
-        self.assertEqual(get_services.call_count, 1)
-        self.assertEqual(remove_service.call_count, 0)
-        self.assertEqual(mark_service_dead.call_count, 0)
+    @mock.patch('gobworkflow.heartbeats.update_service_timestamps')
+    def test_flush_heartbeat_timestamps(self, update_service_timestamps):
+        pending = gobworkflow.heartbeats._pending_timestamps
+        pending.update({("AnyService", "AnyHost"): "any timestamp", ("OtherService", None): "other timestamp"})
 
-        Service = namedtuple('Service', ['timestamp'])
-        service = Service(datetime.datetime.utcnow())
-        get_services.return_value = [service]
-        get_services.reset_mock()
+        flush_heartbeat_timestamps()
+        update_service_timestamps.assert_called_with([
+            ("AnyService", "AnyHost", "any timestamp"), ("OtherService", None, "other timestamp")
+        ])
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps, {})
 
-        on_heartbeat(msg)
+        # Failed timestamps are kept, unless a newer timestamp has been registered
+        gobworkflow.heartbeats._pending_timestamps.update({("AnyService", "AnyHost"): "any timestamp"})
 
-        # Assure that the service has been marked dead because of a heartbeat timeout
-        self.assertEqual(get_services.call_count, 1)
-        self.assertEqual(remove_service.call_count, 0)
-        self.assertEqual(mark_service_dead.call_count, 0)
+        def register_newer(timestamps):
+            gobworkflow.heartbeats._pending_timestamps[("AnyService", "AnyHost")] = "newer timestamp"
+            raise MockException
 
-        service = Service(datetime.datetime.utcnow() - datetime.timedelta(minutes=15))
-        get_services.return_value = [service]
-        get_services.reset_mock()
+        update_service_timestamps.side_effect = register_newer
+        with self.assertRaises(MockException):
+            flush_heartbeat_timestamps()
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps, {("AnyService", "AnyHost"): "newer timestamp"})
 
-        on_heartbeat(msg)
+    @mock.patch('gobworkflow.heartbeats.HEARTBEAT_COALESCE_INTERVAL', 0)
+    @mock.patch('gobworkflow.heartbeats.update_service')
+    def test_on_heartbeat_delta(self, update_service):
+        service = {"name": "AnyService", "host": "AnyHost", "pid": 123, "is_alive": True}
 
-        # Assure that the service has been marked dead because of a heartbeat timeout
-        self.assertEqual(get_services.call_count, 1)
-        self.assertEqual(remove_service.call_count, 0)
-        self.assertEqual(mark_service_dead.call_count, 1)
+        def tasks():
+            return {task["name"]: task["is_alive"] for task in update_service.call_args[0][1]}
 
-        service = Service(datetime.datetime.utcnow() - datetime.timedelta(days=1))
-        get_services.return_value = [service]
-        get_services.reset_mock()
-        mark_service_dead.reset_mock()
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:00:00", "seq": 1,
+                      "threads": [{"name": "thread1", "is_alive": True}]})
+        self.assertEqual(update_service.call_count, 1)
 
-        on_heartbeat(msg)
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:00:10", "seq": 2,
+                      "changed": [{"name": "thread1", "is_alive": False}]})
+        self.assertEqual(update_service.call_count, 2)
+        self.assertEqual(tasks(), {"thread1": False})
+
+        # Delta without changes
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:00:20", "seq": 3})
+        self.assertEqual(update_service.call_count, 2)
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps,
+                         {("AnyService", "AnyHost"): "2020-06-20T12:00:20"})
+
+        # Missing delta, the service is registered without its threads until a full heartbeat
+        with mock.patch("builtins.print") as mock_print:
+            on_heartbeat({**service, "timestamp": "2020-06-20T12:00:40", "seq": 5,
+                          "added": [{"name": "thread2", "is_alive": True}]})
+            mock_print.assert_called_with("Heartbeat AnyService out of sequence, wait for full heartbeat")
+            self.assertEqual(update_service.call_count, 3)
+            update_service.assert_called_with({**service, "timestamp": "2020-06-20T12:00:40"}, None)
+            on_heartbeat({**service, "timestamp": "2020-06-20T12:00:50", "seq": 6})
+            self.assertEqual(mock_print.call_count, 1)
+        self.assertEqual(update_service.call_count, 3)
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps,
+                         {("AnyService", "AnyHost"): "2020-06-20T12:00:50"})
+
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:01:00", "seq": 7,
+                      "threads": [{"name": "thread1", "is_alive": False}, {"name": "thread2", "is_alive": True}]})
+        self.assertEqual(update_service.call_count, 4)
+        self.assertEqual(tasks(), {"thread1": False, "thread2": True})
+
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:01:10", "seq": 8,
+                      "added": [{"name": "thread3", "is_alive": True}], "removed": ["thread1", "unknown"]})
+        self.assertEqual(update_service.call_count, 5)
+        self.assertEqual(tasks(), {"thread2": True, "thread3": True})
+
+        # Full heartbeats without a sequence number do not accept deltas
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:01:20", "threads": []})
+        self.assertEqual(update_service.call_count, 6)
+        self.assertEqual(tasks(), {})
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:01:30", "seq": 9,
+                      "added": [{"name": "thread1", "is_alive": True}]})
+        self.assertEqual(update_service.call_count, 7)
+        update_service.assert_called_with({**service, "timestamp": "2020-06-20T12:01:30"}, None)
+
+        # The last heartbeat of a service does not need to contain its threads
+        on_heartbeat({**service, "is_alive": False, "timestamp": "2020-06-20T12:01:40"})
+        self.assertEqual(update_service.call_count, 8)
+        update_service.assert_called_with({**service, "is_alive": False, "timestamp": "2020-06-20T12:01:40"}, [])
+
+    @mock.patch('gobworkflow.heartbeats.HEARTBEAT_COALESCE_INTERVAL', 0)
+    @mock.patch('gobworkflow.heartbeats.update_service')
+    def test_on_heartbeat_delta_after_restart(self, update_service):
+        service = {"name": "AnyService", "host": "AnyHost", "pid": 123, "is_alive": True}
+
+        # The threads are unknown, the service is registered and its registered tasks are kept
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:00:00", "seq": 10})
+        update_service.assert_called_once_with({**service, "timestamp": "2020-06-20T12:00:00"}, None)
+
+        on_heartbeat({**service, "timestamp": "2020-06-20T12:00:10", "seq": 11,
+                      "changed": [{"name": "thread1", "is_alive": False}]})
+        update_service.assert_called_once()
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps,
+                         {("AnyService", "AnyHost"): "2020-06-20T12:00:10"})
+
+    @freeze_time("2020-06-20 12:00:00")
+    @mock.patch('gobworkflow.heartbeats.HEARTBEAT_COALESCE_INTERVAL', 1)
+    @mock.patch('gobworkflow.heartbeats._SERVICE_REMOVAL_TIMEOUT', 3600)
+    @mock.patch('gobworkflow.heartbeats.update_service')
+    def test_forget_services(self, update_service):
+        old = {"name": "AnyService", "host": "old host", "pid": 1, "is_alive": True, "threads": [],
+               "timestamp": "2020-06-20T10:59:59"}
+        new = {**old, "host": "new host", "timestamp": "2020-06-20T11:00:00"}
+        on_heartbeat(old)
+        on_heartbeat(new)
+        apply_heartbeats()
+        gobworkflow.heartbeats._pending_timestamps[("AnyService", "old host")] = "any timestamp"
+
+        # The services that have timed out are forgotten
+        forget_services()
+        self.assertEqual(list(gobworkflow.heartbeats._threads), [("AnyService", "new host")])
+        self.assertEqual(list(gobworkflow.heartbeats._services), [("AnyService", "new host")])
+        self.assertEqual(gobworkflow.heartbeats._pending_timestamps, {})
 
-        # Assure that the service has been marked dead because of a heartbeat timeout
-        self.assertEqual(get_services.call_count, 1)
-        self.assertEqual(remove_service.call_count, 1)
-        self.assertEqual(mark_service_dead.call_count, 0)
+        # A heartbeat of a service that is forgotten before it is applied is skipped
+        on_heartbeat({**old, "timestamp": "2020-06-20T10:59:58"})
+        heartbeats = dict(gobworkflow.heartbeats._pending_heartbeats)
+        forget_services()
+        self.assertEqual(gobworkflow.heartbeats._pending_heartbeats, {})
+        update_service.reset_mock()
+        gobworkflow.heartbeats._pending_heartbeats.update(heartbeats)
+        apply_heartbeats()
+        update_service.assert_not_called()
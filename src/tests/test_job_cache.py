@@ -0,0 +1,66 @@
+from unittest import TestCase
+
+from gobworkflow.storage.job_cache import JobCache, snapshot
+
+
+class TestJobCache(TestCase):
+
+    def setUp(self):
+        self.cache = JobCache(max_size=2)
+        self.job = snapshot({"id": 1, "end": None})
+        self.step = snapshot({"id": 10, "jobid": 1})
+
+    def test_snapshot(self):
+        self.assertEqual(snapshot({"id": 1, "name": "any name"}).name, "any name")
+
+        # Snapshots are read-only
+        job = snapshot({"id": 1, "name": "any name"})
+        with self.assertRaises(AttributeError):
+            job.name = "other name"
+        with self.assertRaises(AttributeError):
+            del job.name
+        self.assertEqual(job, snapshot({"id": 1, "name": "any name"}))
+
+    def test_set_get(self):
+        self.assertIsNone(self.cache.get_job(1))
+        self.assertIsNone(self.cache.get_step(1, 10))
+
+        # A step is only cached when its job is cached
+        self.cache.set_step(self.step)
+        self.assertIsNone(self.cache.get_step(1, 10))
+
+        self.cache.set_job(self.job)
+        self.cache.set_step(self.step)
+        self.assertEqual(self.cache.get_job(1), self.job)
+        self.assertEqual(self.cache.get_step(1, 10), self.step)
+        self.assertIsNone(self.cache.get_step(1, 11))
+
+        # A new snapshot of the job keeps its steps
+        job = snapshot({"id": 1, "end": None, "log_counts": {}})
+        self.cache.set_job(job)
+        self.assertEqual(self.cache.get_job(1), job)
+        self.assertEqual(self.cache.get_step(1, 10), self.step)
+
+    def test_end_job(self):
+        self.cache.set_job(self.job)
+        self.cache.set_step(self.step)
+
+        self.cache.set_job(snapshot({"id": 1, "end": "any end"}))
+        self.assertIsNone(self.cache.get_job(1))
+        self.assertIsNone(self.cache.get_step(1, 10))
+        self.assertEqual(len(self.cache), 0)
+
+        # Ended jobs are not cached
+        self.cache.set_job(snapshot({"id": 2, "end": "any end"}))
+        self.assertIsNone(self.cache.get_job(2))
+
+    def test_evict_clear(self):
+        self.cache.set_job(self.job)
+        self.cache.set_job(snapshot({"id": 2, "end": None}))
+
+        self.cache.evict(1)
+        self.assertIsNone(self.cache.get_job(1))
+        self.assertEqual(len(self.cache), 1)
+
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
@@ -0,0 +1,64 @@
+from unittest import TestCase, mock
+
+from gobworkflow.leader import Leader
+
+
+class MockException(Exception):
+    pass
+
+
+@mock.patch("builtins.print")
+@mock.patch("gobworkflow.leader.holds_leader_lock")
+@mock.patch("gobworkflow.leader.try_leader_lock")
+class TestLeader(TestCase):
+
+    def test_is_leader(self, mock_try_leader_lock, mock_holds_leader_lock, mock_print):
+        leader = Leader()
+
+        # Another instance is the leader
+        mock_try_leader_lock.return_value = None
+        self.assertFalse(leader.is_leader())
+        mock_print.assert_not_called()
+
+        connection = mock.MagicMock()
+        mock_try_leader_lock.return_value = connection
+        self.assertTrue(leader.is_leader())
+        mock_print.assert_called_with("Elected as leader")
+
+        # The lock is kept
+        mock_holds_leader_lock.return_value = True
+        mock_try_leader_lock.reset_mock()
+        self.assertTrue(leader.is_leader())
+        mock_holds_leader_lock.assert_called_with(connection)
+        mock_try_leader_lock.assert_not_called()
+
+        # The connection is lost and another instance has taken over
+        mock_holds_leader_lock.return_value = False
+        mock_try_leader_lock.return_value = None
+        self.assertFalse(leader.is_leader())
+        mock_print.assert_called_with("Leadership lost")
+        mock_try_leader_lock.assert_called_once()
+
+    def test_is_leader_role(self, mock_try_leader_lock, mock_holds_leader_lock, mock_print):
+        leader = Leader()
+
+        connection = mock.MagicMock()
+        mock_try_leader_lock.side_effect = lambda role: connection if role == "any role" else None
+        self.assertTrue(leader.is_leader("any role"))
+        mock_print.assert_called_with("Elected as leader of any role")
+
+        # Every role has its own leader
+        self.assertFalse(leader.is_leader("other role"))
+        self.assertFalse(leader.is_leader())
+
+        mock_holds_leader_lock.return_value = False
+        mock_try_leader_lock.side_effect = lambda role: None
+        self.assertFalse(leader.is_leader("any role"))
+        mock_print.assert_called_with("Leadership of any role lost")
+
+    def test_is_leader_failure(self, mock_try_leader_lock, mock_holds_leader_lock, mock_print):
+        leader = Leader()
+        mock_try_leader_lock.side_effect = MockException("any error")
+
+        self.assertFalse(leader.is_leader())
+        mock_print.assert_called_with("Leader election failed: any error")
@@ -0,0 +1,107 @@
+from unittest import TestCase, mock
+
+from freezegun import freeze_time
+
+from gobworkflow.log_rate_limiter import LogRateLimiter
+
+
+def _msg(text, timestamp="2020-06-20T12:20:20.000000", jobid=1, level="WARNING"):
+    return {"timestamp": timestamp, "msg": text, "jobid": jobid, "stepid": 2, "level": level, "name": "any name"}
+
+
+@mock.patch("gobworkflow.log_rate_limiter.time.monotonic", lambda: 100.0)
+class TestLogRateLimiter(TestCase):
+
+    def test_no_limit(self):
+        limiter = LogRateLimiter(0, 1)
+        for _ in range(10):
+            self.assertTrue(limiter.allow(_msg("any msg")))
+        self.assertEqual(limiter.summaries(), [])
+
+    def test_burst(self):
+        limiter = LogRateLimiter(1, 2)
+        self.assertTrue(limiter.allow(_msg("any msg")))
+        self.assertTrue(limiter.allow(_msg("any msg")))
+        self.assertFalse(limiter.allow(_msg("any msg")))
+
+        # Other jobs and levels have their own bucket
+        self.assertTrue(limiter.allow(_msg("any msg", jobid=2)))
+        self.assertTrue(limiter.allow(_msg("any msg", level="INFO")))
+
+    def test_rates_per_level(self):
+        limiter = LogRateLimiter(1, 1, {"INFO": 0})
+        self.assertTrue(limiter.allow(_msg("any msg", level="INFO")))
+        self.assertTrue(limiter.allow(_msg("any msg", level="INFO")))
+        self.assertTrue(limiter.allow(_msg("any msg")))
+        self.assertFalse(limiter.allow(_msg("any msg")))
+
+    def test_refill(self):
+        limiter = LogRateLimiter(2, 1)
+        with mock.patch("gobworkflow.log_rate_limiter.time.monotonic") as mock_monotonic:
+            mock_monotonic.return_value = 100.0
+            self.assertTrue(limiter.allow(_msg("any msg")))
+            self.assertFalse(limiter.allow(_msg("any msg")))
+
+            mock_monotonic.return_value = 100.5
+            self.assertTrue(limiter.allow(_msg("any msg")))
+            self.assertFalse(limiter.allow(_msg("any msg")))
+
+            # Tokens do not exceed the burst size
+            mock_monotonic.return_value = 200.0
+            self.assertTrue(limiter.allow(_msg("any msg")))
+            self.assertFalse(limiter.allow(_msg("any msg")))
+
+    @freeze_time("2020-06-20 13:00:00")
+    def test_summaries(self):
+        limiter = LogRateLimiter(1, 1)
+        limiter.allow(_msg("any msg"))
+        limiter.allow(_msg("any msg", "2020-06-20T12:20:21.000000"))
+        limiter.allow(_msg("other msg", "2020-06-20T12:20:22.000000"))
+        limiter.allow(_msg("any msg", "2020-06-20T12:20:23.000000"))
+
+        self.assertEqual(limiter.summaries(), [{
+            "process_id": None,
+            "source": None,
+            "application": None,
+            "destination": None,
+            "catalogue": None,
+            "entity": None,
+            "level": "WARNING",
+            "name": "any name",
+            "jobid": 1,
+            "stepid": 2,
+            "timestamp": "2020-06-20T13:00:00.000000",
+            "msg": "3 further messages suppressed",
+            "data": {
+                "suppressed": 3,
+                "first_timestamp": "2020-06-20T12:20:21.000000",
+                "last_timestamp": "2020-06-20T12:20:23.000000",
+                "messages": [{"msg": "any msg", "count": 2}, {"msg": "other msg", "count": 1}],
+            },
+        }])
+
+        # Suppressed messages are reported once
+        self.assertEqual(limiter.summaries(), [])
+
+    @mock.patch("gobworkflow.log_rate_limiter.MAX_TEXTS", 1)
+    def test_summaries_max_texts(self):
+        limiter = LogRateLimiter(1, 1)
+        limiter.allow(_msg("any msg"))
+        limiter.allow(_msg("any msg"))
+        limiter.allow(_msg("other msg"))
+
+        summary = limiter.summaries()[0]
+        self.assertEqual(summary["data"]["suppressed"], 2)
+        self.assertEqual(summary["data"]["messages"], [{"msg": "any msg", "count": 1}])
+
+    def test_summaries_removes_idle_buckets(self):
+        limiter = LogRateLimiter(1, 2)
+        with mock.patch("gobworkflow.log_rate_limiter.time.monotonic") as mock_monotonic:
+            mock_monotonic.return_value = 100.0
+            limiter.allow(_msg("any msg", jobid=1))
+            limiter.allow(_msg("any msg", jobid=2))
+            limiter.allow(_msg("any msg", jobid=2))
+
+            mock_monotonic.return_value = 101.0
+            limiter.summaries()
+            self.assertEqual(list(limiter._buckets), [(2, "WARNING")])
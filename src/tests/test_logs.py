@@ -0,0 +1,164 @@
+import datetime
+from unittest import TestCase, mock
+
+from freezegun import freeze_time
+
+from gobworkflow.storage.storage import AUDIT_LOG_FIELDS, LOG_FIELDS
+from gobworkflow.logs import audit_log_record, log_record, on_audit_log, on_log, log_suppressed_summaries, \
+    manage_log_partitions, replay_spools, _add_months
+
+
+class TestLogs(TestCase):
+
+    def test_log_record(self):
+        msg = {
+            "timestamp": "2020-06-20T12:20:20.000",
+            "process_id": "any process",
+            "source": "any source",
+            "level": "INFO",
+            "name": "any name",
+            "id": "any id",
+            "msg": "any msg",
+            "jobid": 1,
+            "stepid": 2,
+            "data": {"any": "data"},
+        }
+
+        record = log_record(msg)
+
+        self.assertEqual(dict(zip(LOG_FIELDS, record)), {
+            "timestamp": datetime.datetime(2020, 6, 20, 12, 20, 20),
+            "process_id": "any process",
+            "source": "any source",
+            "application": None,
+            "destination": None,
+            "catalogue": None,
+            "entity": None,
+            "level": "INFO",
+            "name": "any name",
+            "msgid": "any id",
+            "msg": "any msg",
+            "jobid": 1,
+            "stepid": 2,
+            "data": '{"any": "data"}',
+        })
+
+    def test_log_record_without_data(self):
+        record = log_record({"timestamp": "2020-06-20T12:20:20.123456"})
+        self.assertEqual(record[0], datetime.datetime(2020, 6, 20, 12, 20, 20, 123456))
+        self.assertEqual(record[-1], "null")
+
+    @mock.patch("gobworkflow.logs.job_exists")
+    @mock.patch("gobworkflow.logs.log_writer")
+    @mock.patch("gobworkflow.logs.log_record")
+    def test_on_log(self, mock_log_record, mock_log_writer, mock_job_exists):
+        # Log without job
+        on_log({"msg": "any msg"})
+        mock_log_record.assert_called_with({"msg": "any msg"})
+        mock_log_writer.add.assert_called_with(mock_log_record.return_value)
+        mock_job_exists.assert_not_called()
+
+        # Log for an existing job
+        mock_job_exists.return_value = True
+        on_log({"msg": "any msg", "jobid": 1})
+        mock_job_exists.assert_called_with(1)
+        self.assertEqual(mock_log_writer.add.call_count, 2)
+
+        # Log for a non-existent job is skipped
+        mock_job_exists.return_value = False
+        on_log({"msg": "any msg", "jobid": 2})
+        self.assertEqual(mock_log_writer.add.call_count, 2)
+
+    @mock.patch("gobworkflow.logs.job_exists")
+    @mock.patch("gobworkflow.logs.log_writer")
+    @mock.patch("gobworkflow.logs.log_rate_limiter")
+    def test_on_log_rate_limited(self, mock_limiter, mock_log_writer, mock_job_exists):
+        mock_limiter.allow.return_value = False
+        on_log({"msg": "any msg", "jobid": 1})
+        mock_limiter.allow.assert_called_with({"msg": "any msg", "jobid": 1})
+        mock_job_exists.assert_not_called()
+        mock_log_writer.add.assert_not_called()
+
+    @mock.patch("gobworkflow.logs.log_writer")
+    @mock.patch("gobworkflow.logs.log_record")
+    @mock.patch("gobworkflow.logs.log_rate_limiter")
+    def test_log_suppressed_summaries(self, mock_limiter, mock_log_record, mock_log_writer):
+        mock_limiter.summaries.return_value = [{"msg": "summary"}]
+        log_suppressed_summaries()
+        mock_log_record.assert_called_with({"msg": "summary"})
+        mock_log_writer.add.assert_called_with(mock_log_record.return_value)
+
+    @mock.patch("gobworkflow.logs.is_connected")
+    @mock.patch("gobworkflow.logs.audit_log_spool")
+    @mock.patch("gobworkflow.logs.log_spool")
+    def test_replay_spools(self, mock_log_spool, mock_audit_log_spool, mock_is_connected):
+        # Nothing to replay
+        mock_log_spool.pending.return_value = False
+        mock_audit_log_spool.pending.return_value = False
+        replay_spools()
+        mock_is_connected.assert_not_called()
+
+        # Wait for the connection to be restored
+        mock_log_spool.pending.return_value = True
+        mock_is_connected.return_value = False
+        with mock.patch("builtins.print") as mock_print:
+            replay_spools()
+            mock_print.assert_called_with("Spooled logs are replayed when the connection has been restored")
+        mock_log_spool.replay.assert_not_called()
+
+        # Connected
+        mock_is_connected.return_value = True
+        replay_spools()
+        mock_log_spool.replay.assert_called_once_with()
+        mock_audit_log_spool.replay.assert_not_called()
+
+    def test_audit_log_record(self):
+        msg = {
+            "timestamp": "2020-06-20T12:20:20.000",
+            "source": "any source",
+            "type": "any type",
+            "data": {"any": "data"},
+        }
+
+        record = audit_log_record(msg)
+
+        self.assertEqual(dict(zip(AUDIT_LOG_FIELDS, record)), {
+            "timestamp": datetime.datetime(2020, 6, 20, 12, 20, 20),
+            "source": "any source",
+            "destination": None,
+            "type": "any type",
+            "data": {"any": "data"},
+            "request_uuid": None,
+        })
+
+    @mock.patch("gobworkflow.logs.audit_log_writer")
+    @mock.patch("gobworkflow.logs.audit_log_record")
+    def test_on_audit_log(self, mock_audit_log_record, mock_audit_log_writer):
+        on_audit_log("any msg")
+        mock_audit_log_record.assert_called_with("any msg")
+        mock_audit_log_writer.add.assert_called_with(mock_audit_log_record.return_value)
+
+    def test_add_months(self):
+        self.assertEqual(_add_months(datetime.date(2020, 6, 1), 0), datetime.date(2020, 6, 1))
+        self.assertEqual(_add_months(datetime.date(2020, 6, 1), 7), datetime.date(2021, 1, 1))
+        self.assertEqual(_add_months(datetime.date(2020, 6, 1), -6), datetime.date(2019, 12, 1))
+        self.assertEqual(_add_months(datetime.date(2020, 12, 1), 1), datetime.date(2021, 1, 1))
+
+    @freeze_time("2020-11-20 12:00:00")
+    @mock.patch("builtins.print")
+    @mock.patch("gobworkflow.logs.drop_log_partitions")
+    @mock.patch("gobworkflow.logs.create_log_partitions")
+    def test_manage_log_partitions(self, mock_create, mock_drop, mock_print):
+
+        with mock.patch("gobworkflow.logs.LOG_RETENTION_MONTHS", 0):
+            manage_log_partitions()
+
+        mock_create.assert_called_with([datetime.date(2020, 11, 1), datetime.date(2020, 12, 1), datetime.date(2021, 1, 1)])
+        mock_drop.assert_not_called()
+
+        mock_drop.return_value = ["logs_2019_10"]
+        with mock.patch("gobworkflow.logs.LOG_RETENTION_MONTHS", 12):
+            manage_log_partitions()
+
+        mock_drop.assert_called_with(datetime.date(2019, 11, 1))
+        mock_print.assert_called_with("Dropped logs partition logs_2019_10")
@@ -1,3 +1,4 @@
+import copy
 import sys
 import importlib
 
@@ -36,6 +37,103 @@ class TestMain(TestCase):
         # Should connect to the storage
         mock_connect.assert_called_with(force_migrate=True)
 
+    @mock.patch('gobcore.logging.logger.logger', mock.MagicMock())
+    @mock.patch('gobcore.message_broker.messagedriven_service.messagedriven_service')
+    @mock.patch('gobworkflow.storage.storage.connect')
+    @mock.patch('gobworkflow.retention.purge')
+    def test_purge(self, mock_purge, mock_connect, mock_messagedriven_service):
+        sys.argv = ['python -m gobworkflow', '--purge']
+
+        from gobworkflow import __main__
+        importlib.reload(__main__)
+
+        # Should purge once and not start as a service
+        mock_connect.assert_called_with()
+        mock_purge.assert_called_with()
+        mock_messagedriven_service.assert_not_called()
+
+    @mock.patch('gobcore.logging.logger.logger', mock.MagicMock())
+    @mock.patch('gobcore.message_broker.messagedriven_service.messagedriven_service')
+    @mock.patch('gobworkflow.storage.storage.connect')
+    @mock.patch('gobworkflow.logs.audit_log_writer')
+    @mock.patch('gobworkflow.logs.log_writer')
+    @mock.patch('gobworkflow.scheduler.scheduler')
+    @mock.patch('gobworkflow.workflow.workflow.compile_workflows')
+    @mock.patch('gobworkflow.config.PREFETCH_COUNT_PER_ROLE', {"logs": 1000, "audit": 500})
+    @mock.patch('gobworkflow.config.DB_POOL_SIZE_PER_ROLE', {"logs": 2})
+    def test_main_roles(self, mock_compile_workflows, mock_scheduler, mock_log_writer, mock_audit_log_writer,
+                        mock_connect, mock_messagedriven_service):
+        sys.argv = ['python -m gobworkflow', '--roles', 'logs,audit']
+
+        from gobworkflow import __main__
+        importlib.reload(__main__)
+
+        # The largest pool size and prefetch count of the roles
+        mock_connect.assert_called_with(pool_size=5)
+        # Only the writers and scheduled tasks of the roles are started
+        mock_compile_workflows.assert_not_called()
+        mock_log_writer.start.assert_called_with()
+        mock_audit_log_writer.start.assert_called_with()
+        self.assertEqual([call[0][0] for call in mock_scheduler.add.call_args_list],
+                         ["LogPartitions", "LogSuppressionSummaries", "ReplaySpools"])
+        mock_scheduler.start.assert_called_with()
+        # Only the services of the roles are started
+        services = mock_messagedriven_service.call_args[0][0]
+        self.assertEqual(list(services), ["save_logs", "save_audit_logs"])
+        self.assertEqual(mock_messagedriven_service.call_args[0][2], {'prefetch_count': 1000, 'load_message': False})
+
+        mock_scheduler.reset_mock()
+        sys.argv = ['python -m gobworkflow', '--roles', 'heartbeat,tasks,tasks']
+        importlib.reload(__main__)
+
+        mock_connect.assert_called_with(pool_size=5)
+        self.assertEqual([call[0][0] for call in mock_scheduler.add.call_args_list],
+                         ["Heartbeats", "HeartbeatTimestamps", "ServiceSweep", "ForgetServices"])
+        services = mock_messagedriven_service.call_args[0][0]
+        self.assertEqual(list(services), ["heartbeat_monitor", "start_tasks", "task_completed"])
+        self.assertEqual(mock_messagedriven_service.call_args[0][2], {'prefetch_count': 100, 'load_message': False})
+
+    @mock.patch('builtins.print', mock.MagicMock())
+    @mock.patch('sys.stderr', mock.MagicMock())
+    def test_main_invalid_roles(self):
+        from gobworkflow import __main__
+
+        for roles in ['logs,any role', ',']:
+            sys.argv = ['python -m gobworkflow', '--roles', roles]
+            with self.assertRaises(SystemExit):
+                importlib.reload(__main__)
+
+    @mock.patch('gobcore.logging.logger.logger', mock.MagicMock())
+    @mock.patch('gobcore.message_broker.messagedriven_service.messagedriven_service')
+    @mock.patch('gobworkflow.storage.storage.connect')
+    @mock.patch('gobworkflow.logs.audit_log_writer', mock.MagicMock())
+    @mock.patch('gobworkflow.logs.log_writer', mock.MagicMock())
+    @mock.patch('gobworkflow.scheduler.scheduler', mock.MagicMock())
+    @mock.patch('gobworkflow.workflow.workflow.compile_workflows', mock.MagicMock())
+    @mock.patch('gobworkflow.worker_pool.with_worker_pools')
+    @mock.patch('gobworkflow.config.WORKERS_PER_ROLE', {"workflow": 4})
+    @mock.patch('gobworkflow.config.WORKERS', 2)
+    def test_main_worker_pools(self, mock_with_worker_pools, mock_connect, mock_messagedriven_service):
+        sys.argv = ['python -m gobworkflow']
+
+        from gobworkflow import __main__
+        importlib.reload(__main__)
+
+        # The services of every role share a pool with the default number of workers unless set for the role
+        pools = {role: (2, definition["services"]) for role, definition in __main__.ROLES.items()}
+        pools["workflow"] = (4, ["step_completed", "start_workflow", "workflow_progress"])
+        mock_with_worker_pools.assert_called_with(__main__.SERVICEDEFINITION, pools, 10,
+                                                  on_error=__main__.report_failure)
+
+        # Failures of workers are reported in the log of the job
+        with mock.patch.object(__main__, "logger") as mock_logger:
+            msg = {"header": {"jobid": 1}}
+            __main__.report_failure(msg, Exception("any error"))
+            mock_logger.configure_context.assert_called_with(msg, __main__.LOG_NAME, __main__.LOG_HANDLERS)
+            mock_logger.error.assert_called_with("Message could not be handled: any error")
+        mock_messagedriven_service.assert_called_with(mock_with_worker_pools.return_value, "Workflow",
+                                                      {'prefetch_count': 100, 'load_message': False})
+
     @mock.patch('gobcore.logging.logger.logger', mock.MagicMock())
     @mock.patch('gobcore.message_broker.messagedriven_service.messagedriven_service')
     @mock.patch('gobworkflow.storage.storage.connect')
@@ -43,7 +141,14 @@ class TestMain(TestCase):
     @mock.patch('gobworkflow.workflow.jobs.step_status')
     @mock.patch('gobworkflow.workflow.workflow.Workflow')
     @mock.patch('gobworkflow.workflow.hooks.handle_result')
-    def test_main(self, mock_handle, mock_workflow, mock_status, mock_get_job_step, mock_connect, mock_messagedriven_service):
+    @mock.patch('gobworkflow.logs.audit_log_writer')
+    @mock.patch('gobworkflow.logs.log_writer')
+    @mock.patch('gobworkflow.scheduler.scheduler')
+    @mock.patch('gobworkflow.retention.retention_rules', lambda: [("import", 30)])
+    @mock.patch('gobworkflow.workflow.workflow.compile_workflows')
+    @mock.patch('gobworkflow.storage.storage.session')
+    def test_main(self, mock_session, mock_compile_workflows, mock_scheduler, mock_log_writer, mock_audit_log_writer, mock_handle,
+                  mock_workflow, mock_status, mock_get_job_step, mock_connect, mock_messagedriven_service):
 
         # With command line arguments
         sys.argv = ['python -m gobworkflow']
@@ -52,11 +157,30 @@ class TestMain(TestCase):
         importlib.reload(__main__)
 
         # Should connect to the storage
-        mock_connect.assert_called_with()
+        mock_connect.assert_called_with(pool_size=5)
+        # Should compile the workflows
+        mock_compile_workflows.assert_called_with()
+        # Should start writing logs in batches
+        mock_log_writer.start.assert_called_with()
+        mock_audit_log_writer.start.assert_called_with()
+        # Should start the scheduled tasks
+        mock_scheduler.add.assert_any_call("LogPartitions", 3600, __main__.manage_log_partitions, leader_only=True,
+                                           role="logs")
+        mock_scheduler.add.assert_any_call("Heartbeats", 1, __main__.apply_heartbeats)
+        mock_scheduler.add.assert_any_call("HeartbeatTimestamps", 10, __main__.flush_heartbeat_timestamps)
+        mock_scheduler.add.assert_any_call("ServiceSweep", 60, __main__.check_services, leader_only=True,
+                                           role="heartbeat")
+        mock_scheduler.add.assert_any_call("ForgetServices", 60, __main__.forget_services)
+        mock_scheduler.add.assert_any_call("ZombieSweep", 900, __main__.sweep_zombies, leader_only=True,
+                                           role="workflow")
+        mock_scheduler.add.assert_any_call("ReplaySpools", 10, __main__.replay_spools)
+        mock_scheduler.add.assert_any_call("LogSuppressionSummaries", 60, __main__.log_suppressed_summaries)
+        mock_scheduler.add.assert_any_call("PurgeJobs", 86400, __main__.purge, leader_only=True, role="workflow")
+        mock_scheduler.start.assert_called_with()
         # Should start as a service
         mock_messagedriven_service.assert_called_with(__main__.SERVICEDEFINITION,
                                                  "Workflow",
-                                                      {'prefetch_count': 1, 'load_message': False})
+                                                      {'prefetch_count': 100, 'load_message': False})
 
         mock_get_job_step.return_value = namedtuple('Job', ['type'])('any jobtype'),\
                                          namedtuple('Step', ['name'])('any stepname')
@@ -70,6 +194,8 @@ class TestMain(TestCase):
             }
         })
         self.assertEqual(workflow.msg, {'header': {'jobid': 'any jobid', 'stepid': 'any stepid'}})
+        # Every message is handled in one transaction
+        mock_session.commit.assert_called_once()
 
         workflow.msg = None
         __main__.handle_result({
@@ -145,3 +271,47 @@ class TestMain(TestCase):
 
         __main__.on_workflow_progress({"jobid": "any job", "stepid": "any step", "status": STATUS_FAIL, "info_msg": "Severe error"})
         mock_status.assert_called_with("any job", "any step", STATUS_FAIL)
+
+        # One commit per message
+        self.assertEqual(mock_session.commit.call_count, 8)
+
+    @mock.patch('gobcore.logging.logger.logger', mock.MagicMock())
+    @mock.patch('gobcore.message_broker.messagedriven_service.messagedriven_service', mock.MagicMock())
+    @mock.patch('gobworkflow.storage.storage.connect', mock.MagicMock())
+    @mock.patch('gobworkflow.logs.audit_log_writer', mock.MagicMock())
+    @mock.patch('gobworkflow.logs.log_writer', mock.MagicMock())
+    @mock.patch('gobworkflow.scheduler.scheduler', mock.MagicMock())
+    @mock.patch('gobworkflow.workflow.workflow.compile_workflows', mock.MagicMock())
+    @mock.patch('gobworkflow.workflow.workflow.Workflow')
+    @mock.patch('gobworkflow.storage.storage.session')
+    def test_start_workflow_connection_lost(self, mock_session, mock_workflow):
+        from gobworkflow.storage.auto_reconnect_wrapper import auto_reconnect_wrapper
+
+        # The connection is lost once and restored by the reconnect
+        reconnect = auto_reconnect_wrapper(is_connected=mock.MagicMock(return_value=False),
+                                           connect=mock.MagicMock(return_value=True), disconnect=mock.MagicMock())
+        started = []
+
+        def start(msg, retry_time):
+            started.append(copy.deepcopy(msg))
+            if len(started) == 1:
+                # The job has been registered in the message before the connection was lost
+                msg["header"]["jobid"] = "rolled back job"
+                raise Exception("connection lost")
+
+        mock_workflow.return_value.start.side_effect = start
+
+        sys.argv = ['python -m gobworkflow']
+        with mock.patch('gobworkflow.storage.storage.session_auto_reconnect', reconnect), \
+                mock.patch('builtins.print'):
+            from gobworkflow import __main__
+            importlib.reload(__main__)
+
+            msg = {'workflow': {'workflow_name': 'any workflow'}, 'header': {}, 'anything': 'any value'}
+            __main__.start_workflow(msg)
+
+        # The retry starts the workflow with the message as it has been received
+        self.assertEqual(started, [{'header': {}, 'anything': 'any value'}] * 2)
+        self.assertEqual(msg, {'workflow': {'workflow_name': 'any workflow'}, 'header': {}, 'anything': 'any value'})
+        mock_session.rollback.assert_called()
+        mock_session.commit.assert_called_once()
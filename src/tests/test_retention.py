@@ -0,0 +1,41 @@
+import datetime
+from unittest import TestCase, mock
+
+from freezegun import freeze_time
+
+from gobworkflow.retention import purge, retention_rules
+
+
+@mock.patch("builtins.print", mock.MagicMock())
+class TestRetention(TestCase):
+
+    @mock.patch("gobworkflow.retention.JOB_RETENTION_DAYS_PER_TYPE", {"import": 30, "export": 0})
+    @mock.patch("gobworkflow.retention.JOB_RETENTION_DAYS", 90)
+    def test_retention_rules(self):
+        self.assertEqual(retention_rules(), [("import", 30), (None, 90)])
+
+    @mock.patch("gobworkflow.retention.JOB_RETENTION_DAYS_PER_TYPE", {})
+    @mock.patch("gobworkflow.retention.JOB_RETENTION_DAYS", 0)
+    def test_retention_rules_none(self):
+        self.assertEqual(retention_rules(), [])
+
+    @freeze_time("2020-06-01")
+    @mock.patch("gobworkflow.retention.time.sleep")
+    @mock.patch("gobworkflow.retention.purge_jobs")
+    @mock.patch("gobworkflow.retention.JOB_RETENTION_DAYS_PER_TYPE", {"import": 30})
+    @mock.patch("gobworkflow.retention.JOB_RETENTION_DAYS", 90)
+    def test_purge(self, mock_purge_jobs, mock_sleep):
+        mock_purge_jobs.side_effect = [[1, 2], [3, 4], [5], [6]]
+
+        result = purge(batch_size=2, throttle=0.5)
+
+        self.assertEqual(result, 6)
+        self.assertEqual(mock_purge_jobs.call_args_list, [
+            mock.call(datetime.datetime(2020, 5, 2), 2, job_type="import", exclude_types=["import"]),
+            mock.call(datetime.datetime(2020, 5, 2), 2, job_type="import", exclude_types=["import"]),
+            mock.call(datetime.datetime(2020, 5, 2), 2, job_type="import", exclude_types=["import"]),
+            mock.call(datetime.datetime(2020, 3, 3), 2, job_type=None, exclude_types=["import"]),
+        ])
+        # Pause after every full batch
+        self.assertEqual(mock_sleep.call_count, 2)
+        mock_sleep.assert_called_with(0.5)
@@ -0,0 +1,74 @@
+from unittest import TestCase, mock
+
+from gobworkflow.scheduler import Scheduler
+
+
+class MockException(Exception):
+    pass
+
+
+class TestScheduler(TestCase):
+
+    def setUp(self):
+        self.is_leader = mock.MagicMock(return_value=True)
+        self.scheduler = Scheduler(is_leader=self.is_leader)
+
+    @mock.patch("gobworkflow.scheduler.threading.Thread")
+    def test_start(self, mock_thread):
+        task = mock.MagicMock()
+        self.scheduler.add("AnyTask", 10, task)
+        self.scheduler.start()
+
+        mock_thread.assert_called_once_with(target=self.scheduler._run_loop, args=("AnyTask", 10, task, False, None),
+                                            name="AnyTask", daemon=True)
+        mock_thread.return_value.start.assert_called_once()
+
+        # Only tasks that have been added since the last start are started
+        other_task = mock.MagicMock()
+        self.scheduler.add("OtherTask", 20, other_task, leader_only=True, role="any role")
+        self.scheduler.start()
+
+        self.assertEqual(mock_thread.call_count, 2)
+        mock_thread.assert_called_with(target=self.scheduler._run_loop, args=("OtherTask", 20, other_task, True, "any role"),
+                                       name="OtherTask", daemon=True)
+
+    @mock.patch("gobworkflow.scheduler.time.sleep")
+    def test_run_loop(self, mock_sleep):
+        task = mock.MagicMock()
+        mock_sleep.side_effect = [None, MockException]
+
+        with self.assertRaises(MockException):
+            self.scheduler._run_loop("AnyTask", 10, task, False, None)
+
+        self.assertEqual(task.call_count, 2)
+        mock_sleep.assert_called_with(10)
+
+    @mock.patch("builtins.print")
+    def test_run(self, mock_print):
+        task = mock.MagicMock()
+        self.scheduler._run("AnyTask", task)
+        task.assert_called_once()
+        mock_print.assert_not_called()
+
+        task.side_effect = MockException("any error")
+        self.scheduler._run("AnyTask", task)
+        mock_print.assert_called_with("ERROR: scheduled task AnyTask failed: any error")
+
+    def test_run_leader_only(self):
+        task = mock.MagicMock()
+        self.scheduler._run("AnyTask", task, leader_only=True)
+        task.assert_called_once()
+
+        self.is_leader.return_value = False
+        self.scheduler._run("AnyTask", task, leader_only=True)
+        task.assert_called_once()
+
+        # Other tasks run on every instance
+        self.scheduler._run("AnyTask", task)
+        self.assertEqual(task.call_count, 2)
+
+    def test_run_leader_only_role(self):
+        task = mock.MagicMock()
+        self.scheduler._run("AnyTask", task, leader_only=True, role="any role")
+        task.assert_called_once()
+        self.is_leader.assert_called_once_with("any role")
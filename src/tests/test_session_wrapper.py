@@ -67,6 +67,31 @@ class TestAutoReconnect(TestCase):
         with self.assertRaises(Exception):
             obj.exec(lambda: raise_exception())
 
+    def test_exec_nested(self):
+        connected = [False]
+        mock_connect = mock.MagicMock(side_effect=lambda: connected.__setitem__(0, True) or True)
+        obj = AutoReconnector(is_connected=lambda: connected[0], connect=mock_connect, disconnect=mock.MagicMock())
+
+        inner = get_n_times_function(1, lambda: raise_exception(), lambda: "inner")
+        outer = mock.MagicMock(side_effect=lambda: obj.exec(inner))
+
+        # The outer function is executed again, not only the failing inner function
+        self.assertEqual(obj.exec(outer), "inner")
+        self.assertEqual(outer.call_count, 2)
+        mock_connect.assert_called_once()
+
+    def test_exec_reconnected_by_other_thread(self):
+        # The connection has been restored by another thread when the lock has been acquired
+        is_connected = mock.MagicMock(side_effect=[False, True])
+        mock_connect = mock.MagicMock()
+        mock_disconnect = mock.MagicMock()
+        obj = AutoReconnector(is_connected=is_connected, connect=mock_connect, disconnect=mock_disconnect)
+
+        f = get_n_times_function(1, lambda: raise_exception(), lambda: "exec")
+        self.assertEqual(obj.exec(f), "exec")
+        mock_disconnect.assert_not_called()
+        mock_connect.assert_not_called()
+
     def test_max_reconnects(self):
         is_connected = lambda: False
         mock_connect = lambda: False
@@ -0,0 +1,92 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from gobworkflow.storage.spool import Spool
+
+
+class MockException(Exception):
+    pass
+
+
+class TestSpool(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmpdir.name, "spool")
+        self.write = mock.MagicMock()
+        self.spool = Spool("any", self.directory, self.write, max_rows=3)
+
+    def tearDown(self):
+        if self.spool._segment is not None:
+            self.spool._segment.close()
+        self.tmpdir.cleanup()
+
+    def test_empty(self):
+        self.assertFalse(self.spool.pending())
+        self.assertEqual(self.spool.replay(), 0)
+        self.write.assert_not_called()
+
+    @mock.patch("builtins.print")
+    def test_append_replay(self, mock_print):
+        self.spool.append([("row", 1), ("row", 2)])
+        self.assertTrue(self.spool.pending())
+        self.assertEqual(os.listdir(self.directory), ["any-000000000001.seg.tmp"])
+
+        # A full segment is closed and a new segment is started
+        self.spool.append([("row", 3)])
+        self.spool.append([("row", 4)])
+        self.assertEqual(sorted(os.listdir(self.directory)), ["any-000000000001.seg", "any-000000000002.seg.tmp"])
+
+        self.assertEqual(self.spool.replay(), 4)
+        self.write.assert_has_calls([
+            mock.call([("row", 1), ("row", 2), ("row", 3)]),
+            mock.call([("row", 4)]),
+        ])
+        mock_print.assert_called_with("any: replayed 1 rows from any-000000000002.seg")
+        self.assertFalse(self.spool.pending())
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_replay_failure(self):
+        self.spool.append([("row", 1)])
+        self.write.side_effect = MockException
+
+        # The segment is kept for the next replay
+        with self.assertRaises(MockException):
+            self.spool.replay()
+        self.assertTrue(self.spool.pending())
+        self.assertEqual(os.listdir(self.directory), ["any-000000000001.seg"])
+
+        self.write.side_effect = None
+        with mock.patch("builtins.print"):
+            self.assertEqual(self.spool.replay(), 1)
+        self.assertFalse(self.spool.pending())
+
+    @mock.patch("builtins.print")
+    def test_recover(self, mock_print):
+        self.spool.append([("row", 1)])
+        self.spool.append([("row", 2)])
+        self.spool._segment.close()
+        self.spool._segment = None
+
+        # Segments of a previous process are closed and replayed
+        spool = Spool("any", self.directory, self.write, max_rows=3)
+        self.assertTrue(spool.pending())
+        self.assertEqual(spool._sequence, 1)
+        self.assertEqual(spool.replay(), 2)
+        self.write.assert_called_once_with([("row", 1), ("row", 2)])
+
+        # Other spools in the same directory are left untouched
+        Spool("other", self.directory, self.write, max_rows=3).append([("row", 3)])
+        self.assertFalse(spool.pending())
+
+    @mock.patch("builtins.print")
+    def test_truncated_segment(self, mock_print):
+        self.spool.append([("row", 1)])
+        self.spool._segment.write(b"\x80\x05garbage")
+        self.spool._segment.flush()
+
+        self.assertEqual(self.spool.replay(), 1)
+        self.write.assert_called_once_with([("row", 1)])
+        mock_print.assert_any_call(
+            f"WARNING: any segment {os.path.join(self.directory, 'any-000000000001.seg')} is truncated")
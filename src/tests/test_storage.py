@@ -1,12 +1,22 @@
 import datetime
 from unittest import TestCase, mock
 
+from freezegun import freeze_time
+
 import gobworkflow.storage
-from gobcore.model.sa.management import Job, JobStep, Task
+from gobcore.model.sa.management import AuditLog, Job, JobStep, Log, Task
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
 from gobworkflow.storage.storage import connect, migrate_storage, disconnect, is_connected
-from gobworkflow.storage.storage import job_save, job_update, step_save, step_update, get_job_step, job_runs, job_get
-from gobworkflow.storage.storage import save_log, get_services, remove_service, mark_service_dead, update_service, \
-    _update_servicetasks, save_audit_log
+from gobworkflow.storage.storage import job_save, job_update, step_save, step_update, get_job_step, job_runs
+from gobworkflow.storage.storage import save_logs, update_service, sweep_services, _update_servicetasks, \
+    save_audit_logs, _copy_rows, _rollback, LOG_FIELDS, AUDIT_LOG_FIELDS
+from gobworkflow.storage.storage import create_log_partitions, drop_log_partitions, purge_jobs, job_exists, \
+    update_service_timestamps, try_leader_lock, holds_leader_lock, LEADER_LOCK
+from gobworkflow.storage.storage import _receive_job_changes, JOB_CHANGES_CHANNEL, INSTANCE_ID, end_zombie_jobs
+from gobworkflow.storage.storage import unit_of_work, in_unit_of_work, after_commit, job_add_log_counts
+from gobworkflow.storage.cache import LRUCache
+from gobworkflow.storage.job_cache import JobCache, snapshot
 from gobworkflow.storage.storage import task_get, task_save, task_update, task_lock, task_unlock, get_tasks_for_stepid
 
 
@@ -74,6 +84,9 @@ class MockedSession:
     def commit(self):
         pass
 
+    def flush(self):
+        pass
+
     def update(self, *args, **kwargs):
         self.update_args = args
         return 1
@@ -111,7 +124,8 @@ class TestStorage(TestCase):
         gobworkflow.storage.storage.engine = MockedEngine()
         gobworkflow.storage.storage.session = MockedSession()
 
-    def test_update_service(self):
+    @mock.patch("gobworkflow.storage.storage._update_servicetasks")
+    def test_update_service(self, mock_update_servicetasks):
         mockedSession = MockedSession()
         gobworkflow.storage.storage.session = mockedSession
         gobworkflow.storage.storage.Service = MockedService
@@ -129,23 +143,143 @@ class TestStorage(TestCase):
         mockedSession._first = None
         update_service(service, [])
         self.assertEqual(mockedSession._add.name, "AnyService")
+        mock_update_servicetasks.assert_called_with(mockedSession._add, [])
 
         # If the service is found, it should be updated
         mockedSession._first = MockedService(**{"name": "AnyService", "is_alive": None, "timestamp": None})
         update_service(service, [])
         self.assertEqual(mockedSession._first.is_alive, service["is_alive"])
 
+        # Tasks are left unchanged
+        mock_update_servicetasks.reset_mock()
+        update_service(service, None)
+        mock_update_servicetasks.assert_not_called()
+
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_try_leader_lock(self, mock_engine):
+        connection = mock_engine.connect.return_value.execution_options.return_value
+        connection.execute.return_value.scalar.return_value = True
+
+        self.assertEqual(try_leader_lock(), connection)
+        # The connection is not left idle in transaction
+        mock_engine.connect.return_value.execution_options.assert_called_once_with(isolation_level="AUTOCOMMIT")
+        stmt, params = connection.execute.call_args[0]
+        self.assertEqual(str(stmt), "SELECT pg_try_advisory_lock(:lock)")
+        self.assertEqual(params, {"lock": LEADER_LOCK})
+        connection.close.assert_not_called()
+
+        # Lock held by another instance
+        connection.execute.return_value.scalar.return_value = False
+        self.assertIsNone(try_leader_lock())
+        connection.close.assert_called_once()
+
+        # Connection failure
+        connection.execute.side_effect = MockException
+        with self.assertRaises(MockException):
+            try_leader_lock()
+        connection.invalidate.assert_called_once()
+
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_try_leader_lock_role(self, mock_engine):
+        connection = mock_engine.connect.return_value.execution_options.return_value
+        connection.execute.return_value.scalar.return_value = True
+
+        self.assertEqual(try_leader_lock("any role"), connection)
+        stmt, params = connection.execute.call_args[0]
+        self.assertEqual(str(stmt), "SELECT pg_try_advisory_lock(:lock, hashtext(:role))")
+        self.assertEqual(params, {"lock": LEADER_LOCK, "role": "any role"})
+
+    def test_holds_leader_lock(self):
+        connection = mock.MagicMock()
+        self.assertTrue(holds_leader_lock(connection))
+
+        connection.execute.side_effect = MockException
+        self.assertFalse(holds_leader_lock(connection))
+        connection.invalidate.assert_called_once()
+
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_sweep_services(self, mock_engine):
+        connection = mock_engine.begin.return_value.__enter__.return_value
+        connection.execute.return_value.scalar.side_effect = [2, 1]
+
+        result = sweep_services("dead before", "remove before")
+
+        self.assertEqual(result, (2, 1))
+        (mark, mark_params), (remove, remove_params) = [call[0] for call in connection.execute.call_args_list]
+        self.assertIn("UPDATE services SET is_alive = false WHERE is_alive AND timestamp < :before", str(mark))
+        self.assertIn("DELETE FROM service_tasks WHERE service_id IN (SELECT id FROM dead)", str(mark))
+        self.assertEqual(mark_params, {"before": "dead before"})
+        self.assertIn("DELETE FROM services WHERE timestamp < :before", str(remove))
+        self.assertIn("DELETE FROM service_tasks WHERE service_id IN (SELECT id FROM removed)", str(remove))
+        self.assertEqual(remove_params, {"before": "remove before"})
+
+    @freeze_time("2020-06-01")
+    @mock.patch("gobworkflow.storage.storage.job_cache")
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_end_zombie_jobs(self, mock_engine, mock_job_cache):
+        connection = mock_engine.begin.return_value.__enter__.return_value
+        connection.execute.return_value = [(1,), (2,)]
+
+        result = end_zombie_jobs("started before", "any status", exclude_types=("event_produce",))
+
+        self.assertEqual(result, [1, 2])
+        (end, end_params), (notify, notify_params) = [call[0] for call in connection.execute.call_args_list]
+        self.assertIn('UPDATE jobs SET "end" = :now, status = :status', str(end))
+        self.assertIn('WHERE "end" IS NULL AND start < :before AND (type IS NULL OR NOT type = ANY(:exclude_types))',
+                      str(end))
+        self.assertIn('WHERE "end" IS NULL AND jobid IN (SELECT id FROM zombies)', str(end))
+        self.assertEqual(end_params, {
+            "now": datetime.datetime(2020, 6, 1),
+            "status": "any status",
+            "before": "started before",
+            "exclude_types": ["event_produce"],
+        })
+        self.assertIn("SELECT pg_notify(:channel, :instance || ' ' || id)", str(notify))
+        self.assertEqual(notify_params, {"channel": JOB_CHANGES_CHANNEL, "instance": INSTANCE_ID, "ids": [1, 2]})
+        # Ended jobs are no longer active
+        mock_job_cache.evict.assert_has_calls([mock.call(1), mock.call(2)])
+
+        connection.reset_mock()
+        connection.execute.return_value = []
+        self.assertEqual(end_zombie_jobs("started before", "any status"), [])
+        # Nothing to notify
+        self.assertEqual(connection.execute.call_count, 1)
+
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_update_service_timestamps(self, mock_engine):
+        connection = mock_engine.begin.return_value.__enter__.return_value
+
+        update_service_timestamps([])
+        connection.execute.assert_not_called()
+
+        update_service_timestamps([("AnyService", "AnyHost", "any timestamp"), ("OtherService", None, "any time")])
+
+        stmt, params = connection.execute.call_args[0]
+        self.assertIn("UPDATE services s SET timestamp = v.timestamp", str(stmt))
+        self.assertIn("(CAST(:name_1 AS VARCHAR), CAST(:host_1 AS VARCHAR), CAST(:timestamp_1 AS TIMESTAMP))", str(stmt))
+        self.assertIn("s.host IS NOT DISTINCT FROM v.host AND s.timestamp < v.timestamp", str(stmt))
+        self.assertEqual(params, {
+            "name_0": "AnyService", "host_0": "AnyHost", "timestamp_0": "any timestamp",
+            "name_1": "OtherService", "host_1": None, "timestamp_1": "any time",
+        })
+
     @mock.patch("gobworkflow.storage.storage.URL")
     @mock.patch("gobworkflow.storage.storage.migrate_storage")
     @mock.patch("gobworkflow.storage.storage.create_engine")
     def test_connect(self, mock_create, mock_migrate, mock_url):
         result = connect()
 
-        mock_create.assert_called_with(mock_url.create.return_value, connect_args={'sslmode': 'require'})
+        mock_create.assert_called_with(mock_url.create.return_value, connect_args={'sslmode': 'require'}, pool_size=5)
         mock_migrate.assert_called()
         self.assertEqual(result, True)
         self.assertEqual(is_connected(), True)
 
+        # The pool size is kept for reconnects
+        connect(pool_size=20)
+        connect()
+        mock_create.assert_called_with(mock_url.create.return_value, connect_args={'sslmode': 'require'}, pool_size=20)
+        gobworkflow.storage.storage._pool_size = 5
+
     @mock.patch("gobworkflow.storage.storage.DBAPIError", MockException)
     @mock.patch("gobworkflow.storage.storage.create_engine", mock.MagicMock())
     @mock.patch("gobworkflow.storage.storage.migrate_storage", lambda argv: raise_exception(MockException))
@@ -178,6 +312,20 @@ class TestStorage(TestCase):
         self.assertEqual(gobworkflow.storage.storage.engine, None)
         self.assertEqual(is_connected(), False)
 
+    @mock.patch("gobworkflow.storage.storage.job_cache")
+    @mock.patch("gobworkflow.storage.storage.engine")
+    @mock.patch("gobworkflow.storage.storage.session")
+    def test_disconnect_job_changes(self, mock_session, mock_engine, mock_job_cache):
+        job_changes = mock.MagicMock()
+        gobworkflow.storage.storage._job_changes = job_changes
+
+        disconnect()
+
+        # The listening connection is discarded and the cached jobs are no longer kept up to date
+        job_changes.invalidate.assert_called_once_with()
+        self.assertIsNone(gobworkflow.storage.storage._job_changes)
+        mock_job_cache.clear.assert_called_once_with()
+
     @mock.patch("gobworkflow.storage.storage.DBAPIError", MockException)
     @mock.patch("gobworkflow.storage.storage.engine.dispose", lambda: raise_exception(MockException))
     @mock.patch("gobworkflow.storage.storage.session.close", mock.MagicMock())
@@ -199,185 +347,430 @@ class TestStorage(TestCase):
         with self.assertRaises(MockException):
             disconnect()
 
-    def test_is_connected_not_ok(self):
+    @mock.patch("gobworkflow.storage.storage.session")
+    def test_is_connected_not_ok(self, mock_session):
+        mock_session.execute.side_effect = MockException
         result = is_connected()
         self.assertEqual(result, False)
+        # The failed transaction is discarded
+        mock_session.rollback.assert_called_once_with()
 
     @mock.patch("gobworkflow.storage.storage.session.execute", mock.MagicMock())
     def test_is_connected_ok(self):
         result = is_connected()
         self.assertEqual(result, True)
 
-    @mock.patch("gobworkflow.storage.storage.session.add")
-    @mock.patch("gobworkflow.storage.storage.session.commit")
-    def test_save_log(self, mock_commit, mock_add):
-        msg = {
-            "timestamp": "2020-06-20T12:20:20.000"
-        }
-
-        save_log(msg)
-
-        mock_add.assert_called_with(mock.ANY)
-        mock_commit.assert_called_with()
-
-    @mock.patch("gobworkflow.storage.storage.IntegrityError", MockException)
-    @mock.patch("gobworkflow.storage.storage.session.add")
-    @mock.patch("gobworkflow.storage.storage.session.commit")
-    @mock.patch("gobworkflow.storage.storage.session.rollback")
-    def test_save_log_with_exception(self, mock_rollback, mock_commit, mock_add):
-        msg = {
-            "timestamp": "2020-06-20T12:20:20.000"
-        }
-        mock_add.side_effect = lambda r: raise_exception(MockException)
-        save_log(msg)
-        mock_add.assert_called_with(mock.ANY)
-        mock_commit.assert_not_called()
-        mock_rollback.assert_called()
+    @mock.patch("gobworkflow.storage.storage._copy_rows")
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_save_logs(self, mock_engine, mock_copy_rows):
+        connection = mock_engine.begin.return_value.__enter__.return_value
+        records = [("any log",), ("other log",)]
+        connection.execute.return_value.scalar.return_value = 2
+
+        with mock.patch("builtins.print") as mock_print:
+            save_logs(records)
+            mock_print.assert_not_called()
+
+        # The records are written on their own connection in one transaction
+        mock_engine.begin.assert_called_once_with()
+        mock_copy_rows.assert_called_with(connection, Log, "logs_staging", LOG_FIELDS, records)
+        self.assertEqual(connection.execute.call_count, 2)
+        create, move = [str(call[0][0]) for call in connection.execute.call_args_list]
+        self.assertTrue(create.startswith("CREATE TEMPORARY TABLE IF NOT EXISTS logs_staging"))
+        self.assertIn("INSERT INTO logs", move)
+        self.assertIn("EXISTS (SELECT 1 FROM jobs j WHERE j.id = s.jobid)", move)
+        self.assertIn("md5(s::text)::uuid", move)
+        self.assertIn("ON CONFLICT DO NOTHING", move)
+        self.assertIn("INSERT INTO log_counters", move)
+
+        # Records for non-existent jobs or that have already been stored are skipped
+        connection.execute.return_value.scalar.return_value = 1
+        with mock.patch("builtins.print") as mock_print:
+            save_logs(records)
+            mock_print.assert_called_with("Skip 1 log message(s) for non-existent job or already stored")
+
+    @mock.patch("gobworkflow.storage.storage._copy_rows")
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_save_audit_logs(self, mock_engine, mock_copy_rows):
+        connection = mock_engine.begin.return_value.__enter__.return_value
+        records = [("any audit log",)]
+
+        save_audit_logs(records)
+
+        mock_engine.begin.assert_called_once_with()
+        mock_copy_rows.assert_called_with(connection, AuditLog, "audit_logs", AUDIT_LOG_FIELDS, records)
+
+    @mock.patch("gobworkflow.storage.storage._copy_rows")
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_save_logs_failure(self, mock_engine, mock_copy_rows):
+        mock_copy_rows.side_effect = MockException
+
+        # The exception is re-raised, the transaction is rolled back by leaving the begin context
+        for save in [save_logs, save_audit_logs]:
+            mock_engine.begin.return_value.__exit__.reset_mock()
+            with self.assertRaises(MockException):
+                save([("any log",)])
+            exc_type = mock_engine.begin.return_value.__exit__.call_args[0][0]
+            self.assertEqual(exc_type, MockException)
 
     @mock.patch("gobworkflow.storage.storage.session")
-    @mock.patch("gobworkflow.storage.storage.datetime.datetime")
-    @mock.patch("gobworkflow.storage.storage.AuditLog")
-    def test_save_audit_log(self, mock_audit_log, mock_datetime, mock_session):
-        msg = {
-            'timestamp': 'the timestamp',
-            'source': 'the source',
-            'destination': 'the destination',
-            'type': 'the type',
-            'data': 'the data',
-            'request_uuid': 'the uuid',
-        }
-
-        save_audit_log(msg)
-
-        mock_audit_log.assert_called_with(
-            timestamp=mock_datetime.strptime.return_value,
-            source='the source',
-            destination='the destination',
-            type='the type',
-            data='the data',
-            request_uuid='the uuid',
-        )
-
-        mock_session.add.assert_called_with(mock_audit_log.return_value)
-        mock_session.commit_assert_called_once()
+    def test_rollback_failure(self, mock_session):
+        # Rollback failures are reported, the connection might already have been lost
+        mock_session.rollback.side_effect = MockException("any error")
+        with mock.patch("builtins.print") as mock_print:
+            _rollback()
+        mock_print.assert_called_with("Rollback failed: any error")
+
+    def test_copy_rows(self):
+        connection = mock.MagicMock()
+        records = [
+            (datetime.datetime(2020, 6, 20, 12, 20, 20), None, None, "any\ttype", {"a": 1}, None),
+            (None, "any\nsource\\", None, None, None, None),
+        ]
+        cursor = connection.connection.cursor.return_value
+
+        _copy_rows(connection, AuditLog, "audit_logs", AUDIT_LOG_FIELDS, records)
+
+        stmt, data = cursor.copy_expert.call_args[0]
+        self.assertEqual(stmt, "COPY audit_logs (timestamp, source, destination, type, data, request_uuid) FROM STDIN")
+        self.assertEqual(data.getvalue(),
+                         "2020-06-20 12:20:20\t\\N\t\\N\tany\\ttype\t{\"a\": 1}\t\\N\n"
+                         "\\N\tany\\nsource\\\\\t\\N\t\\N\tnull\t\\N\n")
+
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_create_log_partitions(self, mock_engine):
+        connection = mock_engine.begin.return_value.__enter__.return_value
+
+        create_log_partitions([datetime.date(2020, 6, 1), datetime.date(2020, 7, 1)])
+
+        self.assertEqual(connection.execute.call_count, 2)
+        stmt, params = connection.execute.call_args[0]
+        self.assertEqual(str(stmt), "SELECT create_log_partition(:month)")
+        self.assertEqual(params, {"month": datetime.date(2020, 7, 1)})
+
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_drop_log_partitions(self, mock_engine):
+        connection = mock_engine.begin.return_value.__enter__.return_value
+        connection.execute.return_value.fetchall.return_value = [
+            ("logs_2019_11",), ("logs_2019_12",), ("logs_2020_01",), ("logs_default",)
+        ]
+
+        result = drop_log_partitions(datetime.date(2020, 1, 1))
+
+        self.assertEqual(result, ["logs_2019_11", "logs_2019_12"])
+        stmts = [str(call[0][0]) for call in connection.execute.call_args_list[1:]]
+        self.assertEqual(stmts, [
+            "ALTER TABLE logs DETACH PARTITION logs_2019_11",
+            "DROP TABLE logs_2019_11",
+            "ALTER TABLE logs DETACH PARTITION logs_2019_12",
+            "DROP TABLE logs_2019_12",
+        ])
+
+    @mock.patch("gobworkflow.storage.storage.known_jobs")
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_purge_jobs(self, mock_engine, mock_known_jobs):
+        connection = mock_engine.begin.return_value.__enter__.return_value
+        connection.execute.return_value = [(1,), (2,)]
+        before = datetime.datetime(2020, 1, 1)
+
+        result = purge_jobs(before, 10, job_type="import")
+
+        self.assertEqual(result, [1, 2])
+        select_stmt = connection.execute.call_args_list[0][0][0]
+        self.assertIn("jobs.type = %(type_1)s", str(select_stmt.compile(dialect=postgresql.dialect())))
+        self.assertEqual([(str(call[0][0]), call[0][1]) for call in connection.execute.call_args_list[1:]], [
+            ("DELETE FROM tasks WHERE jobid = ANY(:ids)", {"ids": [1, 2]}),
+            ("DELETE FROM logs WHERE jobid = ANY(:ids)", {"ids": [1, 2]}),
+            ("DELETE FROM log_counters WHERE jobid = ANY(:ids)", {"ids": [1, 2]}),
+            ("DELETE FROM jobsteps WHERE jobid = ANY(:ids)", {"ids": [1, 2]}),
+            ("DELETE FROM jobs WHERE id = ANY(:ids)", {"ids": [1, 2]}),
+        ])
+        # Purged jobs no longer exist
+        mock_known_jobs.set.assert_has_calls([mock.call(1, False), mock.call(2, False)])
+
+        # Nothing to purge, other job types
+        connection.execute.reset_mock()
+        connection.execute.return_value = []
+
+        result = purge_jobs(before, 10, exclude_types=["import"])
+
+        self.assertEqual(result, [])
+        connection.execute.assert_called_once()
+        self.assertIn("NOT IN", str(connection.execute.call_args[0][0].compile(dialect=postgresql.dialect())))
 
-
-    def test_update_servicetasks(self):
-        gobworkflow.storage.storage.Service = MockedService
-        gobworkflow.storage.storage.ServiceTask = MockedService
-
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-        # No action on empty lists
-        _update_servicetasks(MockedService(), tasks=[])
-        self.assertEqual(mockedSession._add, None)
-        self.assertEqual(mockedSession._delete, None)
-
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-        # add task when not yet exists
-        _update_servicetasks(MockedService(), tasks=[{"name": "AnyTask"}])
-        self.assertEqual(mockedSession._add.name, "AnyTask")
-
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-        # delete task when it no longer exists
-        _update_servicetasks(MockedService(), tasks=[])
-        self.assertEqual(mockedSession._delete, None)
-
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-        mocked_task = MockedService(**{"name": "AnyTask", "is_alive": None})
-        other_task = MockedService(**{"name": "AnyTask2", "is_alive": None})
-        # update task
-        mockedSession._all = [mocked_task, other_task]
-        _update_servicetasks(MockedService(), tasks=[{"name": "AnyTask", "is_alive": True}])
-        self.assertEqual(mocked_task.is_alive, True)
-
-    def test_get_services(self):
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-        services = get_services()
-        self.assertEqual(services, [])
-
-    @mock.patch("gobworkflow.storage.storage._update_servicetasks")
-    def test_mark_as_dead(self, mock_update_servicetasks):
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-
-        mockedService = MockedService()
-        mark_service_dead(mockedService)
-
-        self.assertEqual(mockedService.is_alive, False)
-        mock_update_servicetasks.assert_called_with(mockedService, [])
-
-    @mock.patch("gobworkflow.storage.storage.ObjectDeletedError", MockException)
-    @mock.patch("gobworkflow.storage.storage._mark_dangling_tasks")
     @mock.patch("gobworkflow.storage.storage.session")
-    def test_update_servicetasks_failure(self, mock_session, mock_mark_dangling_tasks):
-        mocked_service = MockedService()
-
-        mock_mark_dangling_tasks.side_effect = lambda c, s, l: raise_exception(MockException)
-        result = _update_servicetasks(mocked_service, [])
-        self.assertIsNone(result)
-        mock_session.query.assert_called_with(MockedService)
-
-    def test_remove_service(self):
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-
-        mockedService = MockedService()
-        remove_service(mockedService)
+    def test_update_servicetasks(self, mock_session):
+        mock_session.execute.return_value = [("Register", "AnyTask"), ("Remove", "OldTask")]
+        service = MockedService(id=1, name="AnyService")
+
+        with mock.patch("builtins.print") as mock_print:
+            _update_servicetasks(service, tasks=[{"name": "AnyTask", "is_alive": True}, {"name": "OtherTask"}])
+            mock_print.assert_has_calls([
+                mock.call("Register task AnyService.AnyTask"),
+                mock.call("Remove task AnyService.OldTask"),
+            ])
+
+        stmt, params = mock_session.execute.call_args[0]
+        self.assertIn("ON CONFLICT (service_id, name) DO UPDATE SET is_alive = excluded.is_alive", str(stmt))
+        self.assertIn("DELETE FROM service_tasks", str(stmt))
+        self.assertEqual(params, {
+            "service_id": 1,
+            "service_name": "AnyService",
+            "names": ["AnyTask", "OtherTask"],
+            "is_alive": [True, None],
+        })
+        mock_session.commit.assert_not_called()
 
-        self.assertEqual(mockedSession._delete, None)
+        # All tasks are removed when no tasks are reported
+        _update_servicetasks(service, tasks=[])
+        self.assertEqual(mock_session.execute.call_args[0][1]["names"], [])
 
-    @mock.patch("gobworkflow.storage.storage.ObjectDeletedError", MockException)
-    @mock.patch("gobworkflow.storage.storage._update_servicetasks", mock.MagicMock)
+    @mock.patch("gobworkflow.storage.storage.job_cache")
+    @mock.patch("gobworkflow.storage.storage.known_jobs")
+    def test_job_save(self, mock_known_jobs, mock_job_cache):
+        result = job_save({"id": 123, "name": "any name"})
+        self.assertEqual(result.id, 123)
+        self.assertEqual(result.name, "any name")
+        self.assertIsNone(result.end)
+        mock_known_jobs.set.assert_called_with(123, True)
+        mock_job_cache.set_job.assert_called_with(result)
+
+    @mock.patch("gobworkflow.storage.storage.known_jobs", LRUCache(10))
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_job_exists(self, mock_engine):
+        connection = mock_engine.connect.return_value.__enter__.return_value
+        connection.execute.return_value.first.return_value = (1,)
+        self.assertTrue(job_exists(1))
+
+        connection.execute.return_value.first.return_value = None
+        self.assertFalse(job_exists(2))
+
+        # Subsequent calls for an existing job are served from the cache
+        connection.reset_mock()
+        self.assertTrue(job_exists(1))
+        connection.execute.assert_not_called()
+
+        # A job that has not been found is checked again, it may have been created in the meantime
+        connection.execute.return_value.first.return_value = (2,)
+        self.assertTrue(job_exists(2))
+        connection.execute.assert_called_once()
+
+    @mock.patch("gobworkflow.storage.storage._check_jobs_after", 0)
+    @mock.patch("gobworkflow.storage.storage.known_jobs", LRUCache(10))
+    @mock.patch("gobworkflow.storage.storage.time.monotonic")
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_job_exists_connection_lost(self, mock_engine, mock_monotonic):
+        mock_monotonic.return_value = 100
+        mock_engine.connect.side_effect = DBAPIError("any statement", {}, Exception("any error"))
+
+        # A job that cannot be checked is assumed to exist
+        with mock.patch("builtins.print") as mock_print:
+            self.assertTrue(job_exists(1))
+        mock_print.assert_called_once()
+
+        # The storage is not queried until the reconnect interval has passed
+        mock_engine.connect.reset_mock()
+        mock_monotonic.return_value = 159
+        self.assertTrue(job_exists(2))
+        mock_engine.connect.assert_not_called()
+
+        mock_engine.connect.side_effect = None
+        mock_engine.connect.return_value.__enter__.return_value.execute.return_value.first.return_value = None
+        mock_monotonic.return_value = 160
+        self.assertFalse(job_exists(2))
+
+    @mock.patch("gobworkflow.storage.storage._check_jobs_after", 0)
+    @mock.patch("gobworkflow.storage.storage.known_jobs", LRUCache(10))
+    @mock.patch("gobworkflow.storage.storage.engine", None)
+    def test_job_exists_not_connected(self):
+        # While reconnecting there is no engine, the job is assumed to exist
+        self.assertTrue(job_exists(1))
+
+    @mock.patch("gobworkflow.storage.storage.job_cache")
     @mock.patch("gobworkflow.storage.storage.session")
-    def test_remove_service_concurrent(self, mock_session):
-        mock_session.query.side_effect = lambda s: raise_exception(MockException)
-        mockedService = MockedService()
-        remove_service(mockedService)
-        mock_session.commit.assert_not_called()
-
-    def test_job_save(self):
-        result = job_save({"name": "any name"})
-        self.assertIsInstance(result, Job)
+    def test_job_update(self, mock_session, mock_job_cache):
+        row = mock_session.execute.return_value.first.return_value
+        row._mapping = {"id": 123, "end": "any end"}
+
+        result = job_update({"id": 123, "end": "any end"})
+        self.assertEqual(result, snapshot({"id": 123, "end": "any end"}))
+
+        (stmt,), (notify, params) = [call[0] for call in mock_session.execute.call_args_list]
+        stmt = str(stmt.compile(dialect=postgresql.dialect()))
+        self.assertIn("UPDATE jobs SET", stmt)
+        self.assertIn("RETURNING jobs.id", stmt)
+        self.assertEqual(str(notify), "SELECT pg_notify(:channel, :payload)")
+        self.assertEqual(params, {"channel": JOB_CHANGES_CHANNEL, "payload": f"{INSTANCE_ID} 123"})
+        mock_session.commit.assert_called_once()
+        mock_job_cache.set_job.assert_called_with(result)
+
+        # Job does not exist
+        mock_session.execute.return_value.first.return_value = None
+        mock_job_cache.reset_mock()
+        self.assertIsNone(job_update({"id": 124, "end": "any end"}))
+        mock_job_cache.set_job.assert_not_called()
+
+    @mock.patch("gobworkflow.storage.storage.job_cache")
+    @mock.patch("gobworkflow.storage.storage.session")
+    def test_job_add_log_counts(self, mock_session, mock_job_cache):
+        row = mock_session.execute.return_value.first.return_value
+        row._mapping = {"id": 123, "end": None, "log_counts": {"data_warnings": 7}}
+
+        result = job_add_log_counts(123, {"data_warnings": 5})
+        self.assertEqual(result.log_counts, {"data_warnings": 7})
+
+        (stmt, params), (notify, notify_params) = [call[0] for call in mock_session.execute.call_args_list]
+        self.assertIn("UPDATE jobs SET log_counts", str(stmt))
+        self.assertIn("sum(CAST(value AS BIGINT))", str(stmt))
+        self.assertEqual(params, {"id": 123, "log_counts": '{"data_warnings": 5}'})
+        self.assertEqual(notify_params["payload"], f"{INSTANCE_ID} 123")
+        mock_session.commit.assert_called_once()
+        mock_job_cache.set_job.assert_called_with(result)
+
+        # Job does not exist
+        mock_session.execute.return_value.first.return_value = None
+        mock_job_cache.reset_mock()
+        self.assertIsNone(job_add_log_counts(124, {"data_warnings": 5}))
+        mock_job_cache.set_job.assert_not_called()
+
+    @mock.patch("gobworkflow.storage.storage.job_cache")
+    def test_step_save(self, mock_job_cache):
+        result = step_save({"id": 123, "jobid": 1, "name": "any name"})
         self.assertEqual(result.name, "any name")
+        mock_job_cache.set_step.assert_called_with(result)
 
-    def test_job_update(self):
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-        mockedSession.get = lambda id: Job()
-
-        result = job_update({"id": 123})
-        self.assertIsInstance(result, Job)
-        self.assertEqual(result.id, 123)
+    @mock.patch("gobworkflow.storage.storage.job_cache")
+    @mock.patch("gobworkflow.storage.storage.session")
+    def test_step_update(self, mock_session, mock_job_cache):
+        row = mock_session.execute.return_value.first.return_value
+        row._mapping = {"id": 123, "jobid": 1, "status": "any status"}
+
+        result = step_update({"id": 123, "status": "any status"})
+        self.assertEqual(result, snapshot({"id": 123, "jobid": 1, "status": "any status"}))
+        stmt = mock_session.execute.call_args_list[0][0][0]
+        self.assertIn("UPDATE jobsteps SET", str(stmt.compile(dialect=postgresql.dialect())))
+        self.assertEqual(mock_session.execute.call_args[0][1]["payload"], f"{INSTANCE_ID} 1")
+        mock_session.commit.assert_called_once()
+        mock_job_cache.set_step.assert_called_with(result)
+
+        # Step does not exist
+        mock_session.execute.return_value.first.return_value = None
+        mock_session.reset_mock()
+        mock_job_cache.reset_mock()
+        self.assertIsNone(step_update({"id": 124, "status": "any status"}))
+        # The transaction is ended, the session is not left idle in transaction
+        mock_session.commit.assert_called_once()
+        mock_job_cache.set_step.assert_not_called()
+
+    @mock.patch("gobworkflow.storage.storage._receive_job_changes")
+    @mock.patch("gobworkflow.storage.storage.job_cache", JobCache(10))
+    @mock.patch("gobworkflow.storage.storage.session")
+    def test_get_job_step(self, mock_session, mock_receive):
+        mock_session.query.return_value.get.side_effect = [Job(id=1), JobStep(id=2, jobid=1, name="any step")]
 
-    def test_job_get(self):
-        result = job_get('someid')
-        self.assertEqual('someid', result)
+        job, step = get_job_step(1, 2)
+        self.assertEqual(job.id, 1)
+        self.assertEqual(step.name, "any step")
 
-    def test_step_save(self):
-        result = step_save({"name": "any name"})
-        self.assertIsInstance(result, JobStep)
-        self.assertEqual(result.name, "any name")
+        # Subsequent results of the step are handled without reading the database
+        mock_session.reset_mock()
+        self.assertEqual(get_job_step(1, 2), (job, step))
+        mock_session.query.assert_not_called()
+        self.assertEqual(mock_receive.call_count, 2)
 
-    def test_step_update(self):
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-        mockedSession.get = lambda id: JobStep()
+        mock_session.query.return_value.get.side_effect = [None, None]
+        self.assertEqual(get_job_step(3, 4), (None, None))
 
-        result = step_update({"id": 123})
-        self.assertIsInstance(result, JobStep)
-        self.assertEqual(result.id, 123)
+    @mock.patch("gobworkflow.storage.storage.job_cache")
+    @mock.patch("gobworkflow.storage.storage.session")
+    def test_unit_of_work(self, mock_session, mock_job_cache):
+        mock_session.execute.return_value.first.return_value._mapping = {"id": 123, "jobid": 1, "end": None}
+        committed = mock.MagicMock()
+
+        with unit_of_work():
+            job_update({"id": 1, "status": "any status"})
+            step_save({"id": 123, "jobid": 1, "name": "any name"})
+            step_update({"id": 123, "status": "any status"})
+            with unit_of_work():
+                after_commit(committed, "any arg")
+            # Changes are flushed, not committed
+            mock_session.commit.assert_not_called()
+            committed.assert_not_called()
+            mock_job_cache.set_step.assert_not_called()
+
+        # One commit for the whole unit of work
+        mock_session.commit.assert_called_once()
+        committed.assert_called_once_with("any arg")
+        mock_job_cache.set_job.assert_called_once()
+        self.assertEqual(mock_job_cache.set_step.call_count, 2)
+
+        # Outside a unit of work every function commits and after_commit functions are executed immediately
+        mock_session.reset_mock()
+        committed.reset_mock()
+        step_update({"id": 123, "status": "any status"})
+        mock_session.commit.assert_called_once()
+        after_commit(committed)
+        committed.assert_called_once_with()
+
+        # A failing unit of work is rolled back
+        mock_session.reset_mock()
+        committed.reset_mock()
+        with self.assertRaises(MockException):
+            with unit_of_work():
+                after_commit(committed)
+                raise MockException
+        mock_session.rollback.assert_called_once()
+        mock_session.commit.assert_not_called()
+        committed.assert_not_called()
 
-    def test_get_job_step(self):
-        mockedSession = MockedSession()
-        gobworkflow.storage.storage.session = mockedSession
-        job, step = get_job_step(1, 2)
-        self.assertEqual(job, 1)
-        self.assertEqual(step, 2)
+    @mock.patch("gobworkflow.storage.storage.session")
+    def test_in_unit_of_work(self, mock_session):
+        mock_func = mock.MagicMock(return_value="any result")
+        func = in_unit_of_work(mock_func)
+
+        msg = {"header": {"jobid": 1}, "contents": ["any content"]}
+        self.assertEqual(func(msg, "any arg"), "any result")
+        mock_func.assert_called_once_with(msg, "any arg")
+        mock_session.commit.assert_called_once()
+
+        # The function gets a copy of the message
+        msg_copy = mock_func.call_args[0][0]
+        self.assertIsNot(msg_copy, msg)
+        self.assertIsNot(msg_copy["header"], msg["header"])
+
+    @mock.patch("gobworkflow.storage.storage._job_changes", None)
+    @mock.patch("gobworkflow.storage.storage.job_cache")
+    @mock.patch("gobworkflow.storage.storage.engine")
+    def test_receive_job_changes(self, mock_engine, mock_job_cache):
+        connection = mock_engine.connect.return_value.execution_options.return_value
+        dbapi_connection = connection.connection.dbapi_connection
+        dbapi_connection.notifies = [
+            mock.MagicMock(payload="other 12"),
+            mock.MagicMock(payload=f"{INSTANCE_ID} 13"),
+        ]
+
+        _receive_job_changes()
+
+        mock_engine.connect.return_value.execution_options.assert_called_with(isolation_level="AUTOCOMMIT")
+        self.assertEqual(str(connection.execute.call_args[0][0]), f"LISTEN {JOB_CHANGES_CHANNEL}")
+        # Changes may have been missed before listening
+        mock_job_cache.clear.assert_called_once()
+        dbapi_connection.poll.assert_called_once()
+        # Only the changes of other instances are evicted
+        mock_job_cache.evict.assert_called_once_with(12)
+        self.assertEqual(dbapi_connection.notifies, [])
+
+        # The connection is reused
+        _receive_job_changes()
+        mock_engine.connect.assert_called_once()
+
+        # The cache is cleared when the connection fails
+        mock_job_cache.reset_mock()
+        dbapi_connection.poll.side_effect = MockException
+        _receive_job_changes()
+        connection.invalidate.assert_called_once()
+        mock_job_cache.clear.assert_called_once()
+        self.assertIsNone(gobworkflow.storage.storage._job_changes)
 
     def test_task_get(self):
         result = task_get('someid')
@@ -559,6 +952,7 @@ class TestJobRuns(TestCase):
             .filter_by.return_value \
             .filter.return_value \
             .filter.return_value \
+            .filter.return_value \
             .order_by.return_value \
             .first.return_value = result_job
 
@@ -585,8 +979,13 @@ class TestJobRuns(TestCase):
         mock_filter_args.filter.assert_called_with(mock_job.end == None)
         mock_filter_end = mock_filter_args.filter.return_value
 
-        mock_filter_end.order_by.assert_called_with(mock_job.start.desc.return_value)
-        mock_filter_order = mock_filter_end.order_by.return_value
+        fingerprint = mock_filter_end.filter.call_args[0][0]
+        self.assertEqual(str(fingerprint), "jobs.fingerprint = md5(:fingerprint)")
+        self.assertEqual(fingerprint.compile().params, {"fingerprint": "import:cat:col:attr"})
+        mock_filter_fingerprint = mock_filter_end.filter.return_value
+
+        mock_filter_fingerprint.order_by.assert_called_with(mock_job.start.desc.return_value)
+        mock_filter_order = mock_filter_fingerprint.order_by.return_value
 
         mock_filter_order.first.assert_called()
         mock_filter_order.first.result_value = result_job
@@ -0,0 +1,122 @@
+import threading
+from unittest import TestCase, mock
+
+from gobworkflow.worker_pool import WorkerPool, with_worker_pools
+
+
+class MockException(Exception):
+    pass
+
+
+class TestWorkerPool(TestCase):
+
+    def test_dispatch(self):
+        pool = WorkerPool("AnyPool", 3, 10)
+
+        pool.dispatch("any handler", {"header": {"jobid": 4}})
+        pool.dispatch("other handler", {"jobid": 4, "stepid": 1})
+        pool.dispatch("any handler", {"header": {"jobid": 5}})
+        pool.dispatch("any handler", {"header": {}})
+        pool.dispatch("other handler", {})
+
+        # Messages of one job are queued for the same worker, messages without a job for the first worker
+        queued = [[messages.get_nowait() for _ in range(messages.qsize())] for messages in pool._queues]
+        self.assertEqual(queued, [
+            [("any handler", {"header": {}}), ("other handler", {})],
+            [("any handler", {"header": {"jobid": 4}}), ("other handler", {"jobid": 4, "stepid": 1})],
+            [("any handler", {"header": {"jobid": 5}})],
+        ])
+
+    def test_handler(self):
+        pool = WorkerPool("AnyPool", 1, 10)
+
+        pool.handler("any handler")({"id": 1})
+        self.assertEqual(pool._queues[0].get_nowait(), ("any handler", {"id": 1}))
+
+    @mock.patch("gobworkflow.worker_pool.atexit.register")
+    def test_start_stop(self, mock_register):
+        handled = []
+        lock = threading.Lock()
+
+        def handler(msg):
+            with lock:
+                handled.append(msg["header"]["jobid"])
+
+        pool = WorkerPool("AnyPool", 2, 2)
+        pool.start()
+        mock_register.assert_called_once_with(pool.stop)
+        self.assertEqual([thread.name for thread in pool._workers], ["AnyPool0", "AnyPool1"])
+
+        # Started once
+        pool.start()
+        self.assertEqual(len(pool._workers), 2)
+
+        for jobid in range(10):
+            pool.dispatch(handler, {"header": {"jobid": jobid}})
+        pool.stop()
+
+        # All queued messages are handled before the workers stop
+        self.assertEqual(sorted(handled), list(range(10)))
+        self.assertEqual(pool._workers, [])
+
+    @mock.patch("gobworkflow.worker_pool.traceback.print_exc")
+    @mock.patch("builtins.print")
+    def test_work(self, mock_print, mock_print_exc):
+        error = MockException("any error")
+        handler = mock.MagicMock(side_effect=[error, None])
+        on_error = mock.MagicMock()
+        pool = WorkerPool("AnyPool", 1, 10, on_error)
+
+        for item in [(handler, {"jobid": 1}), (handler, {"jobid": 2}), None]:
+            pool._queues[0].put(item)
+        pool._work(pool._queues[0])
+
+        # A failing message is reported and does not stop the worker
+        handler.assert_has_calls([mock.call({"jobid": 1}), mock.call({"jobid": 2})])
+        mock_print.assert_called_once_with("ERROR: AnyPool handler failed for job 1: any error")
+        mock_print_exc.assert_called_once_with()
+        on_error.assert_called_once_with({"jobid": 1}, error)
+
+    @mock.patch("gobworkflow.worker_pool.traceback.print_exc", mock.MagicMock())
+    @mock.patch("builtins.print")
+    def test_report_failure(self, mock_print):
+        handler = mock.MagicMock(side_effect=MockException("any error"))
+
+        # Without on_error the failure is only printed
+        WorkerPool("AnyPool", 1, 10)._handle(handler, {"jobid": 1})
+        mock_print.assert_called_once()
+
+        # A failing report does not stop the worker
+        mock_print.reset_mock()
+        on_error = mock.MagicMock(side_effect=MockException("report error"))
+        WorkerPool("AnyPool", 1, 10, on_error)._handle(handler, {"jobid": 1})
+        mock_print.assert_called_with("ERROR: AnyPool failure of job 1 not reported: report error")
+
+    @mock.patch("gobworkflow.worker_pool.WorkerPool")
+    def test_with_worker_pools(self, mock_pool):
+        services = {
+            "any service": {"queue": "any queue", "handler": "any handler"},
+            "pooled service": {"queue": "pooled queue", "handler": "pooled handler"},
+            "other pooled service": {"queue": "other pooled queue", "handler": "other pooled handler"},
+            "report service": {"queue": "report queue", "handler": "report handler", "report": {"key": "any key"}},
+        }
+        pools = {
+            "any pool": (4, ["pooled service", "other pooled service", "unknown service"]),
+            "report pool": (2, ["report service"]),
+            "no workers": (0, ["any service"]),
+        }
+        mock_pool.return_value.handler.side_effect = lambda handler: f"dispatch to {handler}"
+
+        result = with_worker_pools(services, pools, 10, on_error="any on_error")
+
+        # The services of a pool share the workers of the pool
+        mock_pool.assert_called_once_with("any pool", 4, 10, "any on_error")
+        mock_pool.return_value.start.assert_called_once()
+        self.assertEqual(result, {
+            "any service": {"queue": "any queue", "handler": "any handler"},
+            "pooled service": {"queue": "pooled queue", "handler": "dispatch to pooled handler"},
+            "other pooled service": {"queue": "other pooled queue", "handler": "dispatch to other pooled handler"},
+            "report service": services["report service"],
+        })
+        # The service definitions are not changed
+        self.assertEqual(services["pooled service"]["handler"], "pooled handler")
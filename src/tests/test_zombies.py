@@ -0,0 +1,29 @@
+import datetime
+from unittest import TestCase, mock
+
+from freezegun import freeze_time
+from gobcore.status.heartbeat import STATUS_FAIL
+
+from gobworkflow.zombies import sweep_zombies
+
+
+@mock.patch("builtins.print", mock.MagicMock())
+class TestZombies(TestCase):
+
+    @freeze_time("2020-06-01 12:00")
+    @mock.patch("gobworkflow.zombies.end_zombie_jobs")
+    @mock.patch("gobworkflow.zombies.WORKFLOWS", {
+        "import": {"start": "import_start"},
+        "export": {"start": "export_start", "allow_start_new_when_zombie": True},
+        "event_produce": {"start": "event_produce_start", "allow_start_new_when_zombie": False},
+    })
+    @mock.patch("gobworkflow.zombies.ZOMBIE_JOB_HOURS", 12)
+    def test_sweep_zombies(self, mock_end_zombie_jobs):
+        mock_end_zombie_jobs.return_value = [1, 2]
+
+        result = sweep_zombies()
+
+        self.assertEqual(result, [1, 2])
+        mock_end_zombie_jobs.assert_called_with(
+            datetime.datetime(2020, 6, 1), STATUS_FAIL, exclude_types=["event_produce"]
+        )
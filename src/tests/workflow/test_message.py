@@ -0,0 +1,30 @@
+from unittest import TestCase
+
+from gobworkflow.workflow.message import copy_message, with_header
+
+
+class TestMessage(TestCase):
+
+    def test_copy_message(self):
+        msg = {"header": {"a": 1}, "contents": [{"any": "content"}]}
+
+        msg_copy = copy_message(msg)
+        msg_copy["header"]["b"] = 2
+        msg_copy["summary"] = {}
+
+        self.assertEqual(msg, {"header": {"a": 1}, "contents": [{"any": "content"}]})
+        self.assertEqual(msg_copy, {"header": {"a": 1, "b": 2}, "contents": [{"any": "content"}], "summary": {}})
+        self.assertIs(msg_copy["contents"], msg["contents"])
+
+        self.assertEqual(copy_message({"contents": []}), {"contents": []})
+
+    def test_with_header(self):
+        msg = {"header": {"a": 1}, "contents": [{"any": "content"}]}
+
+        result = with_header(msg, a=2, b=3)
+
+        self.assertEqual(result, {"header": {"a": 2, "b": 3}, "contents": [{"any": "content"}]})
+        self.assertEqual(msg["header"], {"a": 1})
+        self.assertIs(result["contents"], msg["contents"])
+
+        self.assertEqual(with_header({}, a=1), {"header": {"a": 1}})
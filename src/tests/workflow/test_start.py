@@ -10,10 +10,15 @@ class TestStart(TestCase):
 
     @mock.patch('gobworkflow.workflow.start.publish')
     def testStartStep(self, mock_publish):
-        msg = "any message"
+        msg = {"header": {"any": "header"}}
         start.start_step("step", msg)
         mock_publish.assert_called_with(WORKFLOW_EXCHANGE, "step.request", msg)
 
+        # The message is published as it is at the time the step is started
+        published_msg = mock_publish.call_args[0][2]
+        msg["header"]["any"] = "changed header"
+        self.assertEqual(published_msg, {"header": {"any": "header"}})
+
     @mock.patch('gobworkflow.workflow.start.publish')
     def testStartWorkflow(self, mock_publish):
         msg = {}
@@ -90,19 +90,39 @@ class TestWorkflowTreeNode(TestCase):
     def test_get_node(self):
         wf = WorkflowTreeNode('my name')
         self.assertEqual(wf, wf.get_node('my name'))
+        self.assertIsNone(wf.get_node('your name'))
 
-        next1 = MagicMock()
-        next1.node.get_node.return_value = None
-        next2 = MagicMock()
-        next2.node.get_node.return_value = next2
-        wf.next = [next1, next2]
+        node1 = WorkflowTreeNode('node 1')
+        node2 = WorkflowTreeNode('your name')
+        node3 = WorkflowTreeNode('your name')
+        node1.append_node(node3)
+        wf.append_node(node1)
+        wf.append_node(node2)
 
-        self.assertEqual(next2, wf.get_node('your name'))
-        next1.node.get_node.assert_called_with('your name')
-        next2.node.get_node.assert_called_with('your name')
+        # First node in depth-first order
+        self.assertEqual(node3, wf.get_node('your name'))
+        self.assertEqual(node1, wf.get_node('node 1'))
 
-        next2.node.get_node.return_value = None
-        self.assertIsNone(wf.get_node('your name'))
+        # The index is built once
+        node1.next = []
+        self.assertEqual(node3, wf.get_node('your name'))
+
+        wf.append_to_names('appended')
+        self.assertEqual(wf, wf.get_node('my name_appended'))
+
+    def test_build_index(self):
+        wf = WorkflowTreeNode('my name')
+        node = WorkflowTreeNode('node 1')
+        wf.append_node(node)
+
+        def add_to_index(index):
+            # The index is not visible to other threads while it is built
+            self.assertIsNone(wf._index)
+            index['my name'] = wf
+
+        with patch.object(wf, '_add_to_index', side_effect=add_to_index):
+            self.assertEqual(wf.build_index(), {'my name': wf})
+        self.assertEqual(wf._index, {'my name': wf})
 
     @patch("gobworkflow.workflow.tree.NextStep")
     def test_append_node(self, mock_next_step):
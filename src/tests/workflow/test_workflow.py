@@ -4,7 +4,9 @@ from unittest import TestCase, mock
 
 from gobworkflow.workflow.config import START
 from gobworkflow.workflow.start import END_OF_WORKFLOW
-from gobworkflow.workflow.workflow import Workflow
+import gobworkflow.workflow.workflow
+from gobworkflow.workflow.workflow import Workflow, compile_workflows
+from gobworkflow.storage.storage import unit_of_work
 
 WORKFLOWS = {
     "Workflow": {
@@ -42,6 +44,38 @@ class TestWorkflow(TestCase):
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
     def setUp(self):
         self.workflow = Workflow("Workflow", "Step")
+        self.clear_compiled_workflows()
+
+    def tearDown(self):
+        self.clear_compiled_workflows()
+
+    def clear_compiled_workflows(self):
+        gobworkflow.workflow.workflow._workflow_trees.clear()
+        gobworkflow.workflow.workflow._dynamic_workflow_trees = \
+            gobworkflow.workflow.workflow.LRUCache(10)
+
+    @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
+    def test_compile_workflows(self, mock_tree):
+        compile_workflows()
+        mock_tree.from_dict.assert_called_once_with(WORKFLOWS["Workflow"])
+        # The tree is indexed before it is shared
+        mock_tree.from_dict.return_value.build_index.assert_called_once_with()
+
+        # Workflows are compiled once
+        wf = Workflow('Workflow', 'Step')
+        mock_tree.from_dict.assert_called_once()
+        self.assertEqual(mock_tree.from_dict.return_value.get_node.return_value, wf._step)
+
+    @mock.patch("gobworkflow.workflow.workflow.Workflow._build_dynamic_workflow")
+    def test_dynamic_workflow_compiled_once(self, mock_build_dynamic_workflow, mock_tree):
+        steps = [{'type': 'workflow', 'workflow': 'wf1', 'header': {'a': 1, 'b': 2}}]
+        Workflow('Workflow', dynamic_workflow_steps=steps)
+        Workflow('Workflow', dynamic_workflow_steps=[{'type': 'workflow', 'header': {'b': 2, 'a': 1}, 'workflow': 'wf1'}])
+        mock_build_dynamic_workflow.assert_called_once_with(steps)
+        mock_build_dynamic_workflow.return_value.build_index.assert_called_once_with()
+
+        Workflow('Workflow', dynamic_workflow_steps=[{'type': 'workflow', 'workflow': 'wf2'}])
+        self.assertEqual(mock_build_dynamic_workflow.call_count, 2)
 
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
     def test_create(self, mock_tree):
@@ -150,6 +184,9 @@ class TestWorkflow(TestCase):
         def get_leafs(self):
             return self.leafs
 
+        def build_index(self):
+            self.indexed = True
+
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", DYNAMIC_WORKFLOWS)
     def test_build_dynamic_workflow(self, mock_tree):
         dynamic = [
@@ -255,6 +292,27 @@ class TestWorkflow(TestCase):
         self.workflow.reject.assert_called_once()
         job_start.assert_called_with("Workflow", {'header': {'process_id': mock.ANY}})
 
+    @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
+    @mock.patch("gobworkflow.workflow.workflow.job_runs", lambda j, k, **kwargs: True)
+    @mock.patch("gobworkflow.workflow.workflow.job_start")
+    def test_start_retry_original_msg(self, job_start, mock_tree):
+        def start(job_type, msg):
+            msg["header"]["jobid"] = "any job"
+            return {"id": "any job"}
+
+        job_start.side_effect = start
+        self.workflow.reject = mock.MagicMock()
+        self.workflow.retry_or_fail = mock.MagicMock()
+        contents = [{"any": "content"}]
+
+        self.workflow.start({"header": {"catalogue": "any catalogue"}, "contents": contents}, 10)
+
+        # The original message is retried, its contents are not copied
+        msg, retry_time = self.workflow.retry_or_fail.call_args[0]
+        self.assertEqual(msg, {"header": {"catalogue": "any catalogue"}, "contents": contents})
+        self.assertIs(msg["contents"], contents)
+        self.assertEqual(retry_time, 10)
+
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
     @mock.patch("gobworkflow.workflow.workflow.job_runs", lambda j, k, **kwargs: False)
     @mock.patch("gobworkflow.workflow.workflow.logger", mock.MagicMock())
@@ -280,50 +338,31 @@ class TestWorkflow(TestCase):
 
         job_start.assert_called_with('Workflow', {'summary': 'any summary', 'contents': [], 'header': {}})
 
-    @mock.patch("gobworkflow.workflow.workflow.job_update")
-    def test_update_job_log_counts(self, mock_job_update, mock_tree):
-        job = type('Job', (), {
-            'id': 'jobid',
-            'log_counts': {
-                'data_warnings': 5,
-                'data_errors': 2
-            }
-        })
-        log_counts = {
-            'data_warnings': 2,
-            'data_info': 1
-        }
-        self.workflow._update_job_log_counts(job, log_counts)
-        mock_job_update.assert_called_with({
-            'id': 'jobid',
-            'log_counts': {
-                'data_warnings': 7,
-                'data_errors': 2,
-                'data_info': 1,
-            }
-        })
-
     @mock.patch("gobworkflow.workflow.workflow.logger", mock.MagicMock())
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
     @mock.patch("gobworkflow.workflow.workflow.job_end")
-    @mock.patch("gobworkflow.workflow.workflow.job_get")
-    def test_handle_result_without_next(self, job_get, job_end, mock_tree):
-        self.workflow._update_job_log_counts = mock.MagicMock()
+    @mock.patch("gobworkflow.workflow.workflow.job_add_log_counts")
+    def test_handle_result_without_next(self, job_add_log_counts, job_end, mock_tree):
         self.workflow._function = mock.MagicMock()
         handler = self.workflow.handle_result()
-        handler({"header": {}, "condition": False, "summary": {"log_counts": {"data_warnings": 5}}})
+        handler({"header": {"jobid": 1}, "condition": False, "summary": {"log_counts": {"data_warnings": 5}}})
 
         self.workflow._function.assert_not_called()
         job_end.assert_called()
-        self.workflow._update_job_log_counts.assert_called_with(job_get(), {"data_warnings": 5})
+        job_add_log_counts.assert_called_with(1, {"data_warnings": 5})
+
+        # No log counts to add
+        job_add_log_counts.reset_mock()
+        handler({"header": {"jobid": 1}, "condition": False, "summary": {}})
+        job_add_log_counts.assert_not_called()
 
     @mock.patch("gobworkflow.workflow.workflow.logger")
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
     @mock.patch("gobworkflow.workflow.workflow.publish")
     @mock.patch("gobworkflow.workflow.workflow.job_end")
-    @mock.patch("gobworkflow.workflow.workflow.job_get")
-    def test_handle_result_without_next_on_workflow_complete(self, job_get, job_end, mock_publish, mock_logger, mock_tree):
-        self.workflow._update_job_log_counts = mock.MagicMock()
+    @mock.patch("gobworkflow.workflow.workflow.job_add_log_counts")
+    def test_handle_result_without_next_on_workflow_complete(self, job_add_log_counts, job_end, mock_publish,
+                                                              mock_logger, mock_tree):
         self.workflow._function = mock.MagicMock()
         msg = {"header": {'on_workflow_complete': {'key': 'the key', 'exchange': 'the exchange'}}, "condition": False, "summary": {"log_counts": {"data_warnings": 5}}}
         handler = self.workflow.handle_result()
@@ -331,7 +370,7 @@ class TestWorkflow(TestCase):
 
         self.workflow._function.assert_not_called()
         job_end.assert_called()
-        self.workflow._update_job_log_counts.assert_called_with(job_get(), {"data_warnings": 5})
+        job_add_log_counts.assert_called_with(None, {"data_warnings": 5})
         mock_publish.assert_called_with('the exchange', 'the key', msg)
 
         # Test invalid dict
@@ -341,11 +380,31 @@ class TestWorkflow(TestCase):
         mock_publish.assert_not_called()
         mock_logger.error.assert_called_once_with("on_workflow_complete should be a dict with keys 'exchange' and 'key'")
 
+    @mock.patch("gobworkflow.workflow.workflow.logger", mock.MagicMock())
+    @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
+    @mock.patch("gobworkflow.workflow.workflow.publish")
+    @mock.patch("gobworkflow.storage.storage._receive_job_changes", mock.MagicMock())
+    @mock.patch("gobworkflow.storage.storage.job_cache", mock.MagicMock())
+    @mock.patch("gobworkflow.storage.storage.session")
+    def test_handle_result_unit_of_work(self, mock_session, mock_publish, mock_tree):
+        mock_session.execute.return_value.first.return_value._mapping = {"id": 1, "end": None}
+        msg = {
+            "header": {"jobid": 1, "on_workflow_complete": {"exchange": "the exchange", "key": "the key"}},
+            "summary": {"log_counts": {"data_warnings": 5}},
+        }
+
+        with unit_of_work():
+            self.workflow.handle_result()(msg)
+            # Messages are published when the job has been committed
+            mock_publish.assert_not_called()
+
+        # The log counts are added and the job is ended in one commit
+        mock_session.commit.assert_called_once()
+        mock_publish.assert_called_once_with("the exchange", "the key", msg)
+
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
     @mock.patch("gobworkflow.workflow.workflow.step_start")
-    @mock.patch("gobworkflow.workflow.workflow.job_get")
-    def test_handle_result_with_next(self, job_get, step_start, mock_tree):
-        self.workflow._update_job_log_counts = mock.MagicMock()
+    def test_handle_result_with_next(self, step_start, mock_tree):
         handler = self.workflow.handle_result()
         handler({"header": {}, "condition": True})
 
@@ -354,9 +413,7 @@ class TestWorkflow(TestCase):
 
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
     @mock.patch("gobworkflow.workflow.workflow.step_start", mock.MagicMock())
-    @mock.patch("gobworkflow.workflow.workflow.job_get")
-    def test_handle_result_with_multiple_nexts(self, job_get, mock_tree):
-        self.workflow._update_job_log_counts = mock.MagicMock()
+    def test_handle_result_with_multiple_nexts(self, mock_tree):
         handler = self.workflow.handle_result()
         handler({"header": {}, "next": True})
 
@@ -402,6 +459,7 @@ class TestWorkflow(TestCase):
         self.workflow.end_of_workflow.assert_called_with(msg)
 
     @mock.patch("gobworkflow.workflow.workflow.WORKFLOWS", WORKFLOWS)
+    @mock.patch("gobworkflow.workflow.workflow.job_add_log_counts", mock.MagicMock())
     def test_handle_result_changed_workflow(self, mock_tree):
         # When _workflow_changed is set to True, handle_result should run _step instead of the next step
         wf = Workflow('Workflow', 'Step')